@@ -1,27 +1,125 @@
-from flask import Flask, request, jsonify
+from flask import Flask, Response, g, request, jsonify
 from flask_cors import CORS
 import telebot
 import requests
 import sqlite3
 import os
 from datetime import datetime, timedelta
+import atexit
+import base64
+import collections
+import csv
 import hashlib
+import heapq
+import hmac
+import io
+import json
+import logging
+import math
+import re
 import secrets
+import threading
+import time
+import zlib
 from functools import wraps
+from urllib.parse import urlencode
+from urllib3.exceptions import ReadTimeoutError
+from app_logging import init_logging, log_stats, request_id_var
+from db_backup import create_backup
+from response_cache import ResponseCache
+from update_poller import UpdatePoller
+from shared_state import create_shared_state
+from traffic_capture import TrafficRecorder
+from upstream_reply import PayloadTooLarge, ReplyExtractor
+from text_codec import (RAW, ZLIB, ZSTD, compress_text, decompress_text, load_zstd_dictionary,
+                        train_zstd_dictionary, zstandard)
+
+init_logging()
+logger = logging.getLogger('mobi')
 
 app = Flask(__name__)
 CORS(app)
 
+@app.before_request
+def assign_request_id():
+    g.request_id = request.headers.get('X-Request-ID') or secrets.token_hex(8)
+    g.arrived_at = time.time()
+    g.started = time.monotonic()
+    request_id_var.set(g.request_id)
+
+@app.after_request
+def expose_request_id(response):
+    request_id = getattr(g, 'request_id', None)
+    if request_id:
+        response.headers['X-Request-ID'] = request_id
+    return response
+
+CAPTURE_PATHS = ('/api/chat', '/api/verify-code', '/webhook')
+
+@app.after_request
+def capture_traffic(response):
+    if traffic.enabled and request.method == 'POST' and request.path in CAPTURE_PATHS:
+        traffic.record_http(request.path, request.get_json(silent=True),
+                            {k.lower(): v for k, v in request.headers.items()},
+                            response.status_code, g.arrived_at, time.monotonic() - g.started)
+    return response
+
 BOT_TOKEN = os.environ.get('BOT_TOKEN')
-bot = telebot.TeleBot(BOT_TOKEN)
+# لا تُنشأ خيوط المعالجة عند الاستيراد حتى يبقى التحميل المسبق (--preload) آمناً مع fork،
+# وتُنشأ في كل عامل عبر init_worker()
+bot = telebot.TeleBot(BOT_TOKEN, threaded=False)
+BOT_THREADS = int(os.environ.get('BOT_THREADS', 2))
+
+# webhook أو polling؛ polling يحذف webhook البوت من تلغرام فلا يُفعَّل إلا صراحةً
+TELEGRAM_MODE = os.environ.get('TELEGRAM_MODE', 'webhook')
+TELEGRAM_API_URL = os.environ.get('TELEGRAM_API_URL', 'https://api.telegram.org').rstrip('/')
+TELEGRAM_POLL_TIMEOUT = int(os.environ.get('TELEGRAM_POLL_TIMEOUT', 50))
+TELEGRAM_POLL_LIMIT = int(os.environ.get('TELEGRAM_POLL_LIMIT', 100))
+if TELEGRAM_API_URL != 'https://api.telegram.org':
+    telebot.apihelper.API_URL = TELEGRAM_API_URL + '/bot{0}/{1}'
 
 ADMINS = [6521966233]
-API_SECRET_KEY = os.environ.get('API_SECRET_KEY', secrets.token_urlsafe(32))
+
+def derive_api_key():
+    """مفتاح API ثابت لكل العمال: من المتغير، أو مشتق من BOT_TOKEN، أو عشوائي للتطوير المحلي"""
+    if os.environ.get('API_SECRET_KEY'):
+        return os.environ['API_SECRET_KEY']
+    if BOT_TOKEN:
+        digest = hmac.new(BOT_TOKEN.encode('utf-8'), b'web-api-key', hashlib.sha256).digest()
+        return base64.urlsafe_b64encode(digest).rstrip(b'=').decode('ascii')
+    return secrets.token_urlsafe(32)
+
+API_SECRET_KEY = derive_api_key()
+_LOCAL_SERVER_SECRET = secrets.token_bytes(32)
+
+def derive_server_key(purpose):
+    """مفتاح خاص بالخادم لغرض واحد (توقيع، أسماء مستعارة).
+
+    API_SECRET_KEY يُطبع في صفحة الموقع فلا يصلح سراً؛ المصدر هنا SERVER_SECRET أو
+    BOT_TOKEN، وإلا فمفتاح عشوائي لكل عملية للتطوير المحلي.
+    """
+    secret = os.environ.get('SERVER_SECRET') or BOT_TOKEN
+    secret = secret.encode('utf-8') if secret else _LOCAL_SERVER_SECRET
+    return hmac.new(secret, purpose.encode('utf-8'), hashlib.sha256).digest()
+
+# تسجيل الحركة المنقاة لإعادة تشغيلها (traffic_capture.py)؛ معطل ما لم يُضبط CAPTURE_PATH
+traffic = TrafficRecorder(
+    os.environ.get('CAPTURE_PATH'),
+    derive_server_key('traffic-capture'),
+    sample=float(os.environ.get('CAPTURE_SAMPLE', 1)),
+    max_bytes=int(float(os.environ.get('CAPTURE_MAX_MB', 512)) * 1024 * 1024),
+)
+
+# العدادات والقيم المخزنة المشتركة بين عمال gunicorn
+shared_state = create_shared_state(os.environ.get('SHARED_STATE_URL', 'sqlite:///shared_state.db'))
 
 def init_db():
     conn = sqlite3.connect('bot_data.db', check_same_thread=False)
     c = conn.cursor()
     
+    # WAL: القراءة الطويلة (النسخ الاحتياطي والتصدير) لا تحجب الكتابة
+    c.execute("PRAGMA journal_mode=WAL")
+    
     c.execute('''CREATE TABLE IF NOT EXISTS banned_users
                  (user_id INTEGER PRIMARY KEY, reason TEXT, banned_at TIMESTAMP)''')
     
@@ -38,13 +136,89 @@ def init_db():
     
     c.execute('''CREATE TABLE IF NOT EXISTS access_codes
                  (code TEXT PRIMARY KEY, created_by INTEGER, created_at TIMESTAMP,
-                  used_count INTEGER DEFAULT 0, max_uses INTEGER DEFAULT 1, active INTEGER DEFAULT 1)''')
+                  used_count INTEGER DEFAULT 0, max_uses INTEGER DEFAULT 1, active INTEGER DEFAULT 1,
+                  expires_at TIMESTAMP, batch_label TEXT)''')
+    
+    # ترقية الجداول القديمة
+    columns = {row[1] for row in c.execute("PRAGMA table_info(access_codes)")}
+    if 'expires_at' not in columns:
+        c.execute("ALTER TABLE access_codes ADD COLUMN expires_at TIMESTAMP")
+    if 'batch_label' not in columns:
+        c.execute("ALTER TABLE access_codes ADD COLUMN batch_label TEXT")
+    
+    c.execute("CREATE INDEX IF NOT EXISTS idx_access_codes_created ON access_codes(created_at, code)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_access_codes_batch ON access_codes(batch_label)")
+    
+    columns = {row[1] for row in c.execute("PRAGMA table_info(web_messages)")}
+    if 'prompt_key' not in columns:
+        c.execute("ALTER TABLE web_messages ADD COLUMN prompt_key TEXT")
+    
+    c.execute("CREATE INDEX IF NOT EXISTS idx_web_messages_session ON web_messages(session_id, id)")
+    # فهرس مغطٍّ لتجميع الأسئلة المتكررة في نافذة زمنية دون مسح الجدول
+    c.execute("CREATE INDEX IF NOT EXISTS idx_web_messages_prompt ON web_messages(created_at, prompt_key)")
+    
+    # فهرس بحث نصي بدون محتوى: النصوص مضغوطة في web_messages فتُفهرس نسختها المطبّعة فقط
+    c.execute('''CREATE VIRTUAL TABLE IF NOT EXISTS web_messages_fts USING fts5
+                 (message, response, content='', tokenize='unicode61 remove_diacritics 2')''')
+    
+    # تجميعات الاستخدام لكل ساعة ويوم، تُحدَّث تدريجياً من RollupRecorder
+    c.execute('''CREATE TABLE IF NOT EXISTS usage_rollups
+                 (granularity TEXT, bucket_start TEXT, metric TEXT, count INTEGER, total REAL,
+                  min_value REAL, max_value REAL, histogram TEXT,
+                  PRIMARY KEY (granularity, bucket_start, metric))''')
+    
+    c.execute('''CREATE TABLE IF NOT EXISTS codec_dictionaries
+                 (dict_id INTEGER PRIMARY KEY, data BLOB, created_at TIMESTAMP)''')
+    for (data,) in c.execute("SELECT data FROM codec_dictionaries ORDER BY created_at"):
+        load_zstd_dictionary(data)
     
     conn.commit()
     conn.close()
 
 init_db()
 
+http = requests.Session()
+_worker_pid = os.getpid()
+_worker_ready = False
+_worker_lock = threading.Lock()
+
+def init_worker():
+    """إعادة إنشاء الموارد غير الآمنة عبر fork (جلسة HTTP، اتصالات SQLite، خيوط البوت).
+
+    تُستدعى من post_worker_init في gunicorn.conf.py ومن lifespan في asgi.py، ومع أول
+    طلب (before_request) لأي خادم آخر مثل flask run أو gunicorn بدون -c؛ الاستدعاء
+    المتكرر في نفس العملية لا يفعل شيئاً.
+    """
+    global http, _worker_pid, _worker_ready
+    if _worker_ready and _worker_pid == os.getpid():
+        return
+    with _worker_lock:
+        if _worker_ready and _worker_pid == os.getpid():
+            return
+        http = requests.Session()
+        shared_state.reset()
+        bot.threaded = True
+        bot.worker_pool = telebot.util.ThreadPool(bot, num_threads=BOT_THREADS)
+        _worker_pid = os.getpid()
+        _worker_ready = True
+    if TELEGRAM_DEBOUNCE_MS > 0 and not polling_enabled() and int(os.environ.get('WEB_CONCURRENCY', 2)) > 1:
+        logger.warning("TELEGRAM_DEBOUNCE_MS is per worker: with several webhook workers "
+                       "messages of one chat may not be merged")
+    threading.Thread(target=run_startup_jobs, daemon=True).start()
+    threading.Thread(target=warm_response_cache, daemon=True).start()
+    threading.Thread(target=rollups.run, args=(ROLLUP_FLUSH_SECONDS,), daemon=True).start()
+    atexit.register(rollups.flush)
+    threading.Thread(target=readiness.run, daemon=True).start()
+    threading.Thread(target=purge_shared_state, daemon=True).start()
+    if BACKUP_INTERVAL_HOURS > 0:
+        threading.Thread(target=run_backup_schedule, daemon=True).start()
+    if polling_enabled():
+        threading.Thread(target=run_polling, daemon=True).start()
+
+@app.before_request
+def ensure_worker_started():
+    init_worker()
+
 def verify_api_key(f):
     @wraps(f)
     def decorated_function(*args, **kwargs):
@@ -54,18 +228,32 @@ def verify_api_key(f):
         return f(*args, **kwargs)
     return decorated_function
 
+ADMIN_API_KEY = os.environ.get('ADMIN_API_KEY')
+
+def verify_admin_key(f):
+    """مسارات الإدارة تتطلب X-Admin-Key، وتُعطَّل إن لم يُضبط ADMIN_API_KEY"""
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        admin_key = request.headers.get('X-Admin-Key', '')
+        if not ADMIN_API_KEY or not hmac.compare_digest(admin_key, ADMIN_API_KEY):
+            return jsonify({"error": "Forbidden"}), 403
+        return f(*args, **kwargs)
+    return decorated_function
+
 def verify_access_code(code):
     """التحقق من صحة رمز الدخول"""
     conn = sqlite3.connect('bot_data.db', check_same_thread=False)
     c = conn.cursor()
-    c.execute("SELECT used_count, max_uses, active FROM access_codes WHERE code=?", (code,))
+    c.execute("SELECT used_count, max_uses, active, expires_at FROM access_codes WHERE code=?", (code,))
     result = c.fetchone()
     conn.close()
     
     if not result:
         return False
     
-    used_count, max_uses, active = result
+    used_count, max_uses, active, expires_at = result
+    if expires_at and datetime.strptime(expires_at, '%Y-%m-%d %H:%M:%S.%f') <= datetime.now():
+        return False
     return active == 1 and (max_uses == -1 or used_count < max_uses)
 
 def use_access_code(code):
@@ -75,44 +263,134 @@ def use_access_code(code):
     c.execute("UPDATE access_codes SET used_count = used_count + 1 WHERE code=?", (code,))
     conn.commit()
     conn.close()
+    rollups.record('redemptions')
 
 def create_access_code(admin_id, max_uses=1):
     """إنشاء رمز دخول جديد"""
     code = secrets.token_urlsafe(16)
     conn = sqlite3.connect('bot_data.db', check_same_thread=False)
     c = conn.cursor()
-    c.execute("INSERT INTO access_codes VALUES (?, ?, ?, 0, ?, 1)",
+    c.execute("INSERT INTO access_codes (code, created_by, created_at, used_count, max_uses, active) "
+              "VALUES (?, ?, ?, 0, ?, 1)",
               (code, admin_id, datetime.now(), max_uses))
     conn.commit()
     conn.close()
     return code
 
-def rate_limit_check(session_id, max_requests=20, window_minutes=60):
+MAX_BULK_CODES = 10000
+
+def default_batch_label():
+    """تسمية فريدة لدفعة بدون تسمية؛ اللاحقة العشوائية تمنع تصادم دفعتين في نفس الثانية"""
+    return datetime.now().strftime('batch-%Y%m%d-%H%M%S-') + secrets.token_hex(2)
+
+def create_access_codes_bulk(admin_id, count, max_uses=1, expires_at=None, batch_label=None):
+    """إنشاء دفعة رموز في معاملة واحدة عبر executemany.
+
+    التسمية تحدد ما يصدره iter_codes_csv، لذا تُرفض تسمية مستخدمة مسبقاً (ValueError)
+    حتى لا يختلط تصدير دفعة جديدة برموز دفعة قديمة.
+    """
+    if not 1 <= count <= MAX_BULK_CODES:
+        raise ValueError(f"عدد الرموز يجب أن يكون بين 1 و {MAX_BULK_CODES}")
+    now = datetime.now()
+    rows = [(secrets.token_urlsafe(16), admin_id, now, max_uses, expires_at, batch_label)
+            for _ in range(count)]
+    conn = sqlite3.connect('bot_data.db', check_same_thread=False)
+    try:
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            if batch_label is not None and conn.execute(
+                    "SELECT 1 FROM access_codes WHERE batch_label=? LIMIT 1", (batch_label,)).fetchone():
+                raise ValueError(f"التسمية {batch_label} مستخدمة لدفعة سابقة")
+            conn.executemany("INSERT INTO access_codes (code, created_by, created_at, used_count, max_uses, "
+                             "active, expires_at, batch_label) VALUES (?, ?, ?, 0, ?, 1, ?, ?)", rows)
+    finally:
+        conn.close()
+    return [row[0] for row in rows]
+
+CODES_CSV_HEADER = "code,max_uses,used_count,active,expires_at,batch_label,created_at\n"
+
+def iter_codes_csv(batch_label, chunk_size=500):
+    """تصدير رموز دفعة كـ CSV على أجزاء"""
+    yield CODES_CSV_HEADER
+    conn = sqlite3.connect('bot_data.db', check_same_thread=False)
+    try:
+        c = conn.cursor()
+        c.execute("SELECT code, max_uses, used_count, active, expires_at, batch_label, created_at "
+                  "FROM access_codes WHERE batch_label=? ORDER BY code", (batch_label,))
+        while True:
+            rows = c.fetchmany(chunk_size)
+            if not rows:
+                break
+            out = io.StringIO()
+            csv.writer(out, lineterminator="\n").writerows(rows)
+            yield out.getvalue()
+    finally:
+        conn.close()
+
+def list_access_codes_page(after_code=None, limit=10):
+    """صفحة من الرموز بترتيب الأحدث أولاً، مع ترقيم بالمفتاح (created_at, code)"""
     conn = sqlite3.connect('bot_data.db', check_same_thread=False)
     c = conn.cursor()
-    c.execute("SELECT message_count, last_request FROM web_sessions WHERE session_id=?", (session_id,))
-    result = c.fetchone()
-    
-    if result:
-        count, last_req = result
-        if last_req:
-            last_request_time = datetime.strptime(last_req, '%Y-%m-%d %H:%M:%S.%f')
-            time_diff = datetime.now() - last_request_time
-            
-            if time_diff > timedelta(minutes=window_minutes):
-                c.execute("UPDATE web_sessions SET message_count=0, last_request=? WHERE session_id=?",
-                         (datetime.now(), session_id))
-                conn.commit()
-                conn.close()
-                return True
-            
-            if count >= max_requests:
-                conn.close()
-                return False
-    
+    if after_code:
+        c.execute("SELECT code, used_count, max_uses, active FROM access_codes "
+                  "WHERE (created_at, code) < (SELECT created_at, code FROM access_codes WHERE code=?) "
+                  "ORDER BY created_at DESC, code DESC LIMIT ?", (after_code, limit))
+    else:
+        c.execute("SELECT code, used_count, max_uses, active FROM access_codes "
+                  "ORDER BY created_at DESC, code DESC LIMIT ?", (limit,))
+    codes = c.fetchall()
     conn.close()
+    return codes
+
+def rate_limit_check(session_id, max_requests=20, window_minutes=60):
+    """حجز طلب من حصة الجلسة ذرياً عبر العداد المشترك بين العمال"""
+    count = shared_state.incr(f"rl:{session_id}", ttl=window_minutes * 60)
+    if count > max_requests:
+        shared_state.incr(f"rl:{session_id}", -1)
+        return False
     return True
 
+def refund_rate_limit(session_id):
+    """إعادة طلب محجوز لم يُنفَّذ"""
+    shared_state.incr(f"rl:{session_id}", -1)
+
+IDEMPOTENCY_TTL = float(os.environ.get('IDEMPOTENCY_TTL', 600))
+_IDEMPOTENCY_KEY = re.compile(r'^[A-Za-z0-9_\-]{8,128}$')
+_IDEMPOTENCY_PENDING = {"state": "pending"}
+
+def acquire_idempotency_slot(slot):
+    """حجز مفتاح Idempotency-Key دون انتظار.
+
+    يعيد None إن حُجز المفتاح لهذا الطلب، أو الرد المخزن إن اكتمل الطلب الأصلي،
+    أو _IDEMPOTENCY_PENDING إن كان الأصلي قيد التنفيذ؛ عندها يُرد 409 مع Retry-After
+    فوراً بدل حجز خيط عامل في الانتظار. إن فشل الأصلي وحرر المفتاح يحجزه هذا الطلب
+    ويعيد التنفيذ.
+    """
+    if shared_state.compare_and_set(slot, None, _IDEMPOTENCY_PENDING, ttl=CHAT_DEADLINE_SECONDS + 10):
+        return None
+    entry = shared_state.get(slot)
+    if entry is not None and entry.get("state") == "done":
+        return entry
+    return _IDEMPOTENCY_PENDING
+
+def complete_idempotency_slot(slot, payload):
+    shared_state.set(slot, {"state": "done", "body": payload}, ttl=IDEMPOTENCY_TTL)
+
+def release_idempotency_slot(slot):
+    """تحرير مفتاح طلب لم يكتمل حتى تُنفَّذ إعادة المحاولة من جديد"""
+    if slot:
+        shared_state.delete(slot)
+
+def purge_shared_state(interval=300):
+    """حذف المفاتيح المنتهية دورياً (مفاتيح التكرار وعدادات المعدل) من تطبيق SQLite"""
+    purge = getattr(shared_state, 'purge_expired', None)
+    while purge:
+        time.sleep(interval)
+        try:
+            purge()
+        except Exception:
+            logger.exception("shared state purge failed")
+
 def update_rate_limit(session_id):
     conn = sqlite3.connect('bot_data.db', check_same_thread=False)
     c = conn.cursor()
@@ -174,25 +452,835 @@ def create_session(access_code):
               (session_id, datetime.now(), datetime.now(), access_code))
     conn.commit()
     conn.close()
+    rollups.record('sessions')
     return session_id
 
+# ترميز ضغط نصوص web_messages: none أو zlib أو zstd (انظر text_codec.py)
+TEXT_CODEC = os.environ.get('TEXT_CODEC', 'zlib')
+TEXT_CODEC_MIGRATE = os.environ.get('TEXT_CODEC_MIGRATE', '1') == '1'
+
+def prompt_key_for(message, response):
+    """بصمة السؤال المطبَّع للردود الناجحة القابلة للتخزين المؤقت، وإلا None"""
+    if response in (AI_ERROR_REPLY, AI_EMPTY_REPLY):
+        return None
+    key = response_cache.cache_key(message)
+    return hashlib.sha1(key.encode('utf-8')).hexdigest()[:16] if key else None
+
 def save_web_message(session_id, message, response):
     conn = sqlite3.connect('bot_data.db', check_same_thread=False)
     c = conn.cursor()
-    c.execute("INSERT INTO web_messages (session_id, message, response, created_at) VALUES (?, ?, ?, ?)",
-              (session_id, message, response, datetime.now()))
+    c.execute("INSERT INTO web_messages (session_id, message, response, created_at, prompt_key) "
+              "VALUES (?, ?, ?, ?, ?)",
+              (session_id, compress_text(message, TEXT_CODEC), compress_text(response, TEXT_CODEC),
+               datetime.now(), prompt_key_for(message, response)))
+    c.execute("INSERT INTO web_messages_fts (rowid, message, response) VALUES (?, ?, ?)",
+              (c.lastrowid, normalize_search_text(message), normalize_search_text(response)))
     conn.commit()
     conn.close()
 
-def get_ai_response(text):
+def session_exists(session_id):
+    conn = sqlite3.connect('bot_data.db', check_same_thread=False)
+    c = conn.cursor()
+    c.execute("SELECT 1 FROM web_sessions WHERE session_id=?", (session_id,))
+    result = c.fetchone()
+    conn.close()
+    return result is not None
+
+def get_session_history(session_id, before_id=None, limit=30):
+    """صفحة من سجل الجلسة (الأحدث أولاً في الاستعلام) مرتبة زمنياً للعرض"""
+    conn = sqlite3.connect('bot_data.db', check_same_thread=False)
+    c = conn.cursor()
+    if before_id:
+        c.execute("SELECT id, message, response, created_at FROM web_messages "
+                  "WHERE session_id=? AND id < ? ORDER BY id DESC LIMIT ?", (session_id, before_id, limit))
+    else:
+        c.execute("SELECT id, message, response, created_at FROM web_messages "
+                  "WHERE session_id=? ORDER BY id DESC LIMIT ?", (session_id, limit))
+    rows = c.fetchall()
+    conn.close()
+    return [[row_id, decompress_text(message), decompress_text(response), created_at]
+            for row_id, message, response, created_at in reversed(rows)]
+
+# تصدير web_messages وweb_sessions: صفحات بالمفتاح (id أو rowid) كل منها معاملة قراءة
+# قصيرة، فلا يبقى قفل قراءة مفتوحاً أثناء انتظار العميل ولا يتوقف checkpoint في WAL
+EXPORT_TABLES = {
+    'messages': {
+        'columns': ('id', 'session_id', 'created_at', 'message', 'response'),
+        'select': "SELECT id, session_id, created_at, message, response FROM web_messages",
+        'key': 'id',
+        'table': 'web_messages',
+        'compressed': (3, 4),
+    },
+    'sessions': {
+        'columns': ('id', 'session_id', 'created_at', 'message_count', 'last_request', 'access_code'),
+        'select': "SELECT rowid, session_id, created_at, message_count, last_request, access_code "
+                  "FROM web_sessions",
+        'key': 'rowid',
+        'table': 'web_sessions',
+        'compressed': (),
+    },
+}
+
+EXPORT_SIGNING_KEY = derive_server_key('export-cursor')
+
+def _sign_export(payload):
+    return hmac.new(EXPORT_SIGNING_KEY, payload, hashlib.sha256).hexdigest()[:16]
+
+def make_export_cursor(kind, start=None, end=None, session_id=None):
+    """رمز تصدير يثبت المرشحات وحدود id (لقطة بداية التصدير)، موقَّع حتى لا يُعدَّل"""
+    spec = EXPORT_TABLES[kind]
+    conn = sqlite3.connect('bot_data.db', check_same_thread=False)
+    try:
+        # حدود النافذة الزمنية تتحول إلى مدى id (الإدراج تصاعدي زمنياً)
+        bounds = f"SELECT MIN({spec['key']}), MAX({spec['key']}) FROM {spec['table']}"
+        low = conn.execute(bounds + " WHERE created_at >= ?", (start,)).fetchone()[0] if start \
+            else conn.execute(bounds).fetchone()[0]
+        high = conn.execute(bounds + " WHERE created_at < ?", (end,)).fetchone()[1] if end \
+            else conn.execute(bounds).fetchone()[1]
+    finally:
+        conn.close()
+    state = {"k": kind, "after": (low or 1) - 1, "max": high or 0, "session": session_id,
+             "from": start.isoformat() if start else None, "to": end.isoformat() if end else None}
+    payload = base64.urlsafe_b64encode(json.dumps(state, separators=(',', ':')).encode()).rstrip(b'=')
+    return f"{payload.decode()}.{_sign_export(payload)}"
+
+def parse_export_cursor(token):
+    """فك رمز التصدير والتحقق من توقيعه؛ ValueError عند التلاعب"""
+    try:
+        payload, signature = token.encode().rsplit(b'.', 1)
+    except ValueError:
+        raise ValueError("رمز تصدير غير صالح")
+    if not hmac.compare_digest(signature.decode(), _sign_export(payload)):
+        raise ValueError("رمز تصدير غير صالح")
+    state = json.loads(base64.urlsafe_b64decode(payload + b'=' * (-len(payload) % 4)))
+    if state.get("k") not in EXPORT_TABLES:
+        raise ValueError("رمز تصدير غير صالح")
+    return state
+
+def iter_export_rows(state, after=None, page_size=1000):
+    """صفوف التصدير بترتيب المفتاح بدءاً بعد `after` (آخر id استلمه العميل)"""
+    spec = EXPORT_TABLES[state["k"]]
+    key = spec['key']
+    last = max(state["after"], after or 0)
+    where, params = [f"{key} > ?", f"{key} <= ?"], [None, state["max"]]
+    if state.get("from"):
+        where.append("created_at >= ?")
+        params.append(datetime.fromisoformat(state["from"]))
+    if state.get("to"):
+        where.append("created_at < ?")
+        params.append(datetime.fromisoformat(state["to"]))
+    if state.get("session"):
+        where.append("session_id = ?")
+        params.append(state["session"])
+    query = f"{spec['select']} WHERE {' AND '.join(where)} ORDER BY {key} LIMIT ?"
+    conn = sqlite3.connect('bot_data.db', check_same_thread=False)
+    try:
+        while True:
+            params[0] = last
+            c = conn.execute(query, params + [page_size])
+            rows = c.fetchmany(page_size)
+            c.close()
+            if not rows:
+                break
+            for row in rows:
+                if spec['compressed']:
+                    row = list(row)
+                    for i in spec['compressed']:
+                        row[i] = decompress_text(row[i])
+                yield row
+            last = rows[-1][0]
+    finally:
+        conn.close()
+
+def iter_export(state, fmt='ndjson', after=None, compress=False, rows_per_chunk=500):
+    """ترميز صفوف التصدير إلى CSV أو NDJSON على أجزاء، مع gzip اختياري.
+
+    كل جزء مضغوط يُنهى بـ Z_SYNC_FLUSH، فالجزء المستلم قبل انقطاع الاتصال قابل
+    لفك الضغط ويحدد آخر id لاستئناف التصدير.
+    """
+    columns = EXPORT_TABLES[state["k"]]['columns']
+    gz = zlib.compressobj(6, zlib.DEFLATED, 31) if compress else None
+
+    def encode(text):
+        if gz is None:
+            return text
+        return gz.compress(text.encode('utf-8')) + gz.flush(zlib.Z_SYNC_FLUSH)
+
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator="\n")
+    if fmt == 'csv' and not after:
+        writer.writerow(columns)
+    count = 0
+    for row in iter_export_rows(state, after):
+        if fmt == 'csv':
+            writer.writerow(row)
+        else:
+            buffer.write(json.dumps(dict(zip(columns, row)), ensure_ascii=False, default=str))
+            buffer.write("\n")
+        count += 1
+        if count % rows_per_chunk == 0:
+            yield encode(buffer.getvalue())
+            buffer.seek(0)
+            buffer.truncate()
+    tail = buffer.getvalue()
+    if gz is not None:
+        yield (gz.compress(tail.encode('utf-8')) if tail else b'') + gz.flush()
+    elif tail:
+        yield tail
+
+def ensure_zstd_dictionary(conn, min_rows=1000, sample_size=2000):
+    """تدريب قاموس zstd من أحدث الردود إن لم يوجد قاموس بعد"""
+    if TEXT_CODEC != 'zstd' or zstandard is None:
+        return
+    if conn.execute("SELECT 1 FROM codec_dictionaries LIMIT 1").fetchone():
+        return
+    rows = conn.execute("SELECT response FROM web_messages ORDER BY id DESC LIMIT ?",
+                        (sample_size,)).fetchall()
+    if len(rows) < min_rows:
+        return
+    data = train_zstd_dictionary([decompress_text(r[0]) for r in rows])
+    dict_id = load_zstd_dictionary(data)
+    with conn:
+        conn.execute("INSERT OR IGNORE INTO codec_dictionaries VALUES (?, ?, ?)",
+                     (dict_id, data, datetime.now()))
+
+def run_message_job(name, process_batch, before=None, batch_size=200, pause=0.05, version=None):
+    """تشغيل مهمة خلفية على صفوف web_messages بترتيب id وعلى دفعات صغيرة.
+
+    يعمل عامل واحد فقط في كل مرة (قفل في shared_state)، ويُحفظ آخر id معالج
+    مع `version` (هدف المهمة، مثل الترميز) حتى تستكمل المهمة بعد إعادة التشغيل؛
+    إن تغير `version` تبدأ المهمة من أول الجدول. بين الدفعات مهلة قصيرة كي لا تحجب الكتابة.
+    """
+    lock_key = f"job:{name}:lock"
+    cursor_key = f"job:{name}:last_id"
+    if not shared_state.compare_and_set(lock_key, None, os.getpid(), ttl=300):
+        return
+    conn = sqlite3.connect('bot_data.db', check_same_thread=False)
+    try:
+        if before:
+            before(conn)
+        saved = shared_state.get(cursor_key)
+        last_id = saved["last_id"] if isinstance(saved, dict) and saved.get("version") == version else 0
+        while True:
+            rows = conn.execute("SELECT id, message, response FROM web_messages WHERE id > ? "
+                                "ORDER BY id LIMIT ?", (last_id, batch_size)).fetchall()
+            if not rows:
+                break
+            with conn:
+                process_batch(conn, rows)
+            last_id = rows[-1][0]
+            shared_state.set(cursor_key, {"version": version, "last_id": last_id})
+            shared_state.set(lock_key, os.getpid(), ttl=300)
+            time.sleep(pause)
+    except Exception:
+        logger.exception("background job failed", extra={"fields": {"job": name}})
+    finally:
+        conn.close()
+        shared_state.delete(lock_key)
+
+def recompress_web_messages():
+    """ترحيل خلفي يضغط صفوف web_messages المخزنة كنص أو بترميز غير TEXT_CODEC.
+
+    المؤشر يُحفظ مع الترميز الهدف، فتغيير TEXT_CODEC يعيد الترحيل من أول الجدول.
+    """
+    codec = 'zstd' if TEXT_CODEC == 'zstd' and zstandard is not None else TEXT_CODEC
+    target = {'zstd': ZSTD, 'zlib': ZLIB}.get(codec, RAW)
+
+    def stale(value):
+        return isinstance(value, str) or (isinstance(value, bytes) and bool(value) and value[0] != target)
+
+    def process(conn, rows):
+        updates = [(compress_text(decompress_text(m), codec),
+                    compress_text(decompress_text(r), codec), row_id)
+                   for row_id, m, r in rows
+                   if stale(m) or stale(r)]
+        conn.executemany("UPDATE web_messages SET message=?, response=? WHERE id=?", updates)
+    run_message_job("compress", process, before=ensure_zstd_dictionary, version=codec)
+
+_ARABIC_DIACRITICS = re.compile('[\u0610-\u061a\u064b-\u065f\u0670\u06d6-\u06ed\u0640]')
+_ARABIC_LETTERS = str.maketrans({
+    'أ': 'ا', 'إ': 'ا', 'آ': 'ا', 'ٱ': 'ا', 'ى': 'ي', 'ئ': 'ي', 'ؤ': 'و', 'ة': 'ه',
+    **{chr(0x0660 + i): str(i) for i in range(10)},
+    **{chr(0x06f0 + i): str(i) for i in range(10)},
+})
+_ARABIC_PREFIXES = ('وال', 'بال', 'كال', 'فال', 'لل', 'ال')
+_SEARCH_TOKEN = re.compile(r'\w+')
+
+def normalize_search_text(text):
+    """تطبيع نص للبحث: حذف التشكيل والتطويل، توحيد الألف والياء والتاء المربوطة،
+    الأرقام الهندية إلى لاتينية، وحذف أداة التعريف وما يسبقها من الكلمات الطويلة"""
+    if not text:
+        return ''
+    text = _ARABIC_DIACRITICS.sub('', text).translate(_ARABIC_LETTERS).lower()
+    words = []
+    for word in _SEARCH_TOKEN.findall(text):
+        for prefix in _ARABIC_PREFIXES:
+            if word.startswith(prefix) and len(word) - len(prefix) >= 2:
+                word = word[len(prefix):]
+                break
+        words.append(word)
+    return ' '.join(words)
+
+def build_fts_query(query):
+    """تحويل نص البحث إلى استعلام FTS5 آمن: كل كلمة بين علامتي تنصيص مع بحث بالبادئة"""
+    terms = normalize_search_text(query).split()
+    return ' '.join(f'"{term}"*' for term in terms[:16])
+
+def search_messages(query, page=1, page_size=20):
+    """بحث مرتب حسب bm25 في سجل المحادثات، يعيد صفحة من النتائج"""
+    fts_query = build_fts_query(query)
+    if not fts_query:
+        return []
+    page_size = max(1, min(page_size, 100))
+    offset = (max(1, page) - 1) * page_size
+    conn = sqlite3.connect('bot_data.db', check_same_thread=False)
+    c = conn.cursor()
+    c.execute("""SELECT m.id, m.session_id, m.message, m.response, m.created_at
+                 FROM (SELECT rowid, rank FROM web_messages_fts WHERE web_messages_fts MATCH ?
+                       ORDER BY rank LIMIT ? OFFSET ?) AS hits
+                 JOIN web_messages m ON m.id = hits.rowid
+                 ORDER BY hits.rank""", (fts_query, page_size, offset))
+    rows = c.fetchall()
+    conn.close()
+    return [{"id": row_id, "session_id": session_id, "message": decompress_text(message),
+             "response": decompress_text(response), "created_at": created_at}
+            for row_id, session_id, message, response, created_at in rows]
+
+def backfill_search_index():
+    """فهرسة الصفوف الموجودة قبل تفعيل البحث؛ الصفوف المفهرسة من مسار الكتابة تُتخطى"""
+    def process(conn, rows):
+        ids = [row[0] for row in rows]
+        marks = ','.join('?' * len(ids))
+        indexed = {r[0] for r in conn.execute(
+            f"SELECT rowid FROM web_messages_fts WHERE rowid IN ({marks})", ids)}
+        conn.executemany("INSERT INTO web_messages_fts (rowid, message, response) VALUES (?, ?, ?)",
+                         [(row_id, normalize_search_text(decompress_text(m)),
+                           normalize_search_text(decompress_text(r)))
+                          for row_id, m, r in rows if row_id not in indexed])
+    run_message_job("fts_backfill", process)
+
+def backfill_prompt_keys():
+    """حساب prompt_key للصفوف السابقة لإضافة العمود"""
+    def process(conn, rows):
+        updates = []
+        for row_id, m, r in rows:
+            key = prompt_key_for(decompress_text(m), decompress_text(r))
+            if key:
+                updates.append((key, row_id))
+        conn.executemany("UPDATE web_messages SET prompt_key=? WHERE id=?", updates)
+    run_message_job("prompt_keys", process)
+
+def run_startup_jobs():
+    if TEXT_CODEC_MIGRATE:
+        recompress_web_messages()
+    backfill_search_index()
+    backfill_prompt_keys()
+
+BACKUP_DIR = os.environ.get('BACKUP_DIR', 'backups')
+BACKUP_KEEP = int(os.environ.get('BACKUP_KEEP', 7))
+BACKUP_INTERVAL_HOURS = float(os.environ.get('BACKUP_INTERVAL_HOURS', 24))
+BACKUP_STEP_PAGES = int(os.environ.get('BACKUP_STEP_PAGES', 256))
+BACKUP_PAUSE = float(os.environ.get('BACKUP_PAUSE', 0.05))
+
+def run_backup(reason='schedule'):
+    """لقطة احتياطية حية لـ bot_data.db؛ يعيد None إن كان عامل آخر ينسخ الآن"""
+    if not shared_state.compare_and_set("backup:lock", None, os.getpid(), ttl=3600):
+        return None
+    try:
+        stats = create_backup('bot_data.db', BACKUP_DIR, BACKUP_KEEP, BACKUP_STEP_PAGES, BACKUP_PAUSE)
+        shared_state.set("backup:last", time.time())
+        logger.info("backup written", extra={"fields": {
+            "reason": reason, "path": stats["path"], "bytes": stats["stored_bytes"],
+            "seconds": stats["seconds"], "steps": stats["steps"], "restarts": stats["restarts"],
+            "pruned": len(stats["pruned"])}})
+        return stats
+    finally:
+        shared_state.delete("backup:lock")
+
+def run_backup_schedule(check_every=60):
+    """نسخة كل BACKUP_INTERVAL_HOURS؛ وقت آخر نسخة مشترك فلا يكررها باقي العمال"""
+    while True:
+        last = shared_state.get("backup:last", 0)
+        if time.time() - last >= BACKUP_INTERVAL_HOURS * 3600:
+            try:
+                run_backup()
+            except Exception:
+                logger.exception("scheduled backup failed")
+        time.sleep(check_every)
+
+class AdmissionController:
+    """حد تزامن تكيفي (AIMD) للطلبات المتجهة إلى خادم الذكاء.
+
+    يزيد الحد بمقدار ثابت بعد كل نافذة ناجحة ويضربه في معامل تراجع عندما
+    يتجاوز زمن الاستجابة الهدف أو يفشل الطلب، فيُرفض الطلب الزائد فوراً
+    بدلاً من حجز عامل حتى انتهاء مهلة الخادم.
+
+    `caps` سقف ثابت لكل مصدر (مثلاً 'web' لخيوط gunicorn و'bot' لخيوط البوت)
+    فوق الحد التكيفي، حتى لا يحجز مصدر واحد كل خيوطه في انتظار الخادم.
+    """
+
+    def __init__(self, initial_limit=8, min_limit=1, max_limit=64,
+                 latency_target=20.0, backoff=0.7, caps=None):
+        self._lock = threading.Lock()
+        self.max_limit = max_limit
+        self.limit = float(min(initial_limit, max_limit))
+        self.min_limit = min_limit
+        self.latency_target = latency_target
+        self.backoff = backoff
+        self.caps = dict(caps or {})
+        self.in_flight = 0
+        self.in_flight_by = {}
+        self.avg_latency = 0.0
+        self.rejected = 0
+
+    def try_acquire(self, source=None):
+        with self._lock:
+            cap = self.caps.get(source)
+            used = self.in_flight_by.get(source, 0)
+            if self.in_flight >= int(self.limit) or (cap is not None and used >= cap):
+                self.rejected += 1
+                return False
+            self.in_flight += 1
+            self.in_flight_by[source] = used + 1
+            return True
+
+    def release(self, latency, ok=True, source=None):
+        with self._lock:
+            self.in_flight -= 1
+            self.in_flight_by[source] -= 1
+            if self.avg_latency:
+                self.avg_latency = 0.8 * self.avg_latency + 0.2 * latency
+            else:
+                self.avg_latency = latency
+            if not ok or latency > self.latency_target:
+                self.limit = max(self.min_limit, self.limit * self.backoff)
+            else:
+                self.limit = min(self.max_limit, self.limit + 1.0 / self.limit)
+
+    def retry_after(self):
+        """عدد الثواني المقترح قبل إعادة المحاولة"""
+        return max(1, int(round(self.avg_latency or 1)))
+
+    def stats(self):
+        with self._lock:
+            return {
+                "limit": int(self.limit),
+                "in_flight": self.in_flight,
+                "caps": dict(self.caps),
+                "avg_latency": round(self.avg_latency, 3),
+                "rejected": self.rejected,
+            }
+
+# خيوط gunicorn لكل عامل (نفس متغير gunicorn.conf.py)؛ AI_RESERVED_THREADS منها
+# تبقى دائماً للمسارات التي لا تنتظر خادم الذكاء (/health و/livez و/)
+GUNICORN_THREADS = int(os.environ.get('GUNICORN_THREADS', 8))
+AI_RESERVED_THREADS = int(os.environ.get('AI_RESERVED_THREADS', 2))
+AI_SOURCE_CAPS = {'web': max(1, GUNICORN_THREADS - AI_RESERVED_THREADS), 'bot': BOT_THREADS}
+ai_limiter = AdmissionController(
+    initial_limit=int(os.environ.get('AI_CONCURRENCY_INITIAL', 8)),
+    max_limit=int(os.environ.get('AI_CONCURRENCY_MAX', sum(AI_SOURCE_CAPS.values()))),
+    latency_target=float(os.environ.get('AI_LATENCY_TARGET', 20)),
+    caps=AI_SOURCE_CAPS,
+)
+
+class LatencyHistogram:
+    """مخطط زمن استجابة بدلاء لوغاريتمية (على طريقة HDR) مع نافذة متدحرجة.
+
+    تُحفظ نافذتان (الحالية والسابقة) وتُدوَّران كل `window` ثانية، فتعكس
+    النسب المئوية آخر نافذة إلى نافذتين من الحركة فقط.
+    """
+
+    def __init__(self, min_value=0.01, max_value=600.0, growth=1.1, window=300):
+        self._lock = threading.Lock()
+        self.min_value = min_value
+        self.growth = growth
+        self.window = window
+        self.size = int(math.log(max_value / min_value, growth)) + 2
+        self._current = [0] * self.size
+        self._previous = [0] * self.size
+        self._rotated_at = time.monotonic()
+
+    def _index(self, value):
+        if value <= self.min_value:
+            return 0
+        return min(self.size - 1, int(math.log(value / self.min_value, self.growth)) + 1)
+
+    def _rotate(self):
+        now = time.monotonic()
+        if now - self._rotated_at >= self.window:
+            self._previous = self._current
+            self._current = [0] * self.size
+            self._rotated_at = now
+
+    def record(self, value):
+        with self._lock:
+            self._rotate()
+            self._current[self._index(value)] += 1
+
+    def count(self):
+        with self._lock:
+            return sum(self._current) + sum(self._previous)
+
+    def percentile(self, p):
+        """الحد الأعلى للدلو الذي يقع فيه المئين `p` (0-100)"""
+        with self._lock:
+            self._rotate()
+            counts = [a + b for a, b in zip(self._current, self._previous)]
+        total = sum(counts)
+        if not total:
+            return None
+        rank = total * p / 100.0
+        seen = 0
+        for i, n in enumerate(counts):
+            seen += n
+            if seen >= rank:
+                return self.min_value * self.growth ** i
+        return self.min_value * self.growth ** (self.size - 1)
+
+class TimeoutPolicy:
+    """اشتقاق مهلة القراءة من مئين زمن استجابة الخادم مع هامش وحدين أدنى وأعلى"""
+
+    def __init__(self, histogram, percentile=95, margin=5.0, floor=10.0,
+                 ceiling=120.0, min_samples=20):
+        self.histogram = histogram
+        self.percentile = percentile
+        self.margin = margin
+        self.floor = floor
+        self.ceiling = ceiling
+        self.min_samples = min_samples
+
+    def current(self):
+        """يعيد (المهلة، قيمة المئين المستخدمة أو None)"""
+        if self.histogram.count() < self.min_samples:
+            return self.ceiling, None
+        value = self.histogram.percentile(self.percentile)
+        return min(self.ceiling, max(self.floor, value + self.margin)), value
+
+AI_API_URL = os.environ.get('AI_API_URL', "https://sii3.top/api/openai.php")
+AI_ERROR_REPLY = "⚠️ عذراً، حدث خطأ في المعالجة"
+AI_EMPTY_REPLY = "❌ لا يوجد رد من الخادم"
+# السؤال يُرسل في رابط GET: يُقص إلى هذا العدد من بايتات UTF-8 قبل الترميز
+AI_PROMPT_MAX_BYTES = int(os.environ.get('AI_PROMPT_MAX_BYTES', 2048))
+AI_RESPONSE_MAX_BYTES = int(os.environ.get('AI_RESPONSE_MAX_BYTES', 256 * 1024))
+AI_RESPONSE_CHUNK = 16 * 1024
+
+ai_latency = LatencyHistogram()
+ai_payload_sizes = LatencyHistogram(min_value=64, max_value=64 * 1024 * 1024, growth=1.25)
+_payload_lock = threading.Lock()
+_payload_counts = {"responses": 0, "bytes": 0, "max_bytes": 0, "oversized": 0,
+                   "malformed": 0, "truncated_prompts": 0}
+ai_timeout_policy = TimeoutPolicy(
+    ai_latency,
+    percentile=float(os.environ.get('AI_TIMEOUT_PERCENTILE', 95)),
+    margin=float(os.environ.get('AI_TIMEOUT_MARGIN', 5)),
+    floor=float(os.environ.get('AI_TIMEOUT_FLOOR', 10)),
+    ceiling=float(os.environ.get('AI_TIMEOUT_CEILING', 120)),
+)
+CHAT_DEADLINE_SECONDS = float(os.environ.get('CHAT_DEADLINE_SECONDS', 90))
+
+ROLLUP_GRANULARITIES = {'hour': '%Y-%m-%d %H:00', 'day': '%Y-%m-%d'}
+ROLLUP_HIST_BASE = 1.25
+
+class RollupRecorder:
+    """تجميع الأحداث في ذاكرة العامل ودمجها دورياً في usage_rollups.
+
+    لكل (دقة، بداية الدلو، مقياس) يُحفظ العدد والمجموع والحد الأدنى والأعلى
+    ومدرج تكراري لوغاريتمي يسمح بحساب المئين من التجميعات وحدها.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pending = {}
+
+    def record(self, metric, value=None, at=None):
+        at = at or datetime.now()
+        with self._lock:
+            for granularity, fmt in ROLLUP_GRANULARITIES.items():
+                key = (granularity, at.strftime(fmt), metric)
+                entry = self._pending.get(key)
+                if entry is None:
+                    entry = self._pending[key] = [0, 0.0, None, None, {}]
+                entry[0] += 1
+                if value is not None:
+                    entry[1] += value
+                    entry[2] = value if entry[2] is None else min(entry[2], value)
+                    entry[3] = value if entry[3] is None else max(entry[3], value)
+                    idx = str(math.floor(math.log(value, ROLLUP_HIST_BASE)) if value > 0 else -1000)
+                    entry[4][idx] = entry[4].get(idx, 0) + 1
+
+    def flush(self):
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        if not pending:
+            return
+        conn = sqlite3.connect('bot_data.db', timeout=10, check_same_thread=False)
+        try:
+            with conn:
+                conn.execute("BEGIN IMMEDIATE")
+                for (granularity, bucket, metric), (count, total, lo, hi, hist) in pending.items():
+                    row = conn.execute("SELECT count, total, min_value, max_value, histogram FROM usage_rollups "
+                                       "WHERE granularity=? AND bucket_start=? AND metric=?",
+                                       (granularity, bucket, metric)).fetchone()
+                    if row:
+                        merged = json.loads(row[4] or '{}')
+                        for idx, n in hist.items():
+                            merged[idx] = merged.get(idx, 0) + n
+                        lo = row[2] if lo is None else (lo if row[2] is None else min(lo, row[2]))
+                        hi = row[3] if hi is None else (hi if row[3] is None else max(hi, row[3]))
+                        count, total, hist = count + row[0], total + row[1], merged
+                    conn.execute("INSERT OR REPLACE INTO usage_rollups VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                                 (granularity, bucket, metric, count, total, lo, hi, json.dumps(hist)))
+        except Exception:
+            logger.exception("rollup flush failed")
+        finally:
+            conn.close()
+
+    def run(self, interval):
+        while True:
+            time.sleep(interval)
+            self.flush()
+
+rollups = RollupRecorder()
+ROLLUP_FLUSH_SECONDS = float(os.environ.get('ROLLUP_FLUSH_SECONDS', 10))
+
+def histogram_percentile(hist, p, lo=None, hi=None):
+    """المئين التقريبي (الحد الأعلى للدلو، مقيداً بين lo وhi) من مدرج RollupRecorder"""
+    total = sum(hist.values())
+    if not total:
+        return None
+    rank = total * p / 100.0
+    seen = 0
+    for idx in sorted(hist, key=int):
+        seen += hist[idx]
+        if seen >= rank:
+            value = 0.0 if int(idx) == -1000 else ROLLUP_HIST_BASE ** (int(idx) + 1)
+            if hi is not None:
+                value = min(value, hi)
+            if lo is not None:
+                value = max(value, lo)
+            return round(value, 3)
+    return None
+
+def query_rollups(metric, start, end, granularity='hour'):
+    """قراءة دلاء مقياس ضمن مدى زمني من جداول التجميع فقط"""
+    fmt = ROLLUP_GRANULARITIES[granularity]
+    conn = sqlite3.connect('bot_data.db', check_same_thread=False)
+    c = conn.cursor()
+    c.execute("SELECT bucket_start, count, total, min_value, max_value, histogram FROM usage_rollups "
+              "WHERE granularity=? AND metric=? AND bucket_start >= ? AND bucket_start <= ? "
+              "ORDER BY bucket_start", (granularity, metric, start.strftime(fmt), end.strftime(fmt)))
+    rows = c.fetchall()
+    conn.close()
+    buckets = []
+    combined = {}
+    for bucket, count, total, lo, hi, hist_json in rows:
+        hist = json.loads(hist_json or '{}')
+        for idx, n in hist.items():
+            combined[idx] = combined.get(idx, 0) + n
+        valued = sum(hist.values())
+        buckets.append({"bucket": bucket, "count": count,
+                        "sum": round(total, 3) if valued else None,
+                        "avg": round(total / valued, 3) if valued else None,
+                        "min": lo, "max": hi,
+                        "p50": histogram_percentile(hist, 50, lo, hi),
+                        "p95": histogram_percentile(hist, 95, lo, hi)})
+    valued = sum(combined.values())
+    total_sum = sum(b["sum"] or 0 for b in buckets)
+    lows = [b["min"] for b in buckets if b["min"] is not None]
+    highs = [b["max"] for b in buckets if b["max"] is not None]
+    lo, hi = (min(lows) if lows else None), (max(highs) if highs else None)
+    summary = {"count": sum(b["count"] for b in buckets),
+               "avg": round(total_sum / valued, 3) if valued else None,
+               "p50": histogram_percentile(combined, 50, lo, hi),
+               "p95": histogram_percentile(combined, 95, lo, hi)}
+    return buckets, summary
+
+# ردود الأسئلة القصيرة المتكررة أو المتشابهة تقريباً، لكل عامل على حدة
+response_cache = ResponseCache(
+    normalize_search_text,
+    max_entries=int(os.environ.get('RESPONSE_CACHE_ENTRIES', 50000)),
+    max_bytes=int(float(os.environ.get('RESPONSE_CACHE_MB', 64)) * 1024 * 1024),
+    threshold=float(os.environ.get('RESPONSE_CACHE_THRESHOLD', 0.8)),
+    ttl=float(os.environ.get('RESPONSE_CACHE_TTL', 3600)),
+    max_prompt_chars=int(os.environ.get('RESPONSE_CACHE_MAX_PROMPT', 200)),
+)
+
+WARMUP_TOP_K = int(os.environ.get('WARMUP_TOP_K', 500))
+WARMUP_WINDOW_DAYS = float(os.environ.get('WARMUP_WINDOW_DAYS', 7))
+WARMUP_SECONDS = float(os.environ.get('WARMUP_SECONDS', 10))
+WARMUP_MB = float(os.environ.get('WARMUP_MB', 16))
+WARMUP_DELAY = float(os.environ.get('WARMUP_DELAY', 2))
+
+def warm_response_cache(top_k=WARMUP_TOP_K, window_days=WARMUP_WINDOW_DAYS,
+                        time_budget=WARMUP_SECONDS, memory_budget_mb=WARMUP_MB, delay=WARMUP_DELAY):
+    """تحميل ردود أكثر الأسئلة تكراراً في النافذة الأخيرة إلى response_cache.
+
+    التجميع يقرأ الفهرس المغطي (created_at, prompt_key) للنافذة فقط، ثم يُقرأ
+    أحدث صف لكل سؤال بالمفتاح الأساسي. يتوقف عند نفاد الوقت أو الذاكرة المحددين.
+    """
+    if not response_cache.enabled or top_k <= 0:
+        return
+    time.sleep(delay)
+    started = time.monotonic()
+    budget = memory_budget_mb * 1024 * 1024
+    loaded = used = 0
+    conn = sqlite3.connect('bot_data.db', check_same_thread=False)
+    try:
+        since = datetime.now() - timedelta(days=window_days)
+        top = conn.execute("""SELECT prompt_key, COUNT(*) AS hits, MAX(id) FROM web_messages
+                              WHERE created_at >= ? AND prompt_key IS NOT NULL
+                              GROUP BY prompt_key ORDER BY hits DESC LIMIT ?""",
+                           (since, top_k)).fetchall()
+        for _, hits, row_id in top:
+            if time.monotonic() - started > time_budget or used >= budget:
+                break
+            row = conn.execute("SELECT message, response FROM web_messages WHERE id=?",
+                               (row_id,)).fetchone()
+            if row is None:
+                continue
+            stored = response_cache.store(decompress_text(row[0]), decompress_text(row[1]))
+            if stored:
+                loaded += 1
+                used += stored
+        logger.info("response cache warmed", extra={"fields": {
+            "candidates": len(top), "loaded": loaded, "bytes": used,
+            "seconds": round(time.monotonic() - started, 3)}})
+    except Exception:
+        logger.exception("response cache warm-up failed")
+    finally:
+        conn.close()
+
+def ai_request_url(text):
+    """رابط طلب خادم الذكاء مع ترميز السؤال وقصه إلى AI_PROMPT_MAX_BYTES"""
+    encoded = text.encode('utf-8')
+    if len(encoded) > AI_PROMPT_MAX_BYTES:
+        text = encoded[:AI_PROMPT_MAX_BYTES].decode('utf-8', 'ignore')
+        count_ai_payload("truncated_prompts")
+    return f"{AI_API_URL}?{urlencode({'gpt-5-mini': text})}"
+
+def count_ai_payload(key, size=None):
+    with _payload_lock:
+        _payload_counts[key] += 1
+        if size is not None:
+            _payload_counts["bytes"] += size
+            _payload_counts["max_bytes"] = max(_payload_counts["max_bytes"], size)
+
+def record_ai_payload(size):
+    ai_payload_sizes.record(size)
+    rollups.record('upstream_bytes', size)
+    count_ai_payload("responses", size)
+
+def ai_payload_stats():
+    with _payload_lock:
+        stats = dict(_payload_counts)
+    stats.update(limit=AI_RESPONSE_MAX_BYTES, p50=ai_payload_sizes.percentile(50),
+                 p99=ai_payload_sizes.percentile(99))
+    return stats
+
+def ai_body_chunks(res, until):
+    """قطع جسم رد requests (stream=True) حتى الموعد `until` من time.monotonic().
+
+    مهلة requests تُطبق على كل قراءة من المقبس وحدها، فخادم يرسل بايتاً كل بضع
+    ثوانٍ يتجاوز الموعد النهائي. هنا كل قراءة تعيد ما وصل فقط (read1) ومهلة المقبس
+    لا تتجاوز الوقت المتبقي، ويُرفع ReadTimeout عند نفاده.
+    """
+    raw = res.raw
+    read = getattr(raw, 'read1', None) or raw.read
+    sock = getattr(raw.connection, 'sock', None) if raw.connection is not None else None
+    while True:
+        remaining = until - time.monotonic()
+        if remaining <= 0:
+            raise requests.ReadTimeout("upstream body not complete before the deadline")
+        if sock is not None:
+            sock.settimeout(remaining)
+        try:
+            chunk = read(AI_RESPONSE_CHUNK, decode_content=True)
+        except ReadTimeoutError as e:
+            raise requests.ReadTimeout(e) from e
+        if not chunk:
+            return
+        yield chunk
+
+def read_ai_reply(res, until):
+    """استخراج حقل response من رد requests (stream=True) دون تحميل الجسم كاملاً"""
+    extractor = ReplyExtractor('response', AI_RESPONSE_MAX_BYTES)
+    extractor.check_length(res.headers.get('Content-Length'))
+    for chunk in ai_body_chunks(res, until):
+        extractor.feed(chunk)
+    record_ai_payload(extractor.size)
+    return extractor.finish()
+
+def ai_request_timeout(deadline=None):
+    """(المهلة، قيمة المئين المرصودة) لطلب خادم الذكاء، أو None إن نفد وقت المستدعي"""
+    timeout, observed = ai_timeout_policy.current()
+    if deadline is not None:
+        timeout = min(timeout, deadline - time.monotonic())
+        if timeout <= 0:
+            logger.warning("upstream skipped: deadline exhausted")
+            return None
+    return timeout, observed
+
+def accept_ai_reply(text, reply, elapsed):
+    """تسجيل زمن طلب مكتمل وتخزين الرد في response_cache؛ يعيد (الرد، غير فارغ)"""
+    ai_latency.record(elapsed)
+    rollups.record('upstream_latency', elapsed)
+    if not isinstance(reply, str):
+        reply = None
+    traffic.record_upstream(text, elapsed, 'ok' if reply else 'empty', len(reply or ''))
+    if not reply:
+        return AI_EMPTY_REPLY, False
+    response_cache.store(text, reply)
+    return reply, True
+
+def record_ai_timeout(text, timeout, observed, elapsed):
+    ai_latency.record(elapsed)
+    rollups.record('upstream_errors')
+    traffic.record_upstream(text, elapsed, 'timeout')
+    logger.warning("upstream timeout", extra={"fields": {
+        "timeout_s": round(timeout, 2),
+        "percentile": ai_timeout_policy.percentile,
+        "percentile_value_s": round(observed, 3) if observed is not None else None,
+    }})
+    return AI_ERROR_REPLY
+
+def record_ai_error(text, e, elapsed):
+    rollups.record('upstream_errors')
+    if isinstance(e, PayloadTooLarge):
+        count_ai_payload("oversized")
+    elif isinstance(e, ValueError):
+        count_ai_payload("malformed")
+    traffic.record_upstream(text, elapsed, 'error')
+    logger.error("upstream error: %s", type(e).__name__, extra={"fields": {"error": str(e)}})
+    return AI_ERROR_REPLY
+
+def cached_ai_reply(text):
+    """رد response_cache أو None؛ يُفحص قبل ai_limiter فلا تُحسب الإصابات من الحد"""
+    cached = response_cache.lookup(text)
+    if cached is not None:
+        rollups.record('cache_hits')
+    return cached
+
+def get_ai_response(text, deadline=None):
+    """طلب رد من خادم الذكاء ضمن المهلة التكيفية والموعد النهائي للمستدعي.
+
+    `deadline` قيمة مطلقة من time.monotonic(); لا تتجاوز المهلة الوقت المتبقي منه.
+    يعيد (الرد، نجح)؛ عند المهلة أو الخطأ أو الرد الفارغ يكون الرد رسالة الخطأ
+    و`نجح` False حتى يتراجع ai_limiter.
+    """
+    budget = ai_request_timeout(deadline)
+    if budget is None:
+        return AI_ERROR_REPLY, False
+    timeout, observed = budget
+    started = time.monotonic()
     try:
-        res = requests.get(f"https://sii3.top/api/openai.php?gpt-5-mini={text}", timeout=500)
-        res.raise_for_status()
-        data = res.json()
-        return data.get("response", "❌ لا يوجد رد من الخادم")
+        with http.get(ai_request_url(text), timeout=(min(5.0, timeout), timeout), stream=True) as res:
+            res.raise_for_status()
+            reply = read_ai_reply(res, started + timeout)
+        return accept_ai_reply(text, reply, time.monotonic() - started)
+    except requests.Timeout:
+        return record_ai_timeout(text, timeout, observed, time.monotonic() - started), False
     except Exception as e:
-        print(f"AI Error: {e}")
-        return "⚠️ عذراً، حدث خطأ في المعالجة"
+        return record_ai_error(text, e, time.monotonic() - started), False
 
 @app.route('/api/verify-code', methods=['POST'])
 @verify_api_key
@@ -208,39 +1296,294 @@ def verify_code():
     
     return jsonify({"valid": False, "error": "رمز غير صالح أو منتهي"}), 403
 
-@app.route('/api/chat', methods=['POST'])
+@app.route('/api/history', methods=['GET'])
 @verify_api_key
-def web_chat():
+def chat_history():
+    """سجل الجلسة بترقيم بالمفتاح: ?session_id=&before=<id>&limit=
+
+    العناصر مصفوفات مضغوطة [id, message, response, created_at] بترتيب زمني،
+    و`before` للصفحة التالية هو id أقدم عنصر. الرد يحمل ETag ويُعاد 304 عند التطابق.
+    """
+    session_id = request.args.get('session_id')
+    if not session_id or not session_exists(session_id):
+        return jsonify({"error": "يجب تسجيل الدخول أولاً"}), 401
     try:
-        data = request.get_json()
-        message = data.get('message', '').strip()
-        session_id = data.get('session_id')
-        
-        if not message:
-            return jsonify({"error": "الرسالة فارغة"}), 400
-        
-        if not session_id:
-            return jsonify({"error": "يجب تسجيل الدخول أولاً"}), 401
-        
-        if not rate_limit_check(session_id):
-            return jsonify({
+        before_id = int(request.args['before']) if request.args.get('before') else None
+        limit = max(1, min(int(request.args.get('limit', 30)), 100))
+    except ValueError:
+        return jsonify({"error": "before/limit غير صالح"}), 400
+    
+    items = get_session_history(session_id, before_id, limit)
+    body = json.dumps({"items": items, "before": items[0][0] if len(items) == limit else None},
+                      ensure_ascii=False, separators=(',', ':'), default=str)
+    etag = hashlib.sha1(body.encode('utf-8')).hexdigest()[:20]
+    if etag in request.if_none_match:
+        response = Response(status=304)
+    else:
+        response = Response(body, mimetype='application/json')
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
+
+class ChatTurn:
+    """خطوات طلب محادثة واحد المشتركة بين المسار المتزامن (Flask وtelebot) وasgi.py.
+
+    النقل وحده يختلف بين المسارين (طلب خادم الذكاء ورد تلغرام)، وكل ما قبله وبعده هنا:
+
+        turn = WebChatTurn(data, idempotency_key)
+        try:
+            result = turn.admit()          # None للمتابعة، أو رد مبكر
+            if result is None:
+                if turn.reply is None:
+                    turn.answered(*get_ai_response(turn.prompt, turn.deadline))
+                result = turn.finish()
+        finally:
+            turn.close()                   # يحرر ما بقي محجوزاً عند الفشل
+
+    الدوال حاجبة (SQLite وshared_state)، فيستدعيها asgi.py عبر run_db.
+    """
+    source = None
+
+    def __init__(self, prompt, deadline):
+        self.prompt = prompt
+        self.deadline = deadline
+        self.reply = None
+        self.ok = False
+        self._holding = False
+        self.started = self.upstream_started = self.upstream_ended = time.monotonic()
+
+    def _admit_upstream(self):
+        """الرد من response_cache أو حجز مكان في ai_limiter؛ False إن كان الخادم مشغولاً"""
+        self.started = time.monotonic()
+        self.reply = cached_ai_reply(self.prompt)
+        if self.reply is None:
+            if not ai_limiter.try_acquire(self.source):
+                return False
+            self._holding = True
+        return True
+
+    def _ready(self):
+        self.upstream_started = self.upstream_ended = time.monotonic()
+
+    def answered(self, reply, ok):
+        """تسجيل رد خادم الذكاء وتحرير مكان ai_limiter"""
+        self.upstream_ended = time.monotonic()
+        self.reply, self.ok = reply, ok
+        self._release_limiter()
+
+    def _release_limiter(self):
+        if self._holding:
+            self._holding = False
+            ai_limiter.release(time.monotonic() - self.started, self.ok, self.source)
+
+    def close(self):
+        self._release_limiter()
+
+class WebChatTurn(ChatTurn):
+    """طلب POST /api/chat؛ `data` جسم JSON بعد فكه (None إن لم يكن صالحاً)"""
+    source = 'web'
+
+    def __init__(self, data, idempotency_key=None):
+        self.data = data if isinstance(data, dict) else None
+        message = (self.data or {}).get('message')
+        super().__init__(message.strip() if isinstance(message, str) else '',
+                         time.monotonic() + CHAT_DEADLINE_SECONDS)
+        self.session_id = (self.data or {}).get('session_id')
+        self.idempotency_key = idempotency_key
+        self.slot = None
+
+    def admit(self):
+        """التحقق والتكرار والحصة والقبول؛ يعيد None للمتابعة أو (الحالة، الجسم، ترويسات)"""
+        if self.data is None:
+            return 400, {"error": "طلب غير صالح"}, {}
+
+        if not self.prompt:
+            return 400, {"error": "الرسالة فارغة"}, {}
+
+        if not self.session_id:
+            return 401, {"error": "يجب تسجيل الدخول أولاً"}, {}
+
+        # إعادة المحاولة بنفس المفتاح تلتحق بالطلب الأصلي ولا تُحسب من الحصة
+        if self.idempotency_key:
+            if not _IDEMPOTENCY_KEY.match(self.idempotency_key):
+                return 400, {"error": "Idempotency-Key غير صالح"}, {}
+            slot = f"idem:{self.session_id}:{self.idempotency_key}"
+            stored = acquire_idempotency_slot(slot)
+            if stored is _IDEMPOTENCY_PENDING:
+                return 409, {"error": "الطلب الأصلي ما زال قيد المعالجة"}, {"Retry-After": "1"}
+            if stored is not None:
+                return 200, {**stored["body"], "replayed": True}, {"Idempotent-Replayed": "true"}
+            self.slot = slot
+
+        if not rate_limit_check(self.session_id):
+            return 429, {
                 "error": "لقد تجاوزت الحد الأقصى للطلبات. حاول مرة أخرى بعد ساعة.",
-                "session_id": session_id
-            }), 429
-        
-        update_rate_limit(session_id)
-        ai_response = get_ai_response(message)
-        save_web_message(session_id, message, ai_response)
-        
-        return jsonify({
-            "response": ai_response,
-            "session_id": session_id,
+                "session_id": self.session_id
+            }, {}
+
+        if not self._admit_upstream():
+            refund_rate_limit(self.session_id)
+            return 503, {"error": "الخادم مشغول حالياً، حاول مرة أخرى بعد قليل."}, \
+                {"Retry-After": str(ai_limiter.retry_after())}
+        update_rate_limit(self.session_id)
+        self._ready()
+        return None
+
+    def finish(self):
+        """حفظ الرد وتسجيله وإكمال مفتاح التكرار؛ يعيد (الحالة، الجسم، ترويسات)"""
+        saved_started = time.monotonic()
+        save_web_message(self.session_id, self.prompt, self.reply)
+        rollups.record('web_messages', len(self.reply))
+        logger.info("chat request", extra={"sample": True, "fields": {
+            "session": self.session_id[:8],
+            "admission_ms": round((self.upstream_started - self.started) * 1000, 1),
+            "upstream_ms": round((self.upstream_ended - self.upstream_started) * 1000, 1),
+            "save_ms": round((time.monotonic() - saved_started) * 1000, 1),
+        }})
+
+        payload = {
+            "response": self.reply,
+            "session_id": self.session_id,
             "timestamp": datetime.now().isoformat()
-        })
+        }
+        if self.slot:
+            complete_idempotency_slot(self.slot, payload)
+            self.slot = None
+        return 200, payload, {}
+
+    def close(self):
+        super().close()
+        # مفتاح طلب لم يكتمل يُحرر حتى تُنفَّذ إعادة المحاولة من جديد
+        release_idempotency_slot(self.slot)
+        self.slot = None
+
+CHAT_ERROR_RESULT = (500, {"error": "حدث خطأ في الخادم"}, {})
+
+def json_result(status, body, headers):
+    response = jsonify(body)
+    response.headers.update(headers)
+    return response, status
+
+@app.route('/api/chat', methods=['POST'])
+@verify_api_key
+def web_chat():
+    turn = WebChatTurn(request.get_json(silent=True), request.headers.get('Idempotency-Key'))
+    try:
+        result = turn.admit()
+        if result is None:
+            if turn.reply is None:
+                turn.answered(*get_ai_response(turn.prompt, turn.deadline))
+            result = turn.finish()
+    except Exception:
+        logger.exception("web_chat failed")
+        result = CHAT_ERROR_RESULT
+    finally:
+        turn.close()
+    return json_result(*result)
+
+@app.route('/api/admin/codes', methods=['POST'])
+@verify_api_key
+@verify_admin_key
+def mint_codes():
+    """إنشاء دفعة رموز وإعادتها كملف CSV"""
+    data = request.get_json() or {}
+    try:
+        count = int(data.get('count', 1))
+        max_uses = int(data.get('max_uses', 1))
+        days = data.get('expires_in_days')
+        expires_at = datetime.now() + timedelta(days=float(days)) if days else None
+        batch_label = data.get('batch_label') or default_batch_label()
+        max_uses = max_uses or -1
+        create_access_codes_bulk(0, count, max_uses, expires_at, batch_label)
+    except (TypeError, ValueError) as e:
+        return jsonify({"error": str(e)}), 400
     
-    except Exception as e:
-        print(f"Error in web_chat: {e}")
-        return jsonify({"error": "حدث خطأ في الخادم"}), 500
+    # التسمية فريدة لكل دفعة، فالتصدير من الجدول يطابق ما أُنشئ ويطابق GET /api/admin/codes
+    return Response(iter_codes_csv(batch_label), mimetype='text/csv', headers={
+        'Content-Disposition': f'attachment; filename="{batch_label}.csv"'})
+
+@app.route('/api/admin/codes', methods=['GET'])
+@verify_api_key
+@verify_admin_key
+def export_codes():
+    """تصدير رموز دفعة موجودة كملف CSV"""
+    batch_label = request.args.get('batch', '')
+    if not batch_label:
+        return jsonify({"error": "batch مطلوب"}), 400
+    return Response(iter_codes_csv(batch_label), mimetype='text/csv', headers={
+        'Content-Disposition': f'attachment; filename="{batch_label}.csv"'})
+
+@app.route('/api/admin/export/<kind>', methods=['GET'])
+@verify_api_key
+@verify_admin_key
+def export_table(kind):
+    """تصدير متدفق: ?format=csv|ndjson&from=&to=&session_id=&gzip=1
+
+    للاستئناف بعد انقطاع: ?cursor=<X-Export-Cursor>&after=<آخر id مستلم>
+    """
+    if kind not in EXPORT_TABLES:
+        return jsonify({"error": "النوع يجب أن يكون messages أو sessions"}), 404
+    fmt = request.args.get('format', 'ndjson')
+    if fmt not in ('csv', 'ndjson'):
+        return jsonify({"error": "format يجب أن يكون csv أو ndjson"}), 400
+    try:
+        after = int(request.args.get('after', 0))
+        if 'cursor' in request.args:
+            token = request.args['cursor']
+            state = parse_export_cursor(token)
+            if state["k"] != kind:
+                raise ValueError("رمز التصدير لنوع آخر")
+        else:
+            start = datetime.fromisoformat(request.args['from']) if 'from' in request.args else None
+            end = datetime.fromisoformat(request.args['to']) if 'to' in request.args else None
+            token = make_export_cursor(kind, start, end, request.args.get('session_id') or None)
+            state = parse_export_cursor(token)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    compress = request.args.get('gzip') == '1'
+    filename = f"{kind}-{datetime.now().strftime('%Y%m%d-%H%M%S')}.{fmt}" + ('.gz' if compress else '')
+    mimetype = 'application/gzip' if compress else ('text/csv' if fmt == 'csv' else 'application/x-ndjson')
+    return Response(iter_export(state, fmt, after, compress), mimetype=mimetype, headers={
+        'Content-Disposition': f'attachment; filename="{filename}"',
+        'X-Export-Cursor': token,
+    })
+
+@app.route('/api/admin/search', methods=['GET'])
+@verify_api_key
+@verify_admin_key
+def admin_search():
+    """بحث نصي مرتب في سجل المحادثات"""
+    query = request.args.get('q', '').strip()
+    if not query:
+        return jsonify({"error": "q مطلوب"}), 400
+    try:
+        page = int(request.args.get('page', 1))
+        page_size = int(request.args.get('page_size', 20))
+    except ValueError:
+        return jsonify({"error": "page غير صالح"}), 400
+    results = search_messages(query, page, page_size)
+    return jsonify({"query": query, "page": page, "results": results,
+                    "next_page": page + 1 if len(results) == max(1, min(page_size, 100)) else None})
+
+@app.route('/api/analytics', methods=['GET'])
+@verify_api_key
+@verify_admin_key
+def analytics():
+    """اتجاهات الاستخدام من جداول التجميع: ?metric=&from=&to=&granularity=hour|day"""
+    metric = request.args.get('metric', 'web_messages')
+    granularity = request.args.get('granularity', 'hour')
+    if granularity not in ROLLUP_GRANULARITIES:
+        return jsonify({"error": "granularity يجب أن يكون hour أو day"}), 400
+    try:
+        end = datetime.fromisoformat(request.args['to']) if 'to' in request.args else datetime.now()
+        start = (datetime.fromisoformat(request.args['from']) if 'from' in request.args
+                 else end - timedelta(days=7))
+    except ValueError:
+        return jsonify({"error": "from/to يجب أن تكون بصيغة ISO 8601"}), 400
+    buckets, summary = query_rollups(metric, start, end, granularity)
+    return jsonify({"metric": metric, "granularity": granularity,
+                    "from": start.isoformat(), "to": end.isoformat(),
+                    "summary": summary, "buckets": buckets})
 
 @bot.message_handler(commands=['start'])
 def send_welcome(message):
@@ -280,10 +1623,14 @@ def show_help(message):
 للمشرفين:
 /gencode - إنشاء رمز دخول جديد
 /gencode <عدد> - رمز بعدد استخدامات محدد
+/gencode <عدد> x<كمية> [أيام d] [تسمية] - دفعة رموز كملف CSV
 /listcodes - عرض جميع الرموز
+/listcodes <رمز> - الصفحة التالية من الرموز
+/search <نص> - البحث في سجل محادثات الموقع
 /ban - حظر مستخدم
 /unban - إلغاء حظر مستخدم
 /stats - إحصائيات البوت
+/backup - نسخة احتياطية فورية من قاعدة البيانات
         """
     else:
         help_text = """
@@ -297,6 +1644,22 @@ def show_help(message):
     
     bot.reply_to(message, help_text)
 
+def parse_gencode_args(parts):
+    """تحليل: /gencode [استخدامات] [x<عدد>] [<أيام>d] [تسمية]"""
+    max_uses, count, days, label = 1, None, None, None
+    for part in parts:
+        if part.lower().startswith('x') and part[1:].isdigit():
+            count = int(part[1:])
+        elif part.lower().endswith('d') and part[:-1].isdigit():
+            days = int(part[:-1])
+        elif part.lstrip('-').isdigit():
+            max_uses = int(part)
+        else:
+            label = part
+    if max_uses == 0:
+        max_uses = -1  # استخدام غير محدود
+    return max_uses, count, days, label
+
 @bot.message_handler(commands=['gencode'])
 def generate_code(message):
     user_id = message.from_user.id
@@ -306,14 +1669,20 @@ def generate_code(message):
         return
     
     try:
-        parts = message.text.split()
-        max_uses = int(parts[1]) if len(parts) > 1 else 1
+        max_uses, count, days, label = parse_gencode_args(message.text.split()[1:])
+        uses_text = "غير محدود" if max_uses == -1 else str(max_uses)
         
-        if max_uses == 0:
-            max_uses = -1  # استخدام غير محدود
+        if count is not None:
+            expires_at = datetime.now() + timedelta(days=days) if days else None
+            label = label or default_batch_label()
+            create_access_codes_bulk(user_id, count, max_uses, expires_at, label)
+            document = io.BytesIO("".join(iter_codes_csv(label)).encode('utf-8'))
+            bot.send_document(message.chat.id, document, visible_file_name=f"{label}.csv",
+                              reply_to_message_id=message.message_id,
+                              caption=f"✅ تم إنشاء {count} رمز\n🏷️ الدفعة: {label}\n📊 عدد الاستخدامات: {uses_text}")
+            return
         
         code = create_access_code(user_id, max_uses)
-        uses_text = "غير محدود" if max_uses == -1 else str(max_uses)
         
         bot.reply_to(message, f"""
 ✅ تم إنشاء رمز دخول جديد!
@@ -334,24 +1703,55 @@ def list_codes(message):
         bot.reply_to(message, "❌ ليس لديك صلاحية لهذا الأمر.")
         return
     
-    conn = sqlite3.connect('bot_data.db', check_same_thread=False)
-    c = conn.cursor()
-    c.execute("SELECT code, used_count, max_uses, active FROM access_codes ORDER BY created_at DESC LIMIT 10")
-    codes = c.fetchall()
-    conn.close()
+    parts = message.text.split()
+    after_code = parts[1] if len(parts) > 1 else None
+    codes = list_access_codes_page(after_code, 10)
     
     if not codes:
         bot.reply_to(message, "لا توجد رموز متاحة.")
         return
     
-    codes_text = "📋 آخر 10 رموز:\n\n"
+    codes_text = "📋 آخر 10 رموز:\n\n" if not after_code else "📋 الرموز التالية:\n\n"
     for code, used, max_uses, active in codes:
         status = "🟢 نشط" if active else "🔴 معطل"
         uses_text = "غير محدود" if max_uses == -1 else f"{used}/{max_uses}"
         codes_text += f"`{code[:8]}...` - {uses_text} {status}\n"
     
+    if len(codes) == 10:
+        codes_text += f"\n➡️ للصفحة التالية:\n`/listcodes {codes[-1][0]}`"
+    
     bot.reply_to(message, codes_text, parse_mode='Markdown')
 
+@bot.message_handler(commands=['search'])
+def search_command(message):
+    user_id = message.from_user.id
+    
+    if user_id not in ADMINS:
+        bot.reply_to(message, "❌ ليس لديك صلاحية لهذا الأمر.")
+        return
+    
+    parts = message.text.split(maxsplit=1)
+    if len(parts) < 2:
+        bot.reply_to(message, "استخدم: /search <نص> أو /search <صفحة> <نص>")
+        return
+    
+    query = parts[1]
+    page = 1
+    first, _, rest = query.partition(' ')
+    if first.isdigit() and rest:
+        page, query = int(first), rest
+    
+    results = search_messages(query, page, 10)
+    if not results:
+        bot.reply_to(message, "🔍 لا توجد نتائج.")
+        return
+    
+    lines = [f"🔍 نتائج البحث (صفحة {page}):\n"]
+    for r in results:
+        text = (r["message"] or "").replace("\n", " ")
+        lines.append(f"#{r['id']} | {r['session_id'][:8]} | {str(r['created_at'])[:16]}\n{text[:150]}\n")
+    bot.reply_to(message, "\n".join(lines))
+
 @bot.message_handler(commands=['subscribe'])
 def subscribe_cmd(message):
     user_id = message.from_user.id
@@ -413,35 +1813,269 @@ def stats_command(message):
     
     bot.reply_to(message, stats_text)
 
-@bot.message_handler(func=lambda message: True)
-def handle_all_messages(message):
+@bot.message_handler(commands=['backup'])
+def backup_command(message):
     user_id = message.from_user.id
-    user_name = message.from_user.first_name
     
-    if is_banned(user_id):
-        bot.reply_to(message, "❌ تم حظرك من استخدام البوت.")
+    if user_id not in ADMINS:
+        bot.reply_to(message, "❌ ليس لديك صلاحية لهذا الأمر.")
         return
-        
+    
+    try:
+        stats = run_backup(reason=f"admin:{user_id}")
+    except Exception as e:
+        logger.exception("admin backup failed")
+        bot.reply_to(message, f"❌ فشل النسخ الاحتياطي: {str(e)}")
+        return
+    
+    if stats is None:
+        bot.reply_to(message, "⏳ يوجد نسخ احتياطي قيد التنفيذ، حاول لاحقاً.")
+        return
+    
+    bot.reply_to(message, f"""
+✅ تم إنشاء نسخة احتياطية
+
+📁 {os.path.basename(stats['path'])}
+📦 الحجم: {stats['stored_bytes'] // 1024} KB
+⏱️ المدة: {stats['seconds']} ثانية
+🔐 sha256: {stats['sha256'][:16]}…
+    """)
+
+class MessageBatcher:
+    """دمج الرسائل المتتالية من نفس المحادثة خلال نافذة انتظار قصيرة.
+
+    تُعاد جدولة التفريغ مع كل رسالة جديدة، ولا يتجاوز الانتظار منذ أول رسالة
+    `max_wait` ثانية. خيط جدولة واحد لكل عملية يُسلِّم الدفعة المستحقة إلى
+    `submit(fn, *args)` (مجموعة خيوط البوت) فيُحد عدد التفريغات المتزامنة، ولا
+    تُفرَّغ دفعتان لنفس المحادثة في نفس الوقت: الدفعة الجديدة تنتظر انتهاء
+    السابقة فتصل الردود بالترتيب.
+
+    الدفعات في ذاكرة العملية: مع webhook وأكثر من عامل gunicorn قد تصل رسائل
+    المحادثة الواحدة إلى عمال مختلفين فلا تُدمج. الدمج الكامل يتطلب عاملاً واحداً
+    (WEB_CONCURRENCY=1) أو TELEGRAM_MODE=polling حيث يستقبل عامل واحد كل التحديثات.
+    """
+
+    def __init__(self, flush, window, max_wait, submit):
+        self._lock = threading.Condition()
+        self._pending = {}        # chat -> الدفعة المفتوحة
+        self._flushing = {}       # chat -> deque الدفعات المنتظرة خلف تفريغ جارٍ
+        self._timers = []         # heap من (الموعد، رقم، chat، الدفعة)
+        self._sequence = 0
+        self._thread_pid = None
+        self.flush = flush
+        self.submit = submit
+        self.window = window
+        self.max_wait = max_wait
+        self.messages_in = 0
+        self.batches_out = 0
+
+    def add(self, message):
+        chat_id = message.chat.id
+        now = time.monotonic()
+        self._ensure_thread()
+        with self._lock:
+            self.messages_in += 1
+            batch = self._pending.get(chat_id)
+            if batch is None:
+                batch = {"messages": [], "first_at": now, "due": None}
+                self._pending[chat_id] = batch
+            batch["messages"].append(message)
+            batch["due"] = now + max(0.0, min(self.window, batch["first_at"] + self.max_wait - now))
+            self._sequence += 1
+            heapq.heappush(self._timers, (batch["due"], self._sequence, chat_id, batch))
+            self._lock.notify()
+
+    def _ensure_thread(self):
+        # خيط الجدولة لا ينتقل مع fork
+        if self._thread_pid == os.getpid():
+            return
+        with self._lock:
+            if self._thread_pid != os.getpid():
+                threading.Thread(target=self._run_timers, daemon=True, name="batcher").start()
+                self._thread_pid = os.getpid()
+
+    def _run_timers(self):
+        with self._lock:
+            while True:
+                now = time.monotonic()
+                while self._timers and self._timers[0][0] <= now:
+                    due, _, chat_id, batch = heapq.heappop(self._timers)
+                    # المواعيد القديمة لدفعة أُعيدت جدولتها تُتجاهل
+                    if self._pending.get(chat_id) is batch and batch["due"] == due:
+                        del self._pending[chat_id]
+                        self.batches_out += 1
+                        if chat_id in self._flushing:
+                            self._flushing[chat_id].append(batch)
+                        else:
+                            self._flushing[chat_id] = collections.deque()
+                            self.submit(self._flush_chat, chat_id, batch)
+                self._lock.wait(self._timers[0][0] - now if self._timers else None)
+
+    def _flush_chat(self, chat_id, batch):
+        while batch is not None:
+            try:
+                self.flush(batch["messages"], batch["first_at"])
+            except Exception:
+                logger.exception("message batch failed")
+            with self._lock:
+                waiting = self._flushing[chat_id]
+                if waiting:
+                    batch = waiting.popleft()
+                else:
+                    del self._flushing[chat_id]
+                    batch = None
+
+    def stats(self):
+        with self._lock:
+            ratio = self.messages_in / self.batches_out if self.batches_out else 0.0
+            return {
+                "messages_in": self.messages_in,
+                "batches_out": self.batches_out,
+                "merge_ratio": round(ratio, 3),
+                "pending_chats": len(self._pending),
+                "flushing_chats": len(self._flushing),
+            }
+
+class TelegramTurn(ChatTurn):
+    """رسالة تلغرام (أو دفعة مدموجة) قبل طلب خادم الذكاء وبعد الرد؛ انظر ChatTurn"""
+    source = 'bot'
+    BUSY_REPLY = "⏳ البوت مشغول حالياً، حاول مرة أخرى بعد قليل."
+
+    def __init__(self, texts, received_at):
+        super().__init__("\n".join(t for t in texts if t), received_at + CHAT_DEADLINE_SECONDS)
+        self.received_at = received_at
+        self.batched = len(texts)
+
+    def admit(self):
+        """يعيد None للمتابعة، أو نص الرد إن كان الخادم مشغولاً"""
+        if not self._admit_upstream():
+            return self.BUSY_REPLY
+        self._ready()
+        return None
+
+    def finish(self):
+        """بعد إرسال الرد إلى تلغرام"""
+        rollups.record('telegram_messages', len(self.reply))
+        logger.info("telegram message", extra={"sample": True, "fields": {
+            "batched": self.batched,
+            "queue_ms": round((self.started - self.received_at) * 1000, 1),
+            "upstream_ms": round((self.upstream_ended - self.upstream_started) * 1000, 1),
+            "reply_ms": round((time.monotonic() - self.upstream_ended) * 1000, 1),
+        }})
+
+def telegram_refusal(user_id, first_name):
+    """نص الرفض لمستخدم محظور أو غير مشترك، أو None"""
+    if is_banned(user_id):
+        return "❌ تم حظرك من استخدام البوت."
     if not is_subscribed(user_id):
-        bot.reply_to(message, f"⚠️ عذراً {user_name},\nيجب الاشتراك لاستخدام البوت.\n\nاستخدم /subscribe للاشتراك")
+        return f"⚠️ عذراً {first_name},\nيجب الاشتراك لاستخدام البوت.\n\nاستخدم /subscribe للاشتراك"
+    return None
+
+def answer_messages(messages, received_at):
+    """إرسال رسالة واحدة أو دفعة مدموجة إلى خادم الذكاء والرد على آخرها"""
+    message = messages[-1]
+    request_id_var.set(f"tg-{message.chat.id}-{message.message_id}")
+    
+    turn = TelegramTurn([m.text for m in messages], received_at)
+    try:
+        busy = turn.admit()
+        if busy:
+            bot.reply_to(message, busy)
+            return
+        if turn.reply is None:
+            bot.send_chat_action(message.chat.id, 'typing')
+            turn.answered(*get_ai_response(turn.prompt, turn.deadline))
+    finally:
+        turn.close()
+    bot.reply_to(message, turn.reply)
+    turn.finish()
+
+# نافذة دمج الرسائل بالمللي ثانية (0 = معطل)
+TELEGRAM_DEBOUNCE_MS = int(os.environ.get('TELEGRAM_DEBOUNCE_MS', 0))
+TELEGRAM_DEBOUNCE_MAX_MS = int(os.environ.get('TELEGRAM_DEBOUNCE_MAX_MS', 3000))
+message_batcher = MessageBatcher(answer_messages, TELEGRAM_DEBOUNCE_MS / 1000.0,
+                                 TELEGRAM_DEBOUNCE_MAX_MS / 1000.0,
+                                 submit=lambda fn, *args: bot.worker_pool.put(fn, *args))
+
+@bot.message_handler(func=lambda message: True)
+def handle_all_messages(message):
+    received_at = time.monotonic()
+    refusal = telegram_refusal(message.from_user.id, message.from_user.first_name)
+    if refusal:
+        bot.reply_to(message, refusal)
         return
     
-    bot.send_chat_action(message.chat.id, 'typing')
-    response = get_ai_response(message.text)
-    bot.reply_to(message, response)
+    if TELEGRAM_DEBOUNCE_MS > 0:
+        message_batcher.add(message)
+    else:
+        answer_messages([message], received_at)
 
 @app.route('/webhook', methods=['POST'])
 def webhook():
     if request.headers.get('content-type') == 'application/json':
-        json_string = request.get_data().decode('utf-8')
-        update = telebot.types.Update.de_json(json_string)
+        raw = request.get_json(silent=True)
+        if not isinstance(raw, dict):
+            return 'Invalid JSON', 400
+        update = telebot.types.Update.de_json(raw)
         bot.process_new_updates([update])
         return '', 200
     else:
         return 'Invalid content type', 403
 
-@app.route('/')
-def home():
+def polling_enabled():
+    return bool(BOT_TOKEN) and TELEGRAM_MODE == 'polling'
+
+def process_raw_update(raw):
+    bot.process_new_updates([telebot.types.Update.de_json(raw)])
+
+telegram_poller = None
+POLLER_LOCK_TTL = 30
+
+def run_polling():
+    """تشغيل UpdatePoller في عامل واحد فقط؛ تلغرام يرفض getUpdates المتزامن (409).
+
+    العمال الآخرون ينتظرون قفل shared_state ويتولى أحدهم الاستقبال إن توقف المالك.
+    القفل يُجدَّد فقط ما دام run() يعمل، ويُحرَّر عند خروجه.
+    """
+    global telegram_poller
+    owner = os.getpid()
+    while not shared_state.compare_and_set("telegram:poller", None, owner, ttl=POLLER_LOCK_TTL):
+        time.sleep(POLLER_LOCK_TTL / 2)
+    # المعالجات تعمل داخل خيوط الاستقبال نفسها حتى يبقى ترتيب كل محادثة محفوظاً
+    bot.threaded = False
+    telegram_poller = UpdatePoller(BOT_TOKEN, process_raw_update, 'bot_data.db', TELEGRAM_API_URL,
+                                   timeout=TELEGRAM_POLL_TIMEOUT, limit=TELEGRAM_POLL_LIMIT,
+                                   workers=BOT_THREADS)
+    finished = threading.Event()
+    
+    def keep_lock():
+        # خطأ عابر (قاعدة مقفلة، انقطاع Redis) يُعاد في الدورة التالية؛ إن لم ينجح
+        # التجديد قبل انتهاء TTL فقد يأخذ عامل آخر القفل، فيتوقف الاستقبال هنا
+        renewed_at = time.monotonic()
+        while not finished.wait(POLLER_LOCK_TTL / 3):
+            try:
+                held = shared_state.compare_and_set("telegram:poller", owner, owner, ttl=POLLER_LOCK_TTL)
+            except Exception:
+                logger.warning("telegram poller lock renewal failed", exc_info=True)
+                if time.monotonic() - renewed_at < POLLER_LOCK_TTL:
+                    continue
+                held = False
+            if not held:
+                logger.warning("telegram poller lock lost, stopping")
+                telegram_poller.stop()
+                return
+            renewed_at = time.monotonic()
+    
+    threading.Thread(target=keep_lock, daemon=True).start()
+    logger.info("telegram polling started", extra={"fields": {"workers": BOT_THREADS}})
+    try:
+        telegram_poller.run()
+    finally:
+        finished.set()
+        shared_state.compare_and_set("telegram:poller", owner, None)
+        logger.info("telegram polling stopped")
+
+def render_home_page():
     return f"""<!DOCTYPE html>
 <html lang="ar" dir="rtl">
 <head>
@@ -544,27 +2178,15 @@ body {{
     pointer-events: none;
 }}
 
-.star {{
-    position: absolute;
-    width: 2px;
-    height: 2px;
-    background: white;
-    border-radius: 50%;
-    animation: twinkle 3s infinite;
-}}
-
-@keyframes twinkle {{
-    0%, 100% {{ opacity: 0.3; transform: scale(1); }}
-    50% {{ opacity: 1; transform: scale(1.5); }}
-}}
-
 #spider {{
     position: fixed;
+    top: 0;
+    left: 0;
     width: 40px;
     height: 40px;
     z-index: 999;
     pointer-events: none;
-    transition: transform 0.1s;
+    will-change: transform;
 }}
 
 .spider-body {{
@@ -806,24 +2428,14 @@ body {{
     background: linear-gradient(135deg, #8a2be2, #ff006e);
     color: white;
     border-bottom-right-radius: 5px;
-    animation: messageGlow 2s infinite alternate;
-}}
-
-@keyframes messageGlow {{
-    0% {{ box-shadow: 0 5px 15px rgba(138, 43, 226, 0.5); }}
-    100% {{ box-shadow: 0 5px 25px rgba(255, 0, 110, 0.7); }}
+    box-shadow: 0 5px 20px rgba(138, 43, 226, 0.6);
 }}
 
 .message.bot .message-content {{
     background: linear-gradient(135deg, rgba(58, 134, 255, 0.9), rgba(6, 255, 165, 0.9));
     color: white;
     border-bottom-left-radius: 5px;
-    animation: botGlow 2s infinite alternate;
-}}
-
-@keyframes botGlow {{
-    0% {{ box-shadow: 0 5px 15px rgba(58, 134, 255, 0.5); }}
-    100% {{ box-shadow: 0 5px 25px rgba(6, 255, 165, 0.7); }}
+    box-shadow: 0 5px 20px rgba(58, 134, 255, 0.6);
 }}
 
 .input-area {{
@@ -905,6 +2517,20 @@ body {{
     30% {{ transform: translateY(-12px); opacity: 0.7; }}
 }}
 
+/* وضع الأداء المنخفض: خلفية ثابتة بدون حركة مستمرة */
+.low-cpu .light,
+.low-cpu .container,
+.low-cpu .header h1,
+.low-cpu .header::before {{ animation: none; }}
+.low-cpu .header::before {{ display: none; }}
+.low-cpu .container {{ backdrop-filter: none; background: rgba(20, 20, 30, 0.95); }}
+.low-cpu #spider {{ display: none; }}
+
+@media (prefers-reduced-motion: reduce) {{
+    *, *::before, *::after {{ animation: none !important; transition: none !important; }}
+    #spider {{ display: none; }}
+}}
+
 @media (max-width: 768px) {{
     .container {{ 
         width: 100%; 
@@ -928,7 +2554,7 @@ body {{
     <div class="light"></div>
 </div>
 
-<div class="stars" id="stars"></div>
+<canvas class="stars" id="stars"></canvas>
 
 <div id="spider">
     <div class="spider-leg"></div>
@@ -971,35 +2597,66 @@ body {{
 </div>
 
 <script>
-// إنشاء النجوم
-const starsContainer = document.getElementById('stars');
+// وضع الأداء المنخفض: ?lowcpu=1 أو localStorage.lowCpu أو prefers-reduced-motion،
+// ويُفعَّل تلقائياً إذا كانت الإطارات الأولى بطيئة
+const pageParams = new URLSearchParams(window.location.search);
+const reducedMotion = window.matchMedia('(prefers-reduced-motion: reduce)');
+let lowCpu = pageParams.get('lowcpu') === '1' || localStorage.getItem('lowCpu') === '1' || reducedMotion.matches;
+
+// النجوم على لوحة رسم واحدة بدلاً من 100 عنصر DOM
+const starsCanvas = document.getElementById('stars');
+const starsCtx = starsCanvas.getContext('2d');
+const stars = [];
 for (let i = 0; i < 100; i++) {{
-    const star = document.createElement('div');
-    star.className = 'star';
-    star.style.left = Math.random() * 100 + '%';
-    star.style.top = Math.random() * 100 + '%';
-    star.style.animationDelay = Math.random() * 3 + 's';
-    starsContainer.appendChild(star);
+    stars.push({{ x: Math.random(), y: Math.random(), phase: Math.random() * Math.PI * 2 }});
+}}
+
+function resizeStars() {{
+    const ratio = Math.min(window.devicePixelRatio || 1, 2);
+    starsCanvas.width = window.innerWidth * ratio;
+    starsCanvas.height = window.innerHeight * ratio;
+    starsCtx.setTransform(ratio, 0, 0, ratio, 0, 0);
 }}
 
-// العنكبوت المتحرك
+function drawStars(t) {{
+    const w = window.innerWidth;
+    const h = window.innerHeight;
+    starsCtx.clearRect(0, 0, w, h);
+    starsCtx.fillStyle = 'white';
+    for (const star of stars) {{
+        const twinkle = lowCpu ? 0.6 : 0.5 + 0.5 * Math.sin(t / 480 + star.phase);
+        starsCtx.globalAlpha = 0.3 + 0.7 * twinkle;
+        const size = 2 + twinkle;
+        starsCtx.fillRect(star.x * w, star.y * h, size, size);
+    }}
+    starsCtx.globalAlpha = 1;
+}}
+
+// العنكبوت المتحرك: مواقع الأضواء تُخزَّن وتُحدَّث كل ثانية بدلاً من كل إطار
 const spider = document.getElementById('spider');
+const lights = Array.from(document.querySelectorAll('.light'));
+let lightCenters = [];
+let lightsMeasuredAt = -Infinity;
 let spiderX = Math.random() * window.innerWidth;
 let spiderY = Math.random() * window.innerHeight;
 let targetLight = 0;
 
-function moveSpider() {{
-    const lights = document.querySelectorAll('.light');
+function measureLights(t) {{
+    lightCenters = lights.map(light => {{
+        const rect = light.getBoundingClientRect();
+        return {{ x: rect.left + rect.width / 2, y: rect.top + rect.height / 2 }};
+    }});
+    lightsMeasuredAt = t;
+}}
+
+function moveSpider(t) {{
     if (lights.length === 0) return;
+    if (t - lightsMeasuredAt > 1000) measureLights(t);
     
-    const target = lights[targetLight];
-    const rect = target.getBoundingClientRect();
-    const targetX = rect.left + rect.width / 2;
-    const targetY = rect.top + rect.height / 2;
-    
-    const dx = targetX - spiderX;
-    const dy = targetY - spiderY;
-    const distance = Math.sqrt(dx * dx + dy * dy);
+    const target = lightCenters[targetLight];
+    const dx = target.x - spiderX;
+    const dy = target.y - spiderY;
+    const distance = Math.sqrt(dx * dx + dy * dy) || 1;
     
     if (distance < 100) {{
         targetLight = (targetLight + 1) % lights.length;
@@ -1009,15 +2666,89 @@ function moveSpider() {{
     spiderX += (dx / distance) * speed;
     spiderY += (dy / distance) * speed;
     
-    spider.style.left = spiderX + 'px';
-    spider.style.top = spiderY + 'px';
-    
     const angle = Math.atan2(dy, dx) * 180 / Math.PI;
-    spider.style.transform = `rotate(${{angle}}deg)`;
-    
-    requestAnimationFrame(moveSpider);
+    spider.style.transform = `translate3d(${{spiderX}}px, ${{spiderY}}px, 0) rotate(${{angle}}deg)`;
+}}
+
+// حلقة رسم واحدة تتوقف عند إخفاء التبويب أو في وضع الأداء المنخفض
+let frameId = null;
+let lastStarsDraw = 0;
+let slowFrames = 0;
+let sampledFrames = 0;
+let lastFrame = 0;
+
+function frame(t) {{
+    if (lastFrame && sampledFrames < 120) {{
+        sampledFrames++;
+        if (t - lastFrame > 34) slowFrames++;
+        if (sampledFrames === 120 && slowFrames > 40) setLowCpu(true);
+    }}
+    lastFrame = t;
+    moveSpider(t);
+    if (t - lastStarsDraw > 80) {{
+        drawStars(t);
+        lastStarsDraw = t;
+    }}
+    frameId = lowCpu ? null : requestAnimationFrame(frame);
+}}
+
+function startAnimation() {{
+    if (frameId === null && !lowCpu && !document.hidden) {{
+        lastFrame = 0;
+        frameId = requestAnimationFrame(frame);
+    }}
+}}
+
+function stopAnimation() {{
+    if (frameId !== null) cancelAnimationFrame(frameId);
+    frameId = null;
+}}
+
+function setLowCpu(on) {{
+    lowCpu = on;
+    document.documentElement.classList.toggle('low-cpu', on);
+    if (on) {{
+        stopAnimation();
+        drawStars(0);
+    }} else {{
+        startAnimation();
+    }}
+}}
+
+document.addEventListener('visibilitychange', () => {{
+    if (document.hidden) stopAnimation();
+    else startAnimation();
+}});
+reducedMotion.addEventListener('change', (e) => setLowCpu(e.matches || localStorage.getItem('lowCpu') === '1'));
+window.addEventListener('resize', () => {{
+    resizeStars();
+    drawStars(performance.now());
+    lightsMeasuredAt = -Infinity;
+}});
+
+resizeStars();
+setLowCpu(lowCpu);
+drawStars(0);
+
+// قياس زمن الإطارات: ?fps=1 يطبع المتوسط وp50 وp95 في وحدة التحكم بعد 5 ثوانٍ (benchmarks/frames.py)
+if (pageParams.get('fps') === '1') {{
+    const deltas = [];
+    let prev = performance.now();
+    const until = prev + 5000;
+    const sample = (t) => {{
+        deltas.push(t - prev);
+        prev = t;
+        if (t < until) {{
+            requestAnimationFrame(sample);
+        }} else {{
+            deltas.sort((a, b) => a - b);
+            const avg = deltas.reduce((a, b) => a + b, 0) / deltas.length;
+            const pct = (p) => deltas[Math.floor(deltas.length * p)].toFixed(1);
+            console.log(`frames=${{deltas.length}} avg=${{avg.toFixed(1)}}ms p50=${{pct(0.5)}}ms p95=${{pct(0.95)}}ms lowCpu=${{lowCpu}}`);
+        }}
+    }};
+    requestAnimationFrame(sample);
 }}
-moveSpider();
 
 // نظام تسجيل الدخول
 const API_URL = window.location.origin + '/api/chat';
@@ -1033,10 +2764,123 @@ const chatBox = document.getElementById('chatBox');
 const messageInput = document.getElementById('messageInput');
 const sendBtn = document.getElementById('sendBtn');
 
+// سجل المحادثة: تحميل كسول للصفحات الأقدم مع نافذة محدودة من عناصر DOM
+const HISTORY_URL = window.location.origin + '/api/history';
+const WINDOW_SIZE = 120;
+const WINDOW_STEP = 40;
+const entries = [];
+const renderedNodes = [];
+let windowStart = 0;
+let windowEnd = 0;
+let oldestId = null;
+let hasMoreHistory = true;
+let loadingHistory = false;
+
+function createMessageNode(entry) {{
+    const messageDiv = document.createElement('div');
+    messageDiv.className = `message ${{entry.type}}`;
+    const contentDiv = document.createElement('div');
+    contentDiv.className = 'message-content';
+    contentDiv.textContent = entry.text;
+    messageDiv.appendChild(contentDiv);
+    return messageDiv;
+}}
+
+function firstRenderedAnchor() {{
+    return renderedNodes.length ? renderedNodes[0] : null;
+}}
+
+function trimBottom() {{
+    while (windowEnd - windowStart > WINDOW_SIZE) {{
+        renderedNodes.pop().remove();
+        windowEnd--;
+    }}
+}}
+
+function trimTop() {{
+    const before = chatBox.scrollHeight;
+    while (windowEnd - windowStart > WINDOW_SIZE) {{
+        renderedNodes.shift().remove();
+        windowStart++;
+    }}
+    chatBox.scrollTop -= before - chatBox.scrollHeight;
+}}
+
+function shiftWindowUp() {{
+    const newStart = Math.max(0, windowStart - WINDOW_STEP);
+    if (newStart === windowStart) return;
+    const anchor = firstRenderedAnchor();
+    const fragment = document.createDocumentFragment();
+    const nodes = entries.slice(newStart, windowStart).map(createMessageNode);
+    nodes.forEach(node => fragment.appendChild(node));
+    const before = chatBox.scrollHeight;
+    chatBox.insertBefore(fragment, anchor);
+    renderedNodes.unshift(...nodes);
+    windowStart = newStart;
+    chatBox.scrollTop += chatBox.scrollHeight - before;
+    trimBottom();
+}}
+
+function shiftWindowDown() {{
+    const newEnd = Math.min(entries.length, windowEnd + WINDOW_STEP);
+    if (newEnd === windowEnd) return;
+    const last = renderedNodes[renderedNodes.length - 1];
+    const nodes = entries.slice(windowEnd, newEnd).map(createMessageNode);
+    let ref = last ? last.nextSibling : null;
+    nodes.forEach(node => chatBox.insertBefore(node, ref));
+    renderedNodes.push(...nodes);
+    windowEnd = newEnd;
+    trimTop();
+}}
+
+async function loadOlderHistory() {{
+    if (loadingHistory || !hasMoreHistory || !sessionId) return;
+    loadingHistory = true;
+    try {{
+        const params = new URLSearchParams({{ session_id: sessionId, limit: '30' }});
+        if (oldestId) params.set('before', oldestId);
+        const response = await fetch(`${{HISTORY_URL}}?${{params}}`, {{ headers: {{ 'X-API-Key': API_KEY }} }});
+        if (!response.ok) return;
+        const data = await response.json();
+        const older = [];
+        data.items.forEach(([id, message, reply]) => {{
+            older.push({{ text: message, type: 'user' }}, {{ text: reply, type: 'bot' }});
+        }});
+        if (data.items.length) oldestId = data.items[0][0];
+        hasMoreHistory = data.before !== null;
+        const firstLoad = entries.length === 0;
+        entries.unshift(...older);
+        windowStart += older.length;
+        windowEnd += older.length;
+        shiftWindowUp();
+        if (firstLoad) chatBox.scrollTop = chatBox.scrollHeight;
+    }} catch (error) {{
+        console.error('Error:', error);
+    }} finally {{
+        loadingHistory = false;
+    }}
+}}
+
+let scrollScheduled = false;
+chatBox.addEventListener('scroll', () => {{
+    if (scrollScheduled) return;
+    scrollScheduled = true;
+    requestAnimationFrame(() => {{
+        scrollScheduled = false;
+        if (chatBox.scrollTop < 200) {{
+            if (windowStart > 0) shiftWindowUp();
+            else loadOlderHistory();
+        }} else if (chatBox.scrollHeight - chatBox.scrollTop - chatBox.clientHeight < 200) {{
+            shiftWindowDown();
+        }}
+    }});
+}}, {{ passive: true }});
+
 // التحقق من الجلسة الموجودة
 if (sessionId) {{
     loginModal.classList.add('hidden');
     chatContainer.style.display = 'flex';
+    loadOlderHistory().then(resumePendingChat);
 }}
 
 // تسجيل الدخول
@@ -1094,6 +2938,67 @@ messageInput.addEventListener('keypress', (e) => {{
 }});
 sendBtn.addEventListener('click', sendMessage);
 
+// مفتاح لكل رسالة: إعادة المحاولة أو إعادة تحميل الصفحة لا تعيد استدعاء النموذج
+function newIdempotencyKey() {{
+    if (window.crypto && crypto.randomUUID) return crypto.randomUUID();
+    const bytes = new Uint8Array(16);
+    crypto.getRandomValues(bytes);
+    return Array.from(bytes, b => b.toString(16).padStart(2, '0')).join('');
+}}
+
+const CHAT_RETRIES = 2;
+const CHAT_TIMEOUT_MS = 100000;
+
+async function postChat(message, key) {{
+    for (let attempt = 0; ; attempt++) {{
+        const controller = new AbortController();
+        const timer = setTimeout(() => controller.abort(), CHAT_TIMEOUT_MS);
+        try {{
+            const response = await fetch(API_URL, {{
+                method: 'POST',
+                headers: {{ 
+                    'Content-Type': 'application/json',
+                    'X-API-Key': API_KEY,
+                    'Idempotency-Key': key
+                }},
+                body: JSON.stringify({{ message: message, session_id: sessionId }}),
+                signal: controller.signal
+            }});
+            const retryable = response.status === 409 || response.status === 502 || response.status === 503;
+            if (!retryable || attempt >= CHAT_RETRIES) return response;
+            const wait = Math.min(5, parseInt(response.headers.get('Retry-After') || '1', 10) || 1);
+            await new Promise(resolve => setTimeout(resolve, wait * 1000));
+        }} catch (error) {{
+            if (attempt >= CHAT_RETRIES) throw error;
+            await new Promise(resolve => setTimeout(resolve, 1000 * (attempt + 1)));
+        }} finally {{
+            clearTimeout(timer);
+        }}
+    }}
+}}
+
+async function resumePendingChat() {{
+    const pending = JSON.parse(localStorage.getItem('pendingChat') || 'null');
+    if (!pending || !sessionId) return;
+    const typingIndicator = showTypingIndicator();
+    try {{
+        const response = await postChat(pending.message, pending.key);
+        if (response.ok) {{
+            const data = await response.json();
+            // الرد المحفوظ قد يكون ظهر مسبقاً في السجل المحمَّل
+            const shown = entries.slice(-6).some(e => e.type === 'bot' && e.text === data.response);
+            if (!shown) {{
+                addMessage(pending.message, 'user');
+                addMessage(data.response, 'bot');
+            }}
+        }}
+    }} catch (error) {{
+        console.error('Error:', error);
+    }}
+    typingIndicator.remove();
+    localStorage.removeItem('pendingChat');
+}}
+
 async function sendMessage() {{
     const message = messageInput.value.trim();
     if (!message) return;
@@ -1103,16 +3008,12 @@ async function sendMessage() {{
     addMessage(message, 'user');
     messageInput.value = '';
     const typingIndicator = showTypingIndicator();
+    const key = newIdempotencyKey();
+    localStorage.setItem('pendingChat', JSON.stringify({{ key: key, message: message }}));
 
     try {{
-        const response = await fetch(API_URL, {{
-            method: 'POST',
-            headers: {{ 
-                'Content-Type': 'application/json',
-                'X-API-Key': API_KEY
-            }},
-            body: JSON.stringify({{ message: message, session_id: sessionId }})
-        }});
+        const response = await postChat(message, key);
+        localStorage.removeItem('pendingChat');
         
         if (response.status === 429) {{
             const data = await response.json();
@@ -1144,13 +3045,15 @@ async function sendMessage() {{
 }}
 
 function addMessage(text, type) {{
-    const messageDiv = document.createElement('div');
-    messageDiv.className = `message ${{type}}`;
-    const contentDiv = document.createElement('div');
-    contentDiv.className = 'message-content';
-    contentDiv.textContent = text;
-    messageDiv.appendChild(contentDiv);
-    chatBox.appendChild(messageDiv);
+    // الرسائل الجديدة تعيد النافذة إلى آخر المحادثة
+    while (windowEnd < entries.length) shiftWindowDown();
+    const entry = {{ text: text, type: type }};
+    entries.push(entry);
+    const node = createMessageNode(entry);
+    chatBox.appendChild(node);
+    renderedNodes.push(node);
+    windowEnd = entries.length;
+    trimTop();
     chatBox.scrollTop = chatBox.scrollHeight;
 }}
 
@@ -1166,45 +3069,156 @@ function showTypingIndicator() {{
 </body>
 </html>"""
 
+# تُبنى الصفحة مرة واحدة عند الاستيراد (في العملية الرئيسية عند --preload)
+HOME_PAGE = render_home_page()
+
+@app.route('/')
+def home():
+    return HOME_PAGE
+
+class ReadinessProbe:
+    """فحوص دورية في الخلفية لقابلية الكتابة في SQLite ولوصول خادم الذكاء.
+
+    /readyz يقرأ آخر نتيجة مخزنة فقط، فلا يكلف استطلاع موزع الحمل شيئاً
+    ولا يصل أي منه إلى خادم الذكاء.
+    """
+
+    def __init__(self, db_interval=15.0, upstream_interval=60.0, saturation=0.9):
+        self._lock = threading.Lock()
+        self.db_interval = db_interval
+        self.upstream_interval = upstream_interval
+        self.saturation = saturation
+        self.results = {"db": None, "upstream": None}
+
+    def _store(self, name, ok, started, error=None):
+        with self._lock:
+            self.results[name] = {
+                "ok": ok,
+                "latency_ms": round((time.monotonic() - started) * 1000, 1),
+                "checked_at": datetime.now().isoformat(timespec='seconds'),
+                "error": error,
+            }
+
+    def probe_db(self):
+        started = time.monotonic()
+        try:
+            conn = sqlite3.connect('bot_data.db', timeout=2, check_same_thread=False)
+            try:
+                # حجز قفل الكتابة ثم التراجع: يثبت أن القاعدة قابلة للكتابة دون تعديلها
+                conn.execute("BEGIN IMMEDIATE")
+                conn.execute("SELECT 1 FROM web_sessions LIMIT 1").fetchone()
+                conn.rollback()
+            finally:
+                conn.close()
+            self._store("db", True, started)
+        except Exception as e:
+            self._store("db", False, started, str(e))
+
+    def probe_upstream(self):
+        started = time.monotonic()
+        try:
+            res = http.head(AI_API_URL, timeout=3, allow_redirects=False)
+            self._store("upstream", res.status_code < 500, started,
+                        None if res.status_code < 500 else f"HTTP {res.status_code}")
+        except Exception as e:
+            self._store("upstream", False, started, type(e).__name__)
+
+    def run(self):
+        next_db = next_upstream = 0.0
+        while True:
+            now = time.monotonic()
+            if now >= next_db:
+                self.probe_db()
+                next_db = now + self.db_interval
+            if now >= next_upstream:
+                self.probe_upstream()
+                next_upstream = now + self.upstream_interval
+            time.sleep(max(0.5, min(next_db, next_upstream) - time.monotonic()))
+
+    def snapshot(self):
+        admission = ai_limiter.stats()
+        utilization = admission["in_flight"] / max(1, admission["limit"])
+        pool = getattr(bot, 'worker_pool', None)
+        with self._lock:
+            results = dict(self.results)
+        db = results["db"]
+        upstream = results["upstream"]
+        ready = bool(db and db["ok"]) and utilization < self.saturation
+        if READY_REQUIRES_UPSTREAM:
+            ready = ready and bool(upstream and upstream["ok"])
+        return {
+            "ready": ready,
+            "db": db,
+            "upstream": upstream,
+            "pool_utilization": round(utilization, 3),
+            "admission": admission,
+            "queue_depth": {
+                "telegram_tasks": pool.tasks.qsize() if pool else 0,
+                "batched_chats": message_batcher.stats()["pending_chats"],
+                "log_records": log_stats()["queued"],
+            },
+        }
+
+READY_REQUIRES_UPSTREAM = os.environ.get('READY_REQUIRES_UPSTREAM', '0') == '1'
+readiness = ReadinessProbe(
+    db_interval=float(os.environ.get('READINESS_DB_INTERVAL', 15)),
+    upstream_interval=float(os.environ.get('READINESS_UPSTREAM_INTERVAL', 60)),
+)
 
 @app.route('/health')
 def health_check():
-    return jsonify({{"status": "healthy", "protected": True}})
+    return jsonify({"status": "healthy", "protected": True, "admission": ai_limiter.stats(),
+                    "batching": message_batcher.stats(), "logging": log_stats(),
+                    "polling": telegram_poller.stats if telegram_poller else None,
+                    "cache": response_cache.stats(), "capture": traffic.stats(),
+                    "upstream_payload": ai_payload_stats()})
+
+@app.route('/livez')
+def liveness():
+    """العملية حية وتستقبل الطلبات؛ بدون أي إدخال/إخراج"""
+    return jsonify({"status": "alive"})
+
+@app.route('/readyz')
+def readiness_check():
+    """نتيجة آخر فحوص خلفية مخزنة؛ 503 عند تعذر الكتابة في القاعدة أو تشبع العامل"""
+    snapshot = readiness.snapshot()
+    return jsonify(snapshot), (200 if snapshot["ready"] else 503)
 
 if __name__ == '__main__':
-    print("🚀 بدء تشغيل موبي المحمي...")
+    logger.info("🚀 بدء تشغيل موبي المحمي...")
+    init_worker()
     
     # تحقق من وجود BOT_TOKEN
     if not BOT_TOKEN:
-        print("❌ خطأ: لم يتم العثور على متغير البيئة BOT_TOKEN.")
+        logger.error("❌ خطأ: لم يتم العثور على متغير البيئة BOT_TOKEN.")
     else:
-        print(f"🔒 API Secret Key: {API_SECRET_KEY[:10]}...")
+        logger.info(f"🔒 API Secret Key: {API_SECRET_KEY[:10]}...")
         
         # الحصول على اسم المضيف الخارجي لـ Webhook
         # استخدام RENDER_EXTERNAL_HOSTNAME إذا كان متاحاً، وإلا استخدام IP المحلي
         external_hostname = os.environ.get('RENDER_EXTERNAL_HOSTNAME')
         
-        if external_hostname:
+        if polling_enabled():
+            logger.info("📥 وضع الاستقبال: polling (getUpdates)")
+        elif external_hostname:
             webhook_url = f"https://{external_hostname}/webhook"
             
             try:
                 bot.remove_webhook()
-                print("✅ تم حذف الويب هوك القديم")
+                logger.info("✅ تم حذف الويب هوك القديم")
             except Exception as e:
-                print(f"⚠️ خطأ في حذف الويب هوك: {e}")
+                logger.warning(f"⚠️ خطأ في حذف الويب هوك: {e}")
             
             try:
                 # تعيين الويب هوك الجديد
                 bot.set_webhook(url=webhook_url, drop_pending_updates=True)
-                print(f"✅ تم تعيين الويب هوك: {webhook_url}")
+                logger.info(f"✅ تم تعيين الويب هوك: {webhook_url}")
             except Exception as e:
-                print(f"⚠️ خطأ في تعيين الويب هوك: {e}")
+                logger.warning(f"⚠️ خطأ في تعيين الويب هوك: {e}")
         else:
-            print("⚠️ ملاحظة: لم يتم العثور على RENDER_EXTERNAL_HOSTNAME، لن يتم تعيين Webhook. يفضل استخدامه في بيئات الإنتاج.")
-            # إذا لم يتم العثور على External Hostname، يمكن تشغيل البوت في وضع Polling هنا للتجربة المحلية 
-            # ولكن في بيئة إنتاج (مثل Render) يجب توفير الـ Webhook.
+            logger.warning("⚠️ ملاحظة: لم يتم العثور على RENDER_EXTERNAL_HOSTNAME ولم يُضبط TELEGRAM_MODE=polling، لن يتم استقبال أي تحديث.")
     
     port = int(os.environ.get('PORT', 5000))
-    print(f"🌐 الخادم يعمل على المنفذ: {port}")
+    logger.info(f"🌐 الخادم يعمل على المنفذ: {port}")
     # تشغيل تطبيق Flask لاستقبال طلبات الويب و Webhook
     app.run(host='0.0.0.0', port=port, debug=False)
@@ -0,0 +1,145 @@
+"""سجلات JSON غير حاجبة: الخيوط تضع السجلات في طابور محدود ويكتبها خيط خلفي.
+
+- كل سجل سطر JSON فيه الوقت والمستوى والرسالة ومعرف الطلب وحقول إضافية
+  تُمرَّر عبر extra={"fields": {...}}.
+- الأخطاء المتطابقة (نفس المسجل والمستوى ونص الرسالة) تُكتب مرة
+  واحدة لكل نافذة زمنية، ويُرفق بالسجل التالي عدد ما حُذف منها.
+- السجلات الموسومة extra={"sample": True} تُؤخذ منها عينة تقل كلما امتلأ الطابور.
+- عند امتلاء الطابور تُسقط السجلات ويُعدّ عددها بدلاً من حجب الطلب.
+"""
+import atexit
+import contextvars
+import copy
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import sys
+import threading
+import time
+
+request_id_var = contextvars.ContextVar('request_id', default=None)
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        data = {
+            "ts": round(record.created, 3),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        request_id = getattr(record, 'request_id', None)
+        if request_id:
+            data["request_id"] = request_id
+        data.update(getattr(record, 'fields', None) or {})
+        suppressed = getattr(record, 'suppressed', 0)
+        if suppressed:
+            data["suppressed"] = suppressed
+        if record.exc_info:
+            data["exc"] = self.formatException(record.exc_info)
+        return json.dumps(data, ensure_ascii=False, default=str)
+
+class RepeatFilter(logging.Filter):
+    """كتابة الخطأ المتكرر مرة واحدة لكل `window` ثانية"""
+
+    def __init__(self, window=60.0, min_level=logging.WARNING):
+        super().__init__()
+        self.window = window
+        self.min_level = min_level
+        self._lock = threading.Lock()
+        self._seen = {}
+
+    def filter(self, record):
+        if record.levelno < self.min_level:
+            return True
+        key = (record.name, record.levelno, record.getMessage())
+        now = time.monotonic()
+        with self._lock:
+            entry = self._seen.get(key)
+            if entry and now - entry[0] < self.window:
+                entry[1] += 1
+                return False
+            record.suppressed = entry[1] if entry else 0
+            self._seen[key] = [now, 0]
+            if len(self._seen) > 10000:
+                self._seen.clear()
+        return True
+
+class SamplingFilter(logging.Filter):
+    """أخذ عينة من السجلات الكثيفة حسب امتلاء الطابور"""
+
+    def __init__(self, log_queue, base_rate=1.0, min_rate=0.01):
+        super().__init__()
+        self.log_queue = log_queue
+        self.base_rate = base_rate
+        self.min_rate = min_rate
+
+    def filter(self, record):
+        if not getattr(record, 'sample', False):
+            return True
+        fill = self.log_queue.qsize() / self.log_queue.maxsize if self.log_queue.maxsize else 0.0
+        rate = max(self.min_rate, self.base_rate * (1.0 - fill) ** 2)
+        return random.random() < rate
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler لا يحجب ولا يطبع أخطاء عند امتلاء الطابور"""
+
+    dropped = 0
+
+    def prepare(self, record):
+        # التنسيق يتم في خيط الكتابة؛ هنا تُثبَّت الرسالة ومعرف الطلب فقط
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        record.request_id = getattr(record, 'request_id', None) or request_id_var.get()
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            DroppingQueueHandler.dropped += 1
+
+_state = {"pid": None, "handler": None, "listener": None}
+_setup_lock = threading.Lock()
+
+def init_logging(level=None, queue_size=10000, repeat_window=60.0):
+    """تثبيت المعالج على المسجل الجذر؛ يُعاد إنشاء الطابور والخيط بعد fork"""
+    with _setup_lock:
+        if _state["pid"] == os.getpid():
+            return
+        root = logging.getLogger()
+        if _state["handler"] is not None:
+            root.removeHandler(_state["handler"])
+        log_queue = queue.Queue(maxsize=queue_size)
+        handler = DroppingQueueHandler(log_queue)
+        handler.addFilter(SamplingFilter(log_queue))
+        handler.addFilter(RepeatFilter(repeat_window))
+        stream = logging.StreamHandler(sys.stdout)
+        stream.setFormatter(JsonFormatter())
+        listener = logging.handlers.QueueListener(log_queue, stream, respect_handler_level=False)
+        listener.start()
+        root.addHandler(handler)
+        root.setLevel(level or os.environ.get('LOG_LEVEL', 'INFO'))
+        _state.update(pid=os.getpid(), handler=handler, listener=listener)
+        atexit.register(shutdown_logging)
+
+def _reinit_after_fork():
+    # خيط الكتابة لا ينتقل مع fork وقد يبقى قفل الطابور القديم محجوزاً
+    _state["pid"] = None
+    if _state["handler"] is not None:
+        init_logging()
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reinit_after_fork)
+
+def shutdown_logging():
+    listener = _state.get("listener")
+    if listener is not None and _state["pid"] == os.getpid():
+        listener.stop()
+
+def log_stats():
+    log_queue = _state["handler"].queue if _state["handler"] else None
+    return {"queued": log_queue.qsize() if log_queue else 0, "dropped": DroppingQueueHandler.dropped}
@@ -0,0 +1,347 @@
+"""خدمة asyncio (ASGI) لمسارات المحادثة أمام تطبيق Flask نفسه.
+
+    GUNICORN_WORKER_CLASS=uvicorn.workers.UvicornWorker gunicorn asgi:application -c gunicorn.conf.py
+    python asgi.py
+
+- POST /api/chat وPOST /webhook تعمل كـ coroutines: طلب خادم الذكاء عبر
+  aiohttp، واستدعاءات SQLite وshared_state في مجموعة خيوط محدودة
+  (ASYNC_DB_THREADS)، فالطلب المنتظر لا يحجز خيطاً ولا عاملاً.
+- تحديثات webhook تُقبل فوراً وتُعالج كمهام asyncio مرتبة لكل محادثة. الرسائل
+  النصية العادية تُعالج بالكامل داخل الحلقة، والأوامر وباقي الأنواع تُسلَّم إلى
+  معالجات telebot. عند بلوغ ASYNC_MAX_UPDATES مهمة يُرد 503 فيعيد تلغرام الإرسال.
+- باقي المسارات تُمرر إلى تطبيق Flask في مجموعة خيوط (ASYNC_WSGI_THREADS) مع
+  بث جسم الرد قطعة قطعة.
+
+AI_CONCURRENCY_MAX يبقى سقف الطلبات المتزامنة إلى خادم الذكاء؛ ارفعه (مثلاً 2000)
+حتى يستفيد هذا الوضع من آلاف المحادثات المفتوحة في عملية واحدة.
+"""
+import asyncio
+import contextvars
+import io
+import json
+import logging
+import os
+import secrets
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+import aiohttp
+
+import app
+from app_logging import request_id_var
+from update_poller import update_chat_id
+from upstream_reply import ReplyExtractor
+
+logger = logging.getLogger('mobi.asgi')
+
+ASYNC_DB_THREADS = int(os.environ.get('ASYNC_DB_THREADS', 16))
+ASYNC_WSGI_THREADS = int(os.environ.get('ASYNC_WSGI_THREADS', 8))
+ASYNC_UPSTREAM_CONNECTIONS = int(os.environ.get('ASYNC_UPSTREAM_CONNECTIONS', 1000))
+ASYNC_MAX_UPDATES = int(os.environ.get('ASYNC_MAX_UPDATES', 10000))
+MAX_BODY_BYTES = 1024 * 1024
+
+db_pool = ThreadPoolExecutor(max_workers=ASYNC_DB_THREADS, thread_name_prefix='db')
+# الطلبات المنتظرة هنا لا تحجز خيوط gunicorn: لا سقف ثابت لمسار الويب، ويبقى
+# الحد التكيفي محدوداً بـ AI_CONCURRENCY_MAX وحده
+app.ai_limiter.caps.pop('web', None)
+app.ai_limiter.max_limit = int(os.environ.get('AI_CONCURRENCY_MAX', 64))
+upstream = None
+telegram = None
+_updates = set()
+_chat_tails = {}
+
+async def run_db(fn, *args):
+    """تنفيذ دالة حاجبة (SQLite أو shared_state) في مجموعة خيوط القاعدة"""
+    ctx = contextvars.copy_context()
+    return await asyncio.get_running_loop().run_in_executor(db_pool, ctx.run, partial(fn, *args))
+
+def _clients():
+    """جلستا aiohttp للعملية الحالية؛ تُنشآن داخل الحلقة عند أول استخدام"""
+    global upstream, telegram
+    if upstream is None:
+        upstream = aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=ASYNC_UPSTREAM_CONNECTIONS))
+        telegram = aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=ASYNC_UPSTREAM_CONNECTIONS),
+                                         timeout=aiohttp.ClientTimeout(total=30, connect=10))
+    return upstream, telegram
+
+async def read_ai_reply(res):
+    """نظير app.read_ai_reply لرد aiohttp"""
+    extractor = ReplyExtractor('response', app.AI_RESPONSE_MAX_BYTES)
+    extractor.check_length(res.content_length)
+    async for chunk in res.content.iter_chunked(app.AI_RESPONSE_CHUNK):
+        extractor.feed(chunk)
+    app.record_ai_payload(extractor.size)
+    return extractor.finish()
+
+async def get_ai_response(text, deadline=None):
+    """نظير app.get_ai_response غير الحاجب؛ يعيد (الرد، نجح)"""
+    budget = app.ai_request_timeout(deadline)
+    if budget is None:
+        return app.AI_ERROR_REPLY, False
+    timeout, observed = budget
+    started = time.monotonic()
+    try:
+        async with _clients()[0].get(app.ai_request_url(text),
+                                     timeout=aiohttp.ClientTimeout(total=timeout, connect=min(5.0, timeout),
+                                                                   sock_read=timeout)) as res:
+            res.raise_for_status()
+            reply = await read_ai_reply(res)
+        return app.accept_ai_reply(text, reply, time.monotonic() - started)
+    except asyncio.TimeoutError:
+        return app.record_ai_timeout(text, timeout, observed, time.monotonic() - started), False
+    except Exception as e:
+        return app.record_ai_error(text, e, time.monotonic() - started), False
+
+async def telegram_call(method, **params):
+    async with _clients()[1].post(f"{app.TELEGRAM_API_URL}/bot{app.BOT_TOKEN}/{method}", json=params) as res:
+        data = await res.json(content_type=None)
+    if not data.get('ok'):
+        raise RuntimeError(f"{method}: {data.get('error_code')} {data.get('description')}")
+    return data['result']
+
+async def reply_to(message, text):
+    return await telegram_call('sendMessage', chat_id=message['chat']['id'], text=text,
+                               reply_to_message_id=message['message_id'])
+
+async def web_chat(headers, body):
+    """app.web_chat بنقل غير حاجب؛ يعيد (الحالة، الجسم، ترويسات إضافية)"""
+    if headers.get('x-api-key') != app.API_SECRET_KEY:
+        return 401, {"error": "Unauthorized"}, {}
+    try:
+        data = json.loads(body)
+    except ValueError:
+        data = None
+    turn = app.WebChatTurn(data, headers.get('idempotency-key'))
+    try:
+        result = await run_db(turn.admit)
+        if result is None:
+            if turn.reply is None:
+                turn.answered(*await get_ai_response(turn.prompt, turn.deadline))
+            result = await run_db(turn.finish)
+    except Exception:
+        logger.exception("web_chat failed")
+        result = app.CHAT_ERROR_RESULT
+    finally:
+        await run_db(turn.close)
+    return result
+
+async def answer_text_message(message, received_at):
+    """نظير handle_all_messages ثم answer_messages لرسالة نصية واحدة"""
+    request_id_var.set(f"tg-{message['chat']['id']}-{message['message_id']}")
+    refusal = await run_db(app.telegram_refusal, message['from']['id'], message['from'].get('first_name'))
+    if refusal:
+        await reply_to(message, refusal)
+        return
+
+    turn = app.TelegramTurn([message['text']], received_at)
+    try:
+        busy = await run_db(turn.admit)
+        if busy:
+            await reply_to(message, busy)
+            return
+        if turn.reply is None:
+            await telegram_call('sendChatAction', chat_id=message['chat']['id'], action='typing')
+            turn.answered(*await get_ai_response(turn.prompt, turn.deadline))
+    finally:
+        turn.close()
+    await reply_to(message, turn.reply)
+    turn.finish()
+
+async def process_update(raw, received_at, previous):
+    if previous is not None:
+        await asyncio.wait([previous])
+    try:
+        message = raw.get('message') or {}
+        text = message.get('text')
+        # الدمج (TELEGRAM_DEBOUNCE_MS) يعتمد على مؤقتات خيوط MessageBatcher فيبقى في telebot
+        if text and not text.startswith('/') and 'from' in message and app.TELEGRAM_DEBOUNCE_MS <= 0:
+            await answer_text_message(message, received_at)
+        else:
+            await run_db(app.process_raw_update, raw)
+    except Exception:
+        logger.exception("update handler failed", extra={"fields": {"update_id": raw.get('update_id')}})
+
+def schedule_update(raw):
+    """تشغيل التحديث بعد آخر تحديث مجدول لنفس المحادثة"""
+    chat = update_chat_id(raw)
+    task = asyncio.create_task(process_update(raw, time.monotonic(), _chat_tails.get(chat)))
+    _chat_tails[chat] = task
+    _updates.add(task)
+
+    def done(task):
+        _updates.discard(task)
+        if _chat_tails.get(chat) is task:
+            del _chat_tails[chat]
+
+    task.add_done_callback(done)
+
+async def webhook(headers, body):
+    if headers.get('content-type') != 'application/json':
+        return 403, 'Invalid content type', {}
+    if len(_updates) >= ASYNC_MAX_UPDATES:
+        return 503, '', {"Retry-After": "1"}
+    try:
+        update = json.loads(body)
+    except ValueError:
+        return 400, 'Invalid JSON', {}
+    if not isinstance(update, dict):
+        return 400, 'Invalid JSON', {}
+    schedule_update(update)
+    return 200, '', {}
+
+def build_environ(scope, body):
+    server = scope.get('server') or ('localhost', 80)
+    client = scope.get('client') or ('', 0)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', '').encode('utf-8').decode('latin-1'),
+        'PATH_INFO': scope['path'].encode('utf-8').decode('latin-1'),
+        'QUERY_STRING': scope['query_string'].decode('latin-1'),
+        'SERVER_NAME': server[0],
+        'SERVER_PORT': str(server[1]),
+        'SERVER_PROTOCOL': f"HTTP/{scope.get('http_version', '1.1')}",
+        'REMOTE_ADDR': client[0],
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': io.BytesIO(body),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False,
+    }
+    for name, value in scope['headers']:
+        name = name.decode('latin-1')
+        if name == 'content-type':
+            key = 'CONTENT_TYPE'
+        elif name == 'content-length':
+            key = 'CONTENT_LENGTH'
+        else:
+            key = 'HTTP_' + name.upper().replace('-', '_')
+        value = value.decode('latin-1')
+        environ[key] = f"{environ[key]},{value}" if key in environ else value
+    return environ
+
+class WSGIBridge:
+    """تشغيل تطبيق WSGI في مجموعة خيوط خاصة وبث جسم الرد قطعة قطعة"""
+
+    def __init__(self, wsgi_app, threads):
+        self.wsgi_app = wsgi_app
+        self.pool = ThreadPoolExecutor(max_workers=threads, thread_name_prefix='wsgi')
+
+    async def __call__(self, scope, receive, send):
+        body = await read_body(receive)
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(self.pool, self._run, scope, body, send, loop)
+
+    def _run(self, scope, body, send, loop):
+        def emit(event):
+            asyncio.run_coroutine_threadsafe(send(event), loop).result()
+
+        head = {}
+
+        def start_response(status, headers, exc_info=None):
+            head["status"] = int(status.split(' ', 1)[0])
+            head["headers"] = [(k.lower().encode('latin-1'), v.encode('latin-1')) for k, v in headers]
+            return lambda data: emit({"type": "http.response.body", "body": data, "more_body": True})
+
+        result = self.wsgi_app(build_environ(scope, body), start_response)
+        try:
+            started = False
+            for chunk in result:
+                if not chunk:
+                    continue
+                if not started:
+                    emit({"type": "http.response.start", "status": head["status"], "headers": head["headers"]})
+                    started = True
+                emit({"type": "http.response.body", "body": chunk, "more_body": True})
+            if not started:
+                emit({"type": "http.response.start", "status": head["status"], "headers": head["headers"]})
+            emit({"type": "http.response.body", "body": b""})
+        finally:
+            close = getattr(result, 'close', None)
+            if close:
+                close()
+
+async def read_body(receive, limit=None):
+    chunks, size = [], 0
+    while True:
+        event = await receive()
+        if event['type'] == 'http.disconnect':
+            break
+        chunk = event.get('body', b'')
+        size += len(chunk)
+        if limit is not None and size > limit:
+            raise ValueError("request body too large")
+        chunks.append(chunk)
+        if not event.get('more_body'):
+            break
+    return b''.join(chunks)
+
+async def respond(send, status, body, headers):
+    if isinstance(body, (dict, list)):
+        data = json.dumps(body, ensure_ascii=False).encode('utf-8')
+        content_type = 'application/json'
+    else:
+        data = body.encode('utf-8')
+        content_type = 'text/html; charset=utf-8'
+    raw_headers = [(b'content-type', content_type.encode()), (b'content-length', str(len(data)).encode()),
+                   (b'access-control-allow-origin', b'*')]
+    raw_headers += [(k.lower().encode('latin-1'), v.encode('latin-1')) for k, v in headers.items()]
+    await send({"type": "http.response.start", "status": status, "headers": raw_headers})
+    await send({"type": "http.response.body", "body": data})
+
+ROUTES = {
+    ('POST', '/api/chat'): web_chat,
+    ('POST', '/webhook'): webhook,
+}
+flask_bridge = WSGIBridge(app.app, ASYNC_WSGI_THREADS)
+
+async def lifespan(receive, send):
+    while True:
+        event = await receive()
+        if event['type'] == 'lifespan.startup':
+            await run_db(app.init_worker)
+            _clients()
+            await send({"type": "lifespan.startup.complete"})
+        elif event['type'] == 'lifespan.shutdown':
+            if _updates:
+                await asyncio.wait(list(_updates), timeout=10)
+            if upstream is not None:
+                await upstream.close()
+                await telegram.close()
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+async def application(scope, receive, send):
+    if scope['type'] == 'lifespan':
+        await lifespan(receive, send)
+        return
+    if scope['type'] != 'http':
+        return
+    route = ROUTES.get((scope['method'], scope['path']))
+    if route is None:
+        await flask_bridge(scope, receive, send)
+        return
+    arrived_at, started = time.time(), time.monotonic()
+    headers = {k.decode('latin-1'): v.decode('latin-1') for k, v in scope['headers']}
+    request_id = headers.get('x-request-id') or secrets.token_hex(8)
+    request_id_var.set(request_id)
+    try:
+        body = await read_body(receive, MAX_BODY_BYTES)
+    except ValueError:
+        await respond(send, 413, {"error": "Payload too large"}, {"X-Request-ID": request_id})
+        return
+    status, payload, extra = await route(headers, body)
+    await respond(send, status, payload, {**extra, "X-Request-ID": request_id})
+    if app.traffic.enabled:
+        try:
+            data = json.loads(body)
+        except ValueError:
+            data = None
+        app.traffic.record_http(scope['path'], data, headers, status, arrived_at, time.monotonic() - started)
+
+if __name__ == '__main__':
+    import uvicorn
+    uvicorn.run(application, host='0.0.0.0', port=int(os.environ.get('PORT', 5000)), log_level='warning')
@@ -0,0 +1,58 @@
+"""أدوات مشتركة بين سكربتات القياس: بديل خادم الذكاء، ومنفذ حر، ومئين.
+
+    from benchmarks._stubs import FakeUpstream, free_port, percentile
+    app.http = FakeUpstream(lambda: "رد تجريبي " * random.randint(20, 200), delay=0.02)
+"""
+import io
+import json
+import socket
+import time
+
+class FakeRaw(io.BytesIO):
+    """بديل res.raw من urllib3 كما تقرؤه app.ai_body_chunks"""
+    connection = None
+
+    def read1(self, amt=-1, decode_content=True):
+        return super().read1(amt)
+
+class FakeResponse:
+    """رد requests بالحد الذي يستخدمه app.get_ai_response (stream=True)"""
+    headers = {}
+
+    def __init__(self, text):
+        self.raw = FakeRaw(json.dumps({"response": text}, ensure_ascii=False).encode('utf-8'))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        pass
+
+    def raise_for_status(self):
+        pass
+
+class FakeUpstream:
+    """بديل لـ requests.Session؛ `reply` نص أو دالة تعيد نصاً، و`delay` بالثواني قبل الرد"""
+
+    def __init__(self, reply="رد تجريبي", delay=0.0):
+        self.reply = reply
+        self.delay = delay
+
+    def get(self, url, timeout=None, stream=False):
+        if self.delay:
+            time.sleep(self.delay)
+        return FakeResponse(self.reply() if callable(self.reply) else self.reply)
+
+    def head(self, url, timeout=None, allow_redirects=False):
+        return FakeResponse("")
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+def percentile(values, p):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p / 100))]
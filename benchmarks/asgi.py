@@ -0,0 +1,216 @@
+"""/api/chat عبر gunicorn المتزامن مقارنة بوضع asyncio (asgi.py) أمام خادم ذكاء بطيء.
+
+    python benchmarks/asgi.py --concurrency 1000 --upstream-ms 500 --seconds 20
+
+يشغَّل خادم ذكاء وهمي (asyncio) ينتظر --upstream-ms قبل الرد، ثم كل خادم كعملية
+gunicorn منفصلة في مجلد مؤقت:
+
+- sync:  app:app بالإعداد الافتراضي (WEB_CONCURRENCY عامل × GUNICORN_THREADS خيط)
+- sync-N: نفس الشيء مع --sync-threads خيط لكل عامل (لمقارنة ذاكرة مماثلة)
+- async: asgi:application بعامل UvicornWorker واحد
+
+ثم يرسل --concurrency عميل متزامن طلبات متتالية لمدة --seconds (جلسة عشوائية لكل
+طلب حتى لا يتدخل حد المعدل). لكل خادم: الطلبات الناجحة في الثانية، وp50/p95،
+وعدد الأخطاء حسب الحالة، وذروة الذاكرة المقيمة (RSS) لكل عمليات الخادم.
+"""
+import argparse
+import asyncio
+import collections
+import json
+import os
+import secrets
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from benchmarks._stubs import free_port, percentile  # noqa: E402
+
+API_KEY = 'bench-key'
+
+async def fake_upstream(reader, writer, delay):
+    """خادم HTTP/1.1 مصغر يُبقي الاتصال مفتوحاً ويرد بعد `delay` ثانية"""
+    body = json.dumps({"response": "رد تجريبي " * 20}, ensure_ascii=False).encode('utf-8')
+    head = (b"HTTP/1.1 200 OK\r\nContent-Type: application/json\r\nContent-Length: "
+            + str(len(body)).encode() + b"\r\n\r\n")
+    try:
+        while True:
+            request = await reader.readuntil(b"\r\n\r\n")
+            if request.startswith(b"HEAD"):
+                writer.write(head)
+            else:
+                await asyncio.sleep(delay)
+                writer.write(head + body)
+            await writer.drain()
+    except (asyncio.IncompleteReadError, ConnectionError):
+        pass
+    finally:
+        writer.close()
+
+def start_upstream(delay):
+    loop = asyncio.new_event_loop()
+    sock = socket.socket()
+    sock.bind(('127.0.0.1', 0))
+    port = sock.getsockname()[1]
+
+    async def serve():
+        server = await asyncio.start_server(lambda r, w: fake_upstream(r, w, delay), sock=sock, backlog=4096)
+        await server.serve_forever()
+
+    threading.Thread(target=lambda: loop.run_until_complete(serve()), daemon=True).start()
+    return port
+
+def tree_rss(pid):
+    """مجموع RSS بالميغابايت للعملية وأبنائها"""
+    total = 0
+    pids = [pid]
+    while pids:
+        current = pids.pop()
+        try:
+            with open(f"/proc/{current}/status") as f:
+                for line in f:
+                    if line.startswith('VmRSS:'):
+                        total += int(line.split()[1])
+            with open(f"/proc/{current}/task/{current}/children") as f:
+                pids.extend(int(p) for p in f.read().split())
+        except OSError:
+            pass
+    return total / 1024
+
+def start_server(kind, port, upstream_port, workers, threads, concurrency, workdir=None, extra_env=None):
+    """تشغيل gunicorn في `workdir`؛ قيم extra_env تُطبق أخيراً وNone يحذف المتغير"""
+    env = dict(os.environ, PORT=str(port), PYTHONPATH=ROOT, API_SECRET_KEY=API_KEY,
+               AI_API_URL=f"http://127.0.0.1:{upstream_port}/", WEB_CONCURRENCY=str(workers),
+               GUNICORN_THREADS=str(threads), AI_CONCURRENCY_INITIAL=str(concurrency * 2),
+               AI_CONCURRENCY_MAX=str(concurrency * 2), RESPONSE_CACHE_ENTRIES='0', WARMUP_TOP_K='0',
+               BACKUP_INTERVAL_HOURS='0', TEXT_CODEC_MIGRATE='0', LOG_LEVEL='WARNING', TELEGRAM_MODE='webhook')
+    env.pop('BOT_TOKEN', None)
+    target = 'app:app'
+    if kind == 'async':
+        env['GUNICORN_WORKER_CLASS'] = 'uvicorn.workers.UvicornWorker'
+        target = 'asgi:application'
+    for key, value in (extra_env or {}).items():
+        if value is None:
+            env.pop(key, None)
+        else:
+            env[key] = value
+    workdir = workdir or tempfile.mkdtemp(prefix=f'asgi-bench-{kind}-')
+    proc = subprocess.Popen([sys.executable, '-m', 'gunicorn', target, '-c', os.path.join(ROOT, 'gunicorn.conf.py'),
+                             '--backlog', '4096', '--timeout', '120'],
+                            cwd=workdir, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        try:
+            with socket.create_connection(('127.0.0.1', port), timeout=1) as s:
+                s.sendall(b"GET /livez HTTP/1.1\r\nHost: x\r\nConnection: close\r\n\r\n")
+                if s.recv(64).startswith(b"HTTP/1.1 200"):
+                    time.sleep(1.0)
+                    return proc
+        except OSError:
+            time.sleep(0.2)
+    proc.kill()
+    raise RuntimeError(f"{kind} server did not start")
+
+async def client(port, stop_at, latencies, statuses):
+    reader = writer = None
+    while time.monotonic() < stop_at:
+        body = json.dumps({"message": "ما هي البرمجة؟", "session_id": secrets.token_hex(8)}).encode()
+        request = (f"POST /api/chat HTTP/1.1\r\nHost: bench\r\nX-API-Key: {API_KEY}\r\n"
+                   f"Content-Type: application/json\r\nContent-Length: {len(body)}\r\n\r\n").encode() + body
+        started = time.monotonic()
+        try:
+            if writer is None:
+                reader, writer = await asyncio.open_connection('127.0.0.1', port)
+            writer.write(request)
+            head = await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), stop_at + 30 - started)
+            status = int(head.split(b" ", 2)[1])
+            length = 0
+            close = False
+            for line in head.split(b"\r\n")[1:]:
+                name, _, value = line.partition(b":")
+                if name.lower() == b"content-length":
+                    length = int(value)
+                elif name.lower() == b"connection" and value.strip().lower() == b"close":
+                    close = True
+            await reader.readexactly(length)
+            if close:
+                writer.close()
+                writer = None
+        except (OSError, asyncio.IncompleteReadError, asyncio.TimeoutError, ValueError):
+            status = 'conn'
+            if writer is not None:
+                writer.close()
+            writer = None
+            await asyncio.sleep(0.1)
+        finished = time.monotonic()
+        if finished > stop_at:
+            break
+        statuses[status] += 1
+        if status == 200:
+            latencies.append(finished - started)
+    if writer is not None:
+        writer.close()
+
+async def load(port, concurrency, seconds):
+    latencies, statuses = [], collections.Counter()
+    stop_at = time.monotonic() + seconds
+    await asyncio.gather(*(client(port, stop_at, latencies, statuses) for _ in range(concurrency)))
+    return latencies, statuses
+
+def run_case(name, kind, args, upstream_port, workers, threads):
+    port = free_port()
+    proc = start_server(kind, port, upstream_port, workers, threads, args.concurrency)
+    peak = [tree_rss(proc.pid)]
+    idle = peak[0]
+    sampling = threading.Event()
+
+    def sample():
+        while not sampling.wait(0.5):
+            peak[0] = max(peak[0], tree_rss(proc.pid))
+
+    threading.Thread(target=sample, daemon=True).start()
+    try:
+        latencies, statuses = asyncio.run(load(port, args.concurrency, args.seconds))
+    finally:
+        sampling.set()
+        proc.send_signal(signal.SIGTERM)
+        try:
+            proc.wait(15)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+    errors = ",".join(f"{k}:{v}" for k, v in sorted(statuses.items(), key=str) if k != 200) or "-"
+    print(f"{name:10} {workers:>2}x{threads:<4} {len(latencies) / args.seconds:8.1f} "
+          f"{percentile(latencies, 50) * 1000:8.0f} {percentile(latencies, 95) * 1000:8.0f} "
+          f"{idle:8.0f} {peak[0]:8.0f}  {errors}")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--concurrency', type=int, default=1000)
+    parser.add_argument('--upstream-ms', type=float, default=500.0)
+    parser.add_argument('--seconds', type=float, default=20.0)
+    parser.add_argument('--workers', type=int, default=2, help='WEB_CONCURRENCY لخادم sync')
+    parser.add_argument('--threads', type=int, default=8, help='GUNICORN_THREADS لخادم sync')
+    parser.add_argument('--sync-threads', type=int, default=64, help='خيوط sync-N (0 لتخطيها)')
+    parser.add_argument('--only', help='sync أو sync-N أو async مفصولة بفواصل')
+    args = parser.parse_args()
+
+    upstream_port = start_upstream(args.upstream_ms / 1000)
+    print(f"concurrency={args.concurrency} upstream={args.upstream_ms:.0f}ms seconds={args.seconds:.0f}")
+    print(f"{'server':10} {'procs':>7} {'req/s':>8} {'p50_ms':>8} {'p95_ms':>8} {'idle_MB':>8} {'peak_MB':>8}  errors")
+    cases = [("sync", "sync", args.workers, args.threads)]
+    if args.sync_threads:
+        cases.append(("sync-N", "sync", args.workers, args.sync_threads))
+    cases.append(("async", "async", 1, 1))
+    only = args.only.split(',') if args.only else None
+    for name, kind, workers, threads in cases:
+        if only is None or name in only:
+            run_case(name, kind, args, upstream_port, workers, threads)
+
+if __name__ == '__main__':
+    main()
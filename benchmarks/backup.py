@@ -0,0 +1,104 @@
+"""أثر النسخ الاحتياطي الحي على زمن /api/chat.
+
+    python benchmarks/backup.py --rows 100000 --threads 4
+
+يُحمَّل التطبيق في مجلد مؤقت مع خادم ذكاء وهمي (رد فوري) وتُملأ web_messages
+بصفوف مضغوطة، ثم تُرسل طلبات /api/chat متواصلة من عدة خيوط. يُقاس زمن الطلب
+بدون نسخ، ثم أثناء نسخ على خطوات صغيرة (الإعداد الافتراضي)، ثم أثناء نسخ في
+خطوة واحدة للمقارنة، ويُطبع p50/p95/p99 والحد الأقصى لكل مرحلة.
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from benchmarks._stubs import FakeUpstream, percentile  # noqa: E402
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, default=100000)
+    parser.add_argument('--threads', type=int, default=4)
+    parser.add_argument('--baseline', type=float, default=5.0, help='ثواني القياس بدون نسخ')
+    parser.add_argument('--step-pages', type=int, default=256)
+    parser.add_argument('--pause', type=float, default=0.05)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='backup-bench-')
+    os.chdir(workdir)
+    os.environ.setdefault('LOG_LEVEL', 'WARNING')
+    os.environ.setdefault('BOT_TOKEN', '0:bench')
+    os.environ['BACKUP_INTERVAL_HOURS'] = '0'
+    os.environ['TEXT_CODEC_MIGRATE'] = '0'
+    import app as app_module
+    from benchmarks.compression import synthetic_rows
+    from db_backup import copy_database
+    from text_codec import compress_text
+
+    # يرد فوراً حتى يظهر أثر قاعدة البيانات وحده
+    app_module.http = FakeUpstream(lambda: "رد تجريبي " * random.randint(20, 200))
+    conn = app_module.sqlite3.connect('bot_data.db')
+    conn.executemany("INSERT INTO web_messages (session_id, message, response, created_at) "
+                     "VALUES (?, ?, ?, ?)",
+                     ((f"seed-{i % 1000}", compress_text(m), compress_text(r), '2024-01-01')
+                      for i, (m, r) in enumerate(synthetic_rows(args.rows))))
+    conn.commit()
+    conn.close()
+    print(f"db: {os.path.getsize('bot_data.db') // 1024} kB, {args.rows} seeded rows")
+
+    samples = []
+    stop = threading.Event()
+    headers = {'X-API-Key': app_module.API_SECRET_KEY}
+
+    def load():
+        client = app_module.app.test_client()
+        sent = 0
+        session_id = None
+        while not stop.is_set():
+            if sent % 15 == 0:
+                session_id = app_module.create_session('bench')
+            started = time.perf_counter()
+            res = client.post('/api/chat', json={"message": "سؤال تجريبي", "session_id": session_id},
+                              headers=headers)
+            samples.append((started, time.perf_counter() - started, res.status_code))
+            sent += 1
+
+    threads = [threading.Thread(target=load, daemon=True) for _ in range(args.threads)]
+    for t in threads:
+        t.start()
+
+    phases = []
+    started = time.perf_counter()
+    time.sleep(args.baseline)
+    phases.append(("no backup", started, time.perf_counter(), None))
+    for name, pages, pause in (("stepped backup", args.step_pages, args.pause), ("single-step backup", -1, 0.0)):
+        started = time.perf_counter()
+        stats = copy_database('bot_data.db', os.path.join(workdir, 'copy.db'), step_pages=pages, pause=pause)
+        phases.append((name, started, time.perf_counter(), stats))
+        os.remove(os.path.join(workdir, 'copy.db'))
+        time.sleep(1.0)
+    stop.set()
+    for t in threads:
+        t.join()
+
+    print(f"{'phase':20} {'secs':>6} {'reqs':>6} {'errors':>6} {'p50_ms':>8} {'p95_ms':>8} "
+          f"{'p99_ms':>8} {'max_ms':>8} {'restarts':>8}")
+    for name, begin, end, stats in phases:
+        window = [(latency, status) for at, latency, status in samples if begin <= at < end]
+        latencies = [latency * 1000 for latency, _ in window]
+        errors = sum(1 for _, status in window if status != 200)
+        print(f"{name:20} {end - begin:6.1f} {len(window):6} {errors:6} "
+              f"{percentile(latencies, 50):8.2f} {percentile(latencies, 95):8.2f} "
+              f"{percentile(latencies, 99):8.2f} {max(latencies, default=0):8.2f} "
+              f"{stats['restarts'] if stats else '-':>8}")
+    if samples:
+        print(f"mean over run: {statistics.mean(s[1] for s in samples) * 1000:.2f} ms")
+
+if __name__ == '__main__':
+    main()
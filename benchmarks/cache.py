@@ -0,0 +1,92 @@
+"""كلفة البحث في ResponseCache لكل سؤال مع عدد كبير من المدخلات.
+
+    python benchmarks/cache.py --entries 1000000
+
+تُملأ الذاكرة بأسئلة اصطناعية فريدة ثم يُقاس زمن البحث لكل سؤال في ثلاث حالات:
+تطابق تام، تعديل طفيف (ترقيم ورموز تعبيرية وكلمة زائدة)، وسؤال غير موجود.
+يُطبع أيضاً زمن التخزين والذاكرة المستهلكة ومعدل الإصابة والدقة.
+"""
+import argparse
+import os
+import random
+import resource
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+WORDS = ("كيف ما هو افضل طريقة لتعلم البرمجة اللغة العربية الذكاء الاصطناعي شرح مثال "
+         "الفرق بين قاعدة بيانات خادم موقع تطبيق هاتف سريع مجاني كتاب رواية تاريخ علم "
+         "how what best way learn python code write explain example difference between "
+         "database server website app phone fast free book story history science math").split()
+
+def synthetic_prompts(count, seed=7):
+    rnd = random.Random(seed)
+    seen = set()
+    while len(seen) < count:
+        prompt = " ".join(rnd.choice(WORDS) for _ in range(rnd.randint(5, 12)))
+        if prompt not in seen:
+            seen.add(prompt)
+            yield prompt
+
+def near_duplicate(prompt, rnd):
+    words = prompt.split()
+    edit = rnd.randrange(3)
+    if edit == 0:
+        return prompt + rnd.choice(("؟", "?!", " 😈", "..."))
+    if edit == 1:
+        return prompt.replace(" ", ", ", 1) + "؟"
+    words.insert(rnd.randrange(len(words) + 1), rnd.choice(("من فضلك", "please", "يا")))
+    return " ".join(words)
+
+def rss_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+def timed(cache, prompts):
+    hits = 0
+    started = time.perf_counter()
+    for prompt in prompts:
+        hits += cache.lookup(prompt) is not None
+    return (time.perf_counter() - started) / len(prompts) * 1e6, hits / len(prompts)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--entries', type=int, default=1000000)
+    parser.add_argument('--queries', type=int, default=20000)
+    parser.add_argument('--threshold', type=float, default=0.8)
+    args = parser.parse_args()
+
+    os.chdir(tempfile.mkdtemp(prefix='cache-bench-'))
+    os.environ.setdefault('LOG_LEVEL', 'WARNING')
+    os.environ.setdefault('BOT_TOKEN', '0:bench')
+    from app import normalize_search_text
+    from response_cache import ResponseCache
+
+    cache = ResponseCache(normalize_search_text, max_entries=args.entries, max_bytes=1 << 40,
+                          threshold=args.threshold, ttl=86400)
+    response = "رد مخزن " * 20
+    before = rss_mb()
+    stored = []
+    started = time.perf_counter()
+    for prompt in synthetic_prompts(args.entries):
+        cache.store(prompt, response)
+        if len(stored) < args.queries:
+            stored.append(prompt)
+    store_us = (time.perf_counter() - started) / args.entries * 1e6
+    print(f"entries={len(cache)} store={store_us:.1f} us/entry rss+={rss_mb() - before:.0f} MB")
+
+    rnd = random.Random(1)
+    misses = [" ".join(rnd.choice(WORDS) for _ in range(14)) for _ in range(args.queries)]
+    cases = (("exact", stored),
+             ("near-duplicate", [near_duplicate(p, rnd) for p in stored]),
+             ("miss", misses))
+    print(f"{'case':16} {'us/lookup':>10} {'hit_rate':>9}")
+    for name, prompts in cases:
+        cost, rate = timed(cache, prompts)
+        print(f"{name:16} {cost:10.1f} {rate:9.3f}")
+    stats = cache.stats()
+    print(f"precision={stats['precision']} rejected={stats['rejected']} approx_hits={stats['approx_hits']}")
+
+if __name__ == '__main__':
+    main()
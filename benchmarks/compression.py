@@ -0,0 +1,83 @@
+"""تقرير نسبة ضغط web_messages وكلفة القراءة والكتابة لكل صف مقارنة بـ TEXT.
+
+    python benchmarks/compression.py --rows 20000
+    python benchmarks/compression.py --db bot_data.db      # عينة من بيانات حقيقية
+
+تُكتب نفس الصفوف إلى قاعدتين مؤقتتين (نص خام، وBLOB مضغوط لكل ترميز متاح)
+ويُقاس حجم الملف وزمن الإدخال وزمن القراءة مع فك الضغط لكل صف.
+"""
+import argparse
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from text_codec import available_codecs, compress_text, decompress_text  # noqa: E402
+
+PHRASES = [
+    "بالتأكيد! إليك شرحاً مفصلاً للموضوع خطوة بخطوة.",
+    "أولاً، يجب أن نفهم الفكرة الأساسية وراء هذا السؤال.",
+    "Here is a detailed explanation with examples you can try yourself.",
+    "ثانياً، لاحظ أن النتيجة تعتمد على السياق الذي تستخدمه فيه.",
+    "```python\nfor i in range(10):\n    print(i)\n```",
+    "إذا كان لديك أي سؤال آخر فلا تتردد في السؤال 😈",
+    "الخلاصة: هذه أفضل طريقة للتعامل مع المشكلة في معظم الحالات.",
+]
+
+def synthetic_rows(count, seed=1):
+    rnd = random.Random(seed)
+    for _ in range(count):
+        message = " ".join(rnd.choice(PHRASES[:3]) for _ in range(rnd.randint(1, 2)))
+        response = "\n".join(rnd.choice(PHRASES) for _ in range(rnd.randint(4, 30)))
+        yield message, response
+
+def rows_from_db(path, limit):
+    conn = sqlite3.connect(path)
+    for message, response in conn.execute(
+            "SELECT message, response FROM web_messages ORDER BY id DESC LIMIT ?", (limit,)):
+        yield decompress_text(message), decompress_text(response)
+    conn.close()
+
+def run(rows, codec):
+    fd, path = tempfile.mkstemp(suffix='.db')
+    os.close(fd)
+    conn = sqlite3.connect(path)
+    conn.execute("CREATE TABLE web_messages (id INTEGER PRIMARY KEY AUTOINCREMENT, session_id TEXT, "
+                 "message TEXT, response TEXT, created_at TIMESTAMP)")
+    encode = (lambda t: t) if codec == 'text' else (lambda t: compress_text(t, codec))
+    started = time.perf_counter()
+    for message, response in rows:
+        conn.execute("INSERT INTO web_messages (session_id, message, response, created_at) "
+                     "VALUES (?, ?, ?, ?)", ('s', encode(message), encode(response), '2024-01-01'))
+    conn.commit()
+    write_us = (time.perf_counter() - started) / len(rows) * 1e6
+    started = time.perf_counter()
+    for message, response in conn.execute("SELECT message, response FROM web_messages"):
+        decompress_text(message)
+        decompress_text(response)
+    read_us = (time.perf_counter() - started) / len(rows) * 1e6
+    conn.execute("VACUUM")
+    conn.close()
+    size = os.path.getsize(path)
+    os.remove(path)
+    return size, write_us, read_us
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, default=20000)
+    parser.add_argument('--db', help='قراءة العينة من قاعدة بيانات موجودة')
+    args = parser.parse_args()
+    rows = list(rows_from_db(args.db, args.rows) if args.db else synthetic_rows(args.rows))
+    base_size, base_write, base_read = run(rows, 'text')
+    print(f"{'codec':6} {'size_kB':>9} {'ratio':>6} {'write_us/row':>13} {'read_us/row':>12}")
+    print(f"{'text':6} {base_size // 1024:9} {1.0:6.2f} {base_write:13.1f} {base_read:12.1f}")
+    for codec in available_codecs()[1:]:
+        size, write_us, read_us = run(rows, codec)
+        print(f"{codec:6} {size // 1024:9} {base_size / size:6.2f} {write_us:13.1f} {read_us:12.1f}")
+
+if __name__ == '__main__':
+    main()
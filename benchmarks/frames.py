@@ -0,0 +1,126 @@
+"""زمن إطارات خلفية صفحة الموقع بالوضع العادي ووضع الأداء المنخفض على معالج مُبطَّأ.
+
+    python benchmarks/frames.py --chrome /path/to/chrome --throttle 4 --runs 3
+
+يُشغَّل gunicorn في مجلد مؤقت، ثم Chrome بدون واجهة عبر بروتوكول DevTools:
+Emulation.setCPUThrottlingRate يبطئ المعالج بمعامل --throttle (4 ≈ هاتف متوسط)،
+وتُفتح الصفحة بـ ?fps=1 (وبـ &lowcpu=1 للوضع المنخفض) فيطبع خطاف الصفحة بعد 5 ثوانٍ
+عدد الإطارات والمتوسط وp50 وp95. يُطبع لكل وضع وسيط الجولات، وعدد الجولات التي
+انتهت بوضع منخفض (الصفحة تفعّله تلقائياً إن كانت أول 120 إطاراً بطيئة، فيختلط
+الوضع العادي بالمنخفض على معالج بطيء جداً).
+
+Chrome: --chrome أو متغير CHROME أو chromium/google-chrome في PATH.
+"""
+import argparse
+import asyncio
+import os
+import re
+import shutil
+import signal
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import aiohttp
+import requests
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from benchmarks._stubs import free_port  # noqa: E402
+
+HOOK_LINE = re.compile(r'frames=(\d+) avg=([\d.]+)ms p50=([\d.]+)ms p95=([\d.]+)ms lowCpu=(\w+)')
+MODES = {'normal': '?fps=1', 'lowcpu': '?fps=1&lowcpu=1'}
+
+def find_chrome(path):
+    for candidate in (path, os.environ.get('CHROME'), 'chromium', 'chromium-browser', 'google-chrome'):
+        if candidate and shutil.which(candidate):
+            return shutil.which(candidate)
+    sys.exit("Chrome غير موجود: مرر --chrome أو CHROME")
+
+def wait_http(url, proc, timeout=60):
+    started = time.monotonic()
+    while time.monotonic() - started < timeout:
+        if proc.poll() is not None:
+            raise RuntimeError(f"{proc.args[0]} exited with {proc.returncode}")
+        try:
+            return requests.get(url, timeout=1)
+        except requests.RequestException:
+            time.sleep(0.1)
+    raise RuntimeError(f"no response from {url}")
+
+async def measure_page(ws_url, url, throttle, timeout=30):
+    """فتح الصفحة مع تبطيء المعالج وانتظار سطر خطاف ?fps=1"""
+    async with aiohttp.ClientSession() as session, session.ws_connect(ws_url, max_msg_size=0) as ws:
+        ids = iter(range(1, 1000))
+
+        async def call(method, **params):
+            await ws.send_json({"id": next(ids), "method": method, "params": params})
+
+        await call('Runtime.enable')
+        await call('Page.enable')
+        await call('Emulation.setCPUThrottlingRate', rate=throttle)
+        await call('Page.navigate', url=url)
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            msg = await ws.receive_json(timeout=deadline - time.monotonic())
+            if msg.get('method') != 'Runtime.consoleAPICalled':
+                continue
+            for arg in msg['params'].get('args', []):
+                match = HOOK_LINE.search(str(arg.get('value', '')))
+                if match:
+                    frames, avg, p50, p95, low = match.groups()
+                    return {"frames": int(frames), "avg": float(avg), "p50": float(p50),
+                            "p95": float(p95), "low_cpu": low == 'true'}
+    raise RuntimeError(f"no frame report from {url}")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--chrome')
+    parser.add_argument('--throttle', type=float, default=4)
+    parser.add_argument('--runs', type=int, default=3)
+    parser.add_argument('--size', default='390,844', help='عرض,ارتفاع النافذة')
+    args = parser.parse_args()
+    chrome = find_chrome(args.chrome)
+
+    workdir = tempfile.mkdtemp(prefix='frames-')
+    app_port, debug_port = free_port(), free_port()
+    env = dict(os.environ, PORT=str(app_port), WEB_CONCURRENCY='1',
+               PYTHONPATH=ROOT + os.pathsep + os.environ.get('PYTHONPATH', ''))
+    server = subprocess.Popen([sys.executable, '-m', 'gunicorn', 'app:app',
+                               '-c', os.path.join(ROOT, 'gunicorn.conf.py')],
+                              cwd=workdir, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    browser = subprocess.Popen([chrome, '--headless=new', '--no-sandbox', '--no-first-run',
+                                f'--remote-debugging-port={debug_port}', f'--window-size={args.size}',
+                                f'--user-data-dir={os.path.join(workdir, "chrome")}', 'about:blank'],
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        wait_http(f'http://127.0.0.1:{app_port}/livez', server)
+        wait_http(f'http://127.0.0.1:{debug_port}/json/version', browser)
+        results = {mode: [] for mode in MODES}
+        for _ in range(args.runs):
+            for mode, query in MODES.items():
+                target = requests.put(f'http://127.0.0.1:{debug_port}/json/new?about:blank', timeout=5).json()
+                try:
+                    results[mode].append(asyncio.run(measure_page(
+                        target['webSocketDebuggerUrl'], f'http://127.0.0.1:{app_port}/{query}', args.throttle)))
+                finally:
+                    requests.get(f'http://127.0.0.1:{debug_port}/json/close/{target["id"]}', timeout=5)
+        print(f"CPU throttle {args.throttle}x, window {args.size}, {args.runs} runs of 5 s (median per column)")
+        print(f"{'mode':8} {'frames':>7} {'avg ms':>7} {'p50 ms':>7} {'p95 ms':>7} {'ended low':>9}")
+        for mode, runs in results.items():
+            med = {k: statistics.median(r[k] for r in runs) for k in ('frames', 'avg', 'p50', 'p95')}
+            low = sum(r['low_cpu'] for r in runs)
+            print(f"{mode:8} {med['frames']:7.0f} {med['avg']:7.1f} {med['p50']:7.1f} {med['p95']:7.1f} "
+                  f"{low:>5}/{len(runs)}")
+    finally:
+        browser.terminate()
+        server.send_signal(signal.SIGTERM)
+        browser.wait(timeout=30)
+        server.wait(timeout=30)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+if __name__ == '__main__':
+    main()
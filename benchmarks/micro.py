@@ -0,0 +1,207 @@
+"""قياسات دقيقة لدوال قاعدة البيانات ولسلسلة معالجة رسائل تلغرام.
+
+    python benchmarks/micro.py --rows 10000 --save benchmarks/baseline.json
+    python benchmarks/micro.py --rows 10000 --compare benchmarks/baseline.json --tolerance 0.2
+    python benchmarks/micro.py --rows 10000000 --workdir /var/tmp/micro   # يُعاد استخدام القاعدة المعبأة
+
+يُحمَّل التطبيق في مجلد عمل (مؤقت افتراضياً) وتُعبأ bot_data.db بأحجام واقعية:
+`rows` صف في web_messages، وعُشرها جلسات ومشتركين، وجزء من مئة محظورين.
+البوت وخادم الذكاء بديلان وهميان فلا يخرج أي طلب شبكة، و`handle_all_messages`
+يُقاس عبر bot.process_new_updates أي مع مطابقة المعالجات في telebot.
+
+لكل حالة: عدد العمليات في الثانية، وذروة الذاكرة المؤقتة لكل استدعاء
+(tracemalloc)، وصافي الذاكرة المتبقية لكل استدعاء. --save يضيف النتائج إلى ملف
+JSON تحت مفتاح حجم البيانات، و--compare يعيد رمز خروج 1 عند تراجع يتجاوز السماحية.
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from benchmarks._stubs import FakeUpstream  # noqa: E402
+
+def stub_bot(bot):
+    """استبدال استدعاءات Bot API بدوال فارغة"""
+    sent = []
+    bot.reply_to = lambda message, text, **kwargs: sent.append(text)
+    bot.send_message = lambda chat_id, text, **kwargs: sent.append(text)
+    bot.send_chat_action = lambda chat_id, action, **kwargs: None
+    return sent
+
+def populate(conn, rows, compress_text, seed=3):
+    """تعبئة الجداول دفعة واحدة؛ النصوص المضغوطة محسوبة مسبقاً وتُكرر"""
+    rnd = random.Random(seed)
+    now = datetime.now()
+    sessions = max(1, rows // 10)
+    blobs = [(compress_text(f"سؤال تجريبي {i}"), compress_text("رد تجريبي " * rnd.randint(5, 40)))
+             for i in range(64)]
+    conn.execute("PRAGMA synchronous=OFF")
+    with conn:
+        conn.executemany("INSERT OR IGNORE INTO web_sessions VALUES (?, ?, ?, ?, ?)",
+                         ((f"seed-{i}", now - timedelta(days=i % 90), 10, now, 'seed')
+                          for i in range(sessions)))
+        conn.executemany("INSERT OR IGNORE INTO subscribed_users VALUES (?, ?, ?)",
+                         ((i, now, now + timedelta(days=30 if i % 2 else -1)) for i in range(sessions)))
+        conn.executemany("INSERT OR IGNORE INTO banned_users VALUES (?, ?, ?)",
+                         ((i * 100 + 1, 'seed', now) for i in range(max(1, rows // 100))))
+        conn.executemany("INSERT INTO web_messages (session_id, message, response, created_at) "
+                         "VALUES (?, ?, ?, ?)",
+                         ((f"seed-{i % sessions}",) + blobs[i % 64]
+                          + (now - timedelta(seconds=(rows - i) * 60),) for i in range(rows)))
+    conn.execute("PRAGMA synchronous=FULL")
+
+def make_update(update_id, user_id, text):
+    return {
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id,
+            "date": int(time.time()),
+            "chat": {"id": user_id, "type": "private"},
+            "from": {"id": user_id, "is_bot": False, "first_name": "bench"},
+            "text": text,
+        },
+    }
+
+def build_cases(app, telebot, rows):
+    sessions = max(1, rows // 10)
+    rnd = random.Random(11)
+    session_ids = [app.create_session('bench') for _ in range(64)]
+
+    def handler_chain(i):
+        # مستخدم مشترك (رقم فردي) ورسالة مختلفة كل مرة حتى لا تُخدم من الذاكرة المؤقتة
+        user_id = rnd.randrange(sessions // 2 or 1) * 2 + 1
+        update = telebot.types.Update.de_json(make_update(i + 1, user_id, f"سؤال رقم {i} عن البرمجة"))
+        app.bot.process_new_updates([update])
+
+    return {
+        "is_banned": lambda i: app.is_banned(rnd.randrange(rows)),
+        "is_subscribed": lambda i: app.is_subscribed(rnd.randrange(sessions)),
+        "rate_limit_check": lambda i: app.rate_limit_check(f"bench-{i}"),
+        "save_web_message": lambda i: app.save_web_message(session_ids[i % 64], "سؤال قصير", "رد تجريبي"),
+        "create_session": lambda i: app.create_session('bench'),
+        "handle_all_messages": handler_chain,
+    }
+
+def measure(fn, seconds, max_ops, alloc_ops):
+    for i in range(20):
+        fn(i)
+    ops = 0
+    started = time.perf_counter()
+    while ops < max_ops and time.perf_counter() - started < seconds:
+        fn(ops)
+        ops += 1
+    elapsed = time.perf_counter() - started
+
+    tracemalloc.start()
+    peak_total = 0
+    baseline, _ = tracemalloc.get_traced_memory()
+    for i in range(alloc_ops):
+        before, _ = tracemalloc.get_traced_memory()
+        tracemalloc.reset_peak()
+        fn(ops + i)
+        peak_total += tracemalloc.get_traced_memory()[1] - before
+    net = tracemalloc.get_traced_memory()[0] - baseline
+    tracemalloc.stop()
+    return {
+        "ops_per_sec": round(ops / elapsed, 1),
+        "alloc_peak_bytes": round(peak_total / alloc_ops),
+        "alloc_net_bytes": round(net / alloc_ops),
+    }
+
+def compare(results, baseline, tolerance):
+    """قائمة التراجعات: عمليات أقل أو ذاكرة أكثر من الأساس بأكثر من السماحية"""
+    regressions = []
+    for case, current in results.items():
+        base = baseline.get(case)
+        if not base:
+            continue
+        if current["ops_per_sec"] < base["ops_per_sec"] * (1 - tolerance):
+            regressions.append(f"{case}: ops/sec {base['ops_per_sec']} -> {current['ops_per_sec']}")
+        if current["alloc_peak_bytes"] > base["alloc_peak_bytes"] * (1 + tolerance) + 256:
+            regressions.append(f"{case}: alloc peak {base['alloc_peak_bytes']} -> "
+                               f"{current['alloc_peak_bytes']} bytes")
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, default=10000, help='مثلاً 10000 أو 1000000 أو 10000000')
+    parser.add_argument('--workdir', help='مجلد يُحفظ فيه bot_data.db المعبأ لإعادة استخدامه')
+    parser.add_argument('--seconds', type=float, default=2.0, help='مدة القياس لكل حالة')
+    parser.add_argument('--max-ops', type=int, default=20000)
+    parser.add_argument('--alloc-ops', type=int, default=200)
+    parser.add_argument('--only', help='حالات مفصولة بفواصل')
+    parser.add_argument('--save', help='إضافة النتائج إلى ملف JSON أساسي')
+    parser.add_argument('--compare', help='مقارنة النتائج بملف JSON أساسي')
+    parser.add_argument('--tolerance', type=float, default=0.15)
+    args = parser.parse_args()
+
+    workdir = os.path.join(args.workdir, f"rows-{args.rows}") if args.workdir else tempfile.mkdtemp(prefix='micro-')
+    os.makedirs(workdir, exist_ok=True)
+    save_path = os.path.abspath(args.save) if args.save else None
+    compare_path = os.path.abspath(args.compare) if args.compare else None
+    os.chdir(workdir)
+    os.environ.setdefault('LOG_LEVEL', 'WARNING')
+    os.environ.setdefault('BOT_TOKEN', '0:bench')
+    os.environ.update(BACKUP_INTERVAL_HOURS='0', TEXT_CODEC_MIGRATE='0', TELEGRAM_DEBOUNCE_MS='0')
+    import telebot
+    import app
+    from text_codec import compress_text
+
+    app.http = FakeUpstream("رد تجريبي قصير")
+    stub_bot(app.bot)
+    conn = sqlite3.connect('bot_data.db')
+    existing = conn.execute("SELECT COALESCE(MAX(id), 0) FROM web_messages").fetchone()[0]
+    if existing < args.rows:
+        started = time.perf_counter()
+        populate(conn, args.rows - existing, compress_text)
+        print(f"populated {args.rows - existing} rows in {time.perf_counter() - started:.1f}s")
+    conn.close()
+
+    cases = build_cases(app, telebot, args.rows)
+    if args.only:
+        cases = {name: fn for name, fn in cases.items() if name in args.only.split(',')}
+    results = {}
+    print(f"rows={args.rows} db={os.path.getsize('bot_data.db') // (1024 * 1024)} MB")
+    print(f"{'case':22} {'ops/sec':>10} {'peak_B/op':>10} {'net_B/op':>9}")
+    for name, fn in cases.items():
+        results[name] = measure(fn, args.seconds, args.max_ops, args.alloc_ops)
+        r = results[name]
+        print(f"{name:22} {r['ops_per_sec']:10.1f} {r['alloc_peak_bytes']:10} {r['alloc_net_bytes']:9}")
+
+    key = str(args.rows)
+    status = 0
+    if compare_path:
+        with open(compare_path) as f:
+            baseline = json.load(f).get("results", {}).get(key, {})
+        regressions = compare(results, baseline, args.tolerance)
+        for line in regressions:
+            print(f"REGRESSION {line}")
+        print(f"compared {len(baseline)} cases against {compare_path}: "
+              f"{'FAIL' if regressions else 'ok'} (tolerance {args.tolerance:.0%})")
+        status = 1 if regressions else 0
+    if save_path:
+        data = {"results": {}}
+        if os.path.exists(save_path):
+            with open(save_path) as f:
+                data = json.load(f)
+        data["meta"] = {"python": platform.python_version(), "sqlite": sqlite3.sqlite_version,
+                        "machine": platform.machine(), "saved_at": datetime.now().isoformat(timespec='seconds')}
+        data.setdefault("results", {})[key] = results
+        with open(save_path, 'w') as f:
+            json.dump(data, f, indent=2, sort_keys=True)
+            f.write("\n")
+        print(f"saved baseline for rows={key} to {save_path}")
+    return status
+
+if __name__ == '__main__':
+    sys.exit(main())
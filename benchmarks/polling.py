@@ -0,0 +1,224 @@
+"""إنتاجية الاستقبال بـ polling مقارنة بـ webhook، أمام خادم Bot API وهمي محلي.
+
+    python benchmarks/polling.py --updates 2000 --chats 50 --upstream-ms 20
+
+يشغَّل خادم HTTP محلي يحاكي getUpdates (مع long polling وتأكيد الإزاحة) و
+sendMessage وsendChatAction، ويُوجَّه إليه telebot عبر TELEGRAM_API_URL.
+خادم الذكاء بديل ينتظر --upstream-ms ثم يرد.
+
+- webhook: تُرسل التحديثات إلى /webhook من عدة خيوط (كما يفعل تلغرام) وتعالجها
+  مجموعة خيوط البوت.
+- polling: تُوضع التحديثات في الخادم الوهمي ويستقبلها run_polling.
+- إعادة التشغيل: يُوقف المستقبل بعد نصف الدفعة ويُشغَّل من جديد على نفس القاعدة،
+  ويُتحقق من عدم ضياع أو تكرار أي رد.
+
+لكل حالة: الزمن حتى آخر رد، والتحديثات في الثانية، وصحة ترتيب الردود في كل محادثة.
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+class FakeBotAPI:
+    """خادم Bot API مصغر: يحتفظ بالتحديثات غير المؤكدة ويسجل الردود"""
+
+    def __init__(self, port=0):
+        self.cond = threading.Condition()
+        self.updates = []
+        self.replies = []
+        self.next_message_id = 1
+        self.on_reply = None    # (chat_id, reply_to_message_id) من خيط الخادم
+        api = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def _params(self):
+                url = urlparse(self.path)
+                params = {k: v[0] for k, v in parse_qs(url.query).items()}
+                length = int(self.headers.get('Content-Length') or 0)
+                body = self.rfile.read(length) if length else b''
+                if body:
+                    if 'json' in (self.headers.get('Content-Type') or ''):
+                        params.update(json.loads(body))
+                    else:
+                        params.update({k: v[0] for k, v in parse_qs(body.decode()).items()})
+                return url.path.rsplit('/', 1)[-1], params
+
+            def _reply(self, result):
+                data = json.dumps({"ok": True, "result": result}).encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_GET(self):
+                self.do_POST()
+
+            def do_POST(self):
+                method, params = self._params()
+                if method == 'getUpdates':
+                    self._reply(api.get_updates(int(params.get('offset', 0)), int(params.get('limit', 100)),
+                                                float(params.get('timeout', 0))))
+                elif method == 'sendMessage':
+                    self._reply(api.record_reply(params))
+                else:
+                    self._reply(True)
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', port), Handler)
+        self.server.daemon_threads = True
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def push(self, updates):
+        with self.cond:
+            self.updates.extend(updates)
+            self.cond.notify_all()
+
+    def get_updates(self, offset, limit, timeout):
+        deadline = time.monotonic() + timeout
+        with self.cond:
+            # offset يؤكد كل ما قبله فيُحذف نهائياً كما في تلغرام
+            self.updates = [u for u in self.updates if u['update_id'] >= offset]
+            while not self.updates and time.monotonic() < deadline:
+                self.cond.wait(deadline - time.monotonic())
+            return self.updates[:limit]
+
+    def record_reply(self, params):
+        with self.cond:
+            message_id = self.next_message_id
+            self.next_message_id += 1
+            reply = (int(params['chat_id']), int(params.get('reply_to_message_id') or 0))
+            self.replies.append(reply)
+            self.cond.notify_all()
+        if self.on_reply:
+            self.on_reply(*reply)
+        return {"message_id": message_id, "date": int(time.time()),
+                "chat": {"id": int(params['chat_id']), "type": "private"}, "text": params.get('text', '')}
+
+    def wait_replies(self, count, timeout=300):
+        deadline = time.monotonic() + timeout
+        with self.cond:
+            while len(self.replies) < count and time.monotonic() < deadline:
+                self.cond.wait(0.5)
+            return len(self.replies)
+
+def make_updates(first_id, count, chats):
+    updates = []
+    for i in range(count):
+        update_id = first_id + i
+        chat_id = 1000 + i % chats
+        updates.append({"update_id": update_id, "message": {
+            "message_id": update_id, "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private"},
+            "from": {"id": chat_id, "is_bot": False, "first_name": "bench"},
+            "text": f"سؤال {update_id} عن البرمجة"}})
+    return updates
+
+def check(replies, updates):
+    """(مفقود، مكرر، محادثات بترتيب خاطئ)"""
+    expected = {u['message']['message_id'] for u in updates}
+    got = [message_id for _, message_id in replies]
+    missing = len(expected - set(got))
+    duplicated = len(got) - len(set(got))
+    last, disordered = {}, set()
+    for chat_id, message_id in replies:
+        if message_id < last.get(chat_id, 0):
+            disordered.add(chat_id)
+        last[chat_id] = message_id
+    return missing, duplicated, len(disordered)
+
+def report(name, started, finished, updates, replies):
+    missing, duplicated, disordered = check(replies, updates)
+    elapsed = finished - started
+    print(f"{name:10} {elapsed:8.2f} {len(updates) / elapsed:10.1f} {missing:8} {duplicated:10} {disordered:10}")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--updates', type=int, default=2000)
+    parser.add_argument('--chats', type=int, default=50)
+    parser.add_argument('--threads', type=int, default=8, help='BOT_THREADS')
+    parser.add_argument('--upstream-ms', type=float, default=20.0)
+    parser.add_argument('--senders', type=int, default=40, help='اتصالات webhook المتزامنة')
+    args = parser.parse_args()
+
+    api = FakeBotAPI()
+    os.chdir(tempfile.mkdtemp(prefix='polling-bench-'))
+    os.environ.update(BOT_TOKEN='123:fake', TELEGRAM_API_URL=api.url, TELEGRAM_MODE='webhook',
+                      TELEGRAM_POLL_TIMEOUT='2', BOT_THREADS=str(args.threads), BACKUP_INTERVAL_HOURS='0',
+                      TEXT_CODEC_MIGRATE='0', RESPONSE_CACHE_ENTRIES='0', WARMUP_TOP_K='0',
+                      AI_CONCURRENCY_INITIAL=str(args.threads * 4), AI_CONCURRENCY_MAX=str(args.threads * 4))
+    os.environ.setdefault('LOG_LEVEL', 'WARNING')
+    import app
+    from update_poller import UpdatePoller
+    from benchmarks._stubs import FakeUpstream
+
+    app.init_worker()
+    app.http = FakeUpstream(delay=args.upstream_ms / 1000)
+    for chat in range(args.chats):
+        app.add_subscription(1000 + chat, days=1)
+
+    print(f"updates={args.updates} chats={args.chats} threads={args.threads} upstream={args.upstream_ms}ms")
+    print(f"{'mode':10} {'secs':>8} {'updates/s':>10} {'missing':>8} {'duplicated':>10} {'disordered':>10}")
+
+    # webhook: تلغرام يرسل حتى max_connections طلباً متزامناً
+    updates = make_updates(1, args.updates, args.chats)
+    chunks = [updates[i::args.senders] for i in range(args.senders)]
+
+    def send(chunk):
+        client = app.app.test_client()
+        for update in chunk:
+            client.post('/webhook', data=json.dumps(update), content_type='application/json')
+
+    started = time.perf_counter()
+    senders = [threading.Thread(target=send, args=(chunk,)) for chunk in chunks]
+    for t in senders:
+        t.start()
+    api.wait_replies(len(updates))
+    report("webhook", started, time.perf_counter(), updates, api.replies)
+    for t in senders:
+        t.join()
+    # ترتيب webhook غير مضمون: المعالجات تعمل بالتوازي حتى لنفس المحادثة
+
+    # polling
+    api.replies.clear()
+    updates = make_updates(args.updates + 1, args.updates, args.chats)
+    api.push(updates)
+    started = time.perf_counter()
+    threading.Thread(target=app.run_polling, daemon=True).start()
+    api.wait_replies(len(updates))
+    report("polling", started, time.perf_counter(), updates, api.replies)
+    app.telegram_poller.stop()
+    time.sleep(3)
+
+    # إعادة التشغيل في منتصف الدفعة على نفس القاعدة
+    api.replies.clear()
+    updates = make_updates(2 * args.updates + 1, args.updates, args.chats)
+    api.push(updates)
+    started = time.perf_counter()
+    first = UpdatePoller('123:fake', app.process_raw_update, 'bot_data.db', api.url, timeout=2,
+                         workers=args.threads)
+    runner = threading.Thread(target=first.run)
+    runner.start()
+    api.wait_replies(len(updates) // 2)
+    first.stop()
+    runner.join()
+    second = UpdatePoller('123:fake', app.process_raw_update, 'bot_data.db', api.url, timeout=2,
+                          workers=args.threads)
+    threading.Thread(target=second.run, daemon=True).start()
+    api.wait_replies(len(updates), timeout=60)
+    report("restart", started, time.perf_counter(), updates, api.replies)
+    second.stop()
+
+if __name__ == '__main__':
+    main()
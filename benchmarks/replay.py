@@ -0,0 +1,344 @@
+"""إعادة تشغيل حركة مسجلة (traffic_capture.py) على نسخة محلية مع خادم ذكاء وBot API بديلين.
+
+    python benchmarks/replay.py captures/traffic.jsonl                    # بالسرعة الأصلية
+    python benchmarks/replay.py captures/traffic.jsonl --speed 4          # أسرع 4 مرات
+    python benchmarks/replay.py captures/traffic.jsonl --speed 0          # أقصى سرعة
+    python benchmarks/replay.py captures/traffic.jsonl --server async --save benchmarks/replay.json
+    python benchmarks/replay.py captures/traffic.jsonl --compare benchmarks/replay.json --tolerance 0.2
+
+افتراضياً يُشغَّل التطبيق بـ gunicorn (sync أو async) في مجلد مؤقت، وتُزرع قاعدته
+برموز الدخول المسجلة (استخدام غير محدود) واشتراكات لكل مستخدمي تلغرام. مع
+--target تُستخدم نسخة قائمة: يجب أن يشير AI_API_URL وTELEGRAM_API_URL فيها إلى
+--upstream-port و--bot-api-port، و--seed-db يزرع قاعدتها.
+
+- كل حدث يُرسل في موعده الأصلي مقسوماً على --speed، ولا يُرسل طلب جلسة أو محادثة
+  قبل وصول رد الطلب السابق لها، فيبقى ترتيب كل محادثة كما سُجل.
+- خادم الذكاء البديل يرد على كل سؤال بعد زمنه المسجل (بالترتيب للأسئلة المتكررة)،
+  وبالوسيط للأسئلة غير المسجلة؛ الأخطاء تُعاد 502 والمهل المنتهية 504 بعد زمنها.
+- لـ webhook يُقاس زمن الإقرار وزمن وصول sendMessage الرد (webhook_reply).
+
+يُطبع لكل نوع: العدد، والحالات غير 200، وp50/p90/p99/الحد الأقصى بالمللي ثانية
+مقارنة بالزمن المسجل في الإنتاج، وتأخر الإرسال عن الموعد. --save و--compare
+كما في benchmarks/micro.py.
+"""
+import argparse
+import asyncio
+import collections
+import json
+import os
+import platform
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime
+from urllib.parse import parse_qs, urlsplit
+
+import aiohttp
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from benchmarks._stubs import free_port, percentile
+from benchmarks.asgi import API_KEY, start_server
+from benchmarks.polling import FakeBotAPI
+
+def load_capture(path):
+    requests_, upstream = [], []
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            event = json.loads(line)
+            (upstream if event['kind'] == 'upstream' else requests_).append(event)
+    requests_.sort(key=lambda e: e['t'])
+    return requests_, upstream
+
+def chain_key(event):
+    if event['kind'] == 'chat':
+        return ('session', event['session'])
+    if event['kind'] == 'verify':
+        return ('code', event['code'])
+    return ('chat', event.get('chat'))
+
+class UpstreamStub:
+    """خادم ذكاء بديل يعيد أزمنة الاستجابة المسجلة لكل سؤال"""
+
+    def __init__(self, events, scale=1.0):
+        self.scale = scale
+        self.recorded = collections.defaultdict(collections.deque)
+        for event in sorted(events, key=lambda e: e['t']):
+            self.recorded[event['prompt']].append((event['ms'], event['outcome'], event.get('reply_len', 0)))
+        self.default_ms = statistics.median([e['ms'] for e in events]) if events else 50.0
+        self.served = self.unmatched = 0
+
+    def next_for(self, prompt):
+        queued = self.recorded.get(prompt)
+        if queued:
+            entry = queued.popleft()
+            if not queued:
+                queued.append(entry)
+            return entry
+        self.unmatched += 1
+        return self.default_ms, 'ok', 200
+
+    async def handle(self, reader, writer):
+        try:
+            while True:
+                head = await reader.readuntil(b"\r\n\r\n")
+                method, target = head.split(b" ", 2)[:2]
+                if method == b"HEAD":
+                    writer.write(b"HTTP/1.1 200 OK\r\nContent-Length: 0\r\n\r\n")
+                    await writer.drain()
+                    continue
+                query = parse_qs(urlsplit(target.decode('latin-1')).query)
+                ms, outcome, reply_len = self.next_for(query.get('gpt-5-mini', [''])[0])
+                self.served += 1
+                await asyncio.sleep(ms * self.scale / 1000)
+                if outcome in ('ok', 'empty'):
+                    body = json.dumps({"response": "ر" * reply_len if outcome == 'ok' else ""},
+                                      ensure_ascii=False).encode('utf-8')
+                    status = b"200 OK"
+                else:
+                    body = b'{}'
+                    status = b"504 Gateway Timeout" if outcome == 'timeout' else b"502 Bad Gateway"
+                writer.write(b"HTTP/1.1 " + status + b"\r\nContent-Type: application/json\r\nContent-Length: "
+                             + str(len(body)).encode() + b"\r\n\r\n" + body)
+                await writer.drain()
+        except (asyncio.IncompleteReadError, asyncio.CancelledError, ConnectionError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+def seed_database(db_path, events):
+    """رموز الدخول المسجلة صالحة بلا حد، وكل مستخدمي تلغرام مشتركون"""
+    codes = {e['code'] for e in events if e['kind'] == 'verify' and e.get('code')}
+    users = set()
+    for event in events:
+        if event['kind'] == 'webhook':
+            for value in event['update'].values():
+                if isinstance(value, dict) and isinstance(value.get('from'), dict):
+                    users.add(value['from']['id'])
+    now = datetime.now()
+    conn = sqlite3.connect(db_path, timeout=30)
+    with conn:
+        conn.executemany("INSERT OR REPLACE INTO access_codes (code, created_by, created_at, used_count, "
+                         "max_uses, active) VALUES (?, 0, ?, 0, -1, 1)", [(c, now) for c in codes])
+        conn.executemany("INSERT OR REPLACE INTO subscribed_users VALUES (?, ?, ?)",
+                         [(u, now, datetime(2100, 1, 1).strftime('%Y-%m-%d %H:%M:%S.%f')) for u in users])
+    conn.close()
+    return len(codes), len(users)
+
+async def replay(events, base_url, api_key, speed, bot_api, concurrency, reply_timeout):
+    loop = asyncio.get_running_loop()
+    samples = collections.defaultdict(list)
+    statuses = collections.defaultdict(collections.Counter)
+    lags = []
+    waiting = {}
+    reply_tasks = []
+
+    def on_reply(chat_id, message_id):
+        future = waiting.pop((chat_id, message_id), None)
+        if future is not None:
+            replied = time.monotonic()
+            loop.call_soon_threadsafe(lambda: future.done() or future.set_result(replied))
+
+    bot_api.on_reply = on_reply
+    limit = asyncio.Semaphore(concurrency)
+    connector = aiohttp.TCPConnector(limit=concurrency)
+    async with aiohttp.ClientSession(connector=connector, timeout=aiohttp.ClientTimeout(total=300)) as session:
+
+        async def await_reply(future, sent):
+            try:
+                replied = await asyncio.wait_for(future, reply_timeout)
+                samples['webhook_reply'].append((replied - sent) * 1000)
+                statuses['webhook_reply'][200] += 1
+            except asyncio.TimeoutError:
+                statuses['webhook_reply']['timeout'] += 1
+
+        async def send(event, due, previous):
+            if previous is not None:
+                await asyncio.wait([previous])
+            kind = event['kind']
+            headers = {'X-API-Key': api_key}
+            if kind == 'chat':
+                path, body = '/api/chat', {"message": event['message'], "session_id": event['session']}
+                if event.get('idempotency_key'):
+                    headers['Idempotency-Key'] = event['idempotency_key']
+            elif kind == 'verify':
+                path, body = '/api/verify-code', {"code": event['code']}
+            else:
+                path, body = '/webhook', event['update']
+                message = body.get('message') or {}
+                if message.get('text') and 'chat' in message:
+                    future = loop.create_future()
+                    waiting[(message['chat']['id'], message['message_id'])] = future
+            async with limit:
+                started = time.monotonic()
+                lags.append(max(0.0, started - due) * 1000)
+                try:
+                    async with session.post(base_url + path, json=body, headers=headers) as res:
+                        await res.read()
+                        status = res.status
+                except aiohttp.ClientError as e:
+                    status = type(e).__name__
+            statuses[kind][status] += 1
+            if status == 200:
+                samples[kind].append((time.monotonic() - started) * 1000)
+            if kind == 'webhook' and message.get('text') and 'chat' in message:
+                reply_tasks.append(asyncio.create_task(await_reply(future, started)))
+
+        chains, tasks = {}, []
+        started = time.monotonic()
+        t0 = events[0]['t'] if events else 0.0
+        for event in events:
+            due = started + ((event['t'] - t0) / speed if speed else 0.0)
+            if due > time.monotonic():
+                await asyncio.sleep(due - time.monotonic())
+            key = chain_key(event)
+            task = asyncio.create_task(send(event, due, chains.get(key)))
+            chains[key] = task
+            tasks.append(task)
+        await asyncio.gather(*tasks)
+        await asyncio.gather(*reply_tasks)
+        elapsed = time.monotonic() - started
+    bot_api.on_reply = None
+    return samples, statuses, lags, elapsed
+
+def summarize(samples, statuses, events):
+    captured = collections.defaultdict(list)
+    for event in events:
+        if event.get('status') == 200:
+            captured[event['kind']].append(event['ms'])
+    results = {}
+    for kind in sorted(set(statuses) | set(samples)):
+        values = samples.get(kind, [])
+        production = captured.get(kind)
+        results[kind] = {
+            "count": sum(statuses[kind].values()),
+            "errors": {str(k): v for k, v in statuses[kind].items() if k != 200},
+            "p50_ms": round(percentile(values, 50), 2),
+            "p90_ms": round(percentile(values, 90), 2),
+            "p99_ms": round(percentile(values, 99), 2),
+            "max_ms": round(max(values, default=0.0), 2),
+            "captured_p50_ms": round(percentile(production, 50), 2) if production else None,
+            "captured_p99_ms": round(percentile(production, 99), 2) if production else None,
+        }
+    return results
+
+def compare(results, baseline, tolerance):
+    regressions = []
+    for kind, current in results.items():
+        base = baseline.get(kind)
+        if not base:
+            continue
+        for metric in ("p50_ms", "p99_ms"):
+            if current[metric] > base[metric] * (1 + tolerance) + 1.0:
+                regressions.append(f"{kind}: {metric} {base[metric]} -> {current[metric]}")
+        if sum(current["errors"].values()) > sum(base["errors"].values()) * (1 + tolerance) + 1:
+            regressions.append(f"{kind}: errors {base['errors']} -> {current['errors']}")
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('capture', help='ملف JSONL من CAPTURE_PATH')
+    parser.add_argument('--speed', type=float, default=1.0, help='1 الأصلية، N أسرع، 0 أقصى سرعة')
+    parser.add_argument('--server', choices=('sync', 'async'), default='sync')
+    parser.add_argument('--workers', type=int, default=2)
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--concurrency', type=int, default=1000, help='حد الطلبات المفتوحة من أداة الإعادة')
+    parser.add_argument('--upstream-scale', type=float, default=1.0, help='معامل لأزمنة خادم الذكاء المسجلة')
+    parser.add_argument('--reply-timeout', type=float, default=120.0)
+    parser.add_argument('--limit', type=int, help='أول N حدث فقط')
+    parser.add_argument('--target', help='نسخة قائمة بدلاً من تشغيل واحدة، مثل http://127.0.0.1:5000')
+    parser.add_argument('--api-key', default=API_KEY)
+    parser.add_argument('--seed-db', help='bot_data.db للنسخة القائمة')
+    parser.add_argument('--upstream-port', type=int, default=0)
+    parser.add_argument('--bot-api-port', type=int, default=0)
+    parser.add_argument('--save', help='إضافة النتائج إلى ملف JSON أساسي')
+    parser.add_argument('--compare', help='مقارنة النتائج بملف JSON أساسي')
+    parser.add_argument('--tolerance', type=float, default=0.15)
+    args = parser.parse_args()
+
+    events, upstream_events = load_capture(args.capture)
+    if args.limit:
+        events = events[:args.limit]
+    if not events:
+        print("no request events in capture")
+        return 1
+    stub = UpstreamStub(upstream_events, args.upstream_scale)
+    bot_api = FakeBotAPI(args.bot_api_port)
+    upstream_port = args.upstream_port or free_port()
+    proc = None
+
+    async def run():
+        server = await asyncio.start_server(stub.handle, '127.0.0.1', upstream_port, backlog=4096)
+        async with server:
+            return await replay(events, base_url, args.api_key, args.speed, bot_api,
+                                args.concurrency, args.reply_timeout)
+
+    if args.target:
+        base_url = args.target.rstrip('/')
+        if args.seed_db:
+            seed_database(args.seed_db, events)
+        print(f"upstream stub: http://127.0.0.1:{upstream_port}/  bot api stub: {bot_api.url}")
+    else:
+        port = free_port()
+        workdir = tempfile.mkdtemp(prefix='replay-')
+        proc = start_server(args.server, port, upstream_port, args.workers, args.threads, 0, workdir=workdir,
+                            extra_env={'BOT_TOKEN': '123:replay', 'TELEGRAM_API_URL': bot_api.url,
+                                       'AI_CONCURRENCY_INITIAL': None, 'AI_CONCURRENCY_MAX': None,
+                                       'RESPONSE_CACHE_ENTRIES': None})
+        base_url = f"http://127.0.0.1:{port}"
+        codes, users = seed_database(os.path.join(workdir, 'bot_data.db'), events)
+        print(f"server={args.server} {args.workers}x{args.threads} seeded codes={codes} users={users}")
+    try:
+        samples, statuses, lags, elapsed = asyncio.run(run())
+    finally:
+        if proc is not None:
+            proc.terminate()
+            proc.wait(15)
+
+    span = events[-1]['t'] - events[0]['t']
+    print(f"events={len(events)} captured_span={span:.1f}s speed={args.speed or 'max'} "
+          f"replayed_in={elapsed:.1f}s upstream served={stub.served} unmatched={stub.unmatched}")
+    print(f"send lag p50={percentile(lags, 50):.1f}ms p99={percentile(lags, 99):.1f}ms")
+    results = summarize(samples, statuses, events)
+    print(f"{'kind':14} {'count':>6} {'p50_ms':>8} {'p90_ms':>8} {'p99_ms':>8} {'max_ms':>8} "
+          f"{'prod_p50':>8} {'prod_p99':>8}  errors")
+    for kind, r in results.items():
+        errors = ",".join(f"{k}:{v}" for k, v in r["errors"].items()) or "-"
+        production = [f"{r[m]:8.1f}" if r[m] is not None else f"{'-':>8}"
+                      for m in ("captured_p50_ms", "captured_p99_ms")]
+        print(f"{kind:14} {r['count']:6} {r['p50_ms']:8.1f} {r['p90_ms']:8.1f} {r['p99_ms']:8.1f} "
+              f"{r['max_ms']:8.1f} {production[0]} {production[1]}  {errors}")
+
+    key = f"{os.path.basename(args.capture)}@{args.speed or 'max'}"
+    status = 0
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f).get("results", {}).get(key, {})
+        regressions = compare(results, baseline, args.tolerance)
+        for line in regressions:
+            print(f"REGRESSION {line}")
+        print(f"compared {len(baseline)} kinds against {args.compare}: "
+              f"{'FAIL' if regressions else 'ok'} (tolerance {args.tolerance:.0%})")
+        status = 1 if regressions else 0
+    if args.save:
+        data = {"results": {}}
+        if os.path.exists(args.save):
+            with open(args.save) as f:
+                data = json.load(f)
+        data["meta"] = {"python": platform.python_version(), "server": args.target or args.server,
+                        "saved_at": datetime.now().isoformat(timespec='seconds')}
+        data.setdefault("results", {})[key] = results
+        with open(args.save, 'w') as f:
+            json.dump(data, f, indent=2, sort_keys=True)
+            f.write("\n")
+        print(f"saved results for {key} to {args.save}")
+    return status
+
+if __name__ == '__main__':
+    sys.exit(main())
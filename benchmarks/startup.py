@@ -0,0 +1,107 @@
+"""قياس زمن الإقلاع البارد وذاكرة كل عامل لـ gunicorn مع --preload وبدونه.
+
+    python benchmarks/startup.py --workers 4
+
+يُشغَّل gunicorn في مجلد مؤقت (حتى لا تُمس قاعدة البيانات الحقيقية) ويُقاس
+الزمن حتى أول رد 200 من /health وحتى إقلاع كل العمال، ثم RSS وPSS لكل عامل
+من /proc (PSS يوزع الصفحات المشتركة عبر fork على العمال فيظهر أثر التحميل المسبق).
+"""
+import argparse
+import os
+import shutil
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+
+import requests
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from benchmarks._stubs import free_port  # noqa: E402
+
+def children(pid):
+    result = []
+    for entry in os.listdir('/proc'):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f'/proc/{entry}/stat') as f:
+                fields = f.read().rsplit(')', 1)[1].split()
+        except OSError:
+            continue
+        if int(fields[1]) == pid:
+            result.append(int(entry))
+    return result
+
+def memory_kb(pid):
+    values = {}
+    with open(f'/proc/{pid}/smaps_rollup') as f:
+        for line in f:
+            key, _, rest = line.partition(':')
+            if key in ('Rss', 'Pss'):
+                values[key] = int(rest.split()[0])
+    return values
+
+def measure(preload, workers, timeout=60):
+    workdir = tempfile.mkdtemp(prefix='startup-')
+    port = free_port()
+    env = dict(os.environ, PORT=str(port), WEB_CONCURRENCY=str(workers),
+               GUNICORN_PRELOAD='1' if preload else '0',
+               PYTHONPATH=ROOT + os.pathsep + os.environ.get('PYTHONPATH', ''))
+    started = time.monotonic()
+    proc = subprocess.Popen([sys.executable, '-m', 'gunicorn', 'app:app',
+                             '-c', os.path.join(ROOT, 'gunicorn.conf.py')],
+                            cwd=workdir, env=env,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        first_ok = None
+        while time.monotonic() - started < timeout:
+            try:
+                if requests.get(f'http://127.0.0.1:{port}/health', timeout=1).status_code == 200:
+                    first_ok = time.monotonic() - started
+                    break
+            except requests.RequestException:
+                time.sleep(0.02)
+        while len(children(proc.pid)) < workers and time.monotonic() - started < timeout:
+            time.sleep(0.02)
+        # مهلة قصيرة حتى يكمل كل عامل تحميل التطبيق (بدون --preload)
+        deadline = time.monotonic() + 5
+        while time.monotonic() < deadline:
+            if all(memory_kb(pid)['Rss'] > 20000 for pid in children(proc.pid)):
+                break
+            time.sleep(0.05)
+        all_ready = time.monotonic() - started
+        per_worker = [memory_kb(pid) for pid in children(proc.pid)]
+        master = memory_kb(proc.pid)
+    finally:
+        proc.send_signal(signal.SIGTERM)
+        proc.wait(timeout=30)
+        shutil.rmtree(workdir, ignore_errors=True)
+    return {
+        'preload': preload,
+        'first_response_s': round(first_ok, 3) if first_ok is not None else None,
+        'all_workers_s': round(all_ready, 3),
+        'master_rss_kb': master['Rss'],
+        'worker_rss_kb': [m['Rss'] for m in per_worker],
+        'worker_pss_kb': [m['Pss'] for m in per_worker],
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--runs', type=int, default=3)
+    args = parser.parse_args()
+    for preload in (False, True):
+        for _ in range(args.runs):
+            r = measure(preload, args.workers)
+            pss = r['worker_pss_kb']
+            print(f"preload={r['preload']!s:5} first={r['first_response_s']}s "
+                  f"all={r['all_workers_s']}s master_rss={r['master_rss_kb']}kB "
+                  f"worker_rss={sum(r['worker_rss_kb']) // max(1, len(pss))}kB "
+                  f"worker_pss={sum(pss) // max(1, len(pss))}kB")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,189 @@
+"""نسخ احتياطي حي لقاعدة SQLite دون إيقاف الكتابة.
+
+تُنسخ القاعدة بواجهة backup في sqlite3 على خطوات صغيرة من الصفحات مع مهلة
+بين كل خطوة. في وضع WAL تُفتح معاملة قراءة على المصدر طوال النسخ فتُقرأ كل
+الخطوات من لقطة واحدة ولا يتوقف الكتّاب إطلاقاً. بدون WAL تبدأ SQLite النسخ من
+جديد مع كل كتابة من اتصال آخر؛ بعد عدد محدود من إعادة البدء تُنسخ القاعدة
+كلها في خطوة واحدة كي ينتهي النسخ تحت ضغط الكتابة.
+
+كل لقطة ملف gzip باسم زمني بجانبه ملف sha256 بصيغة sha256sum:
+    bot_data-20240101T030000Z.db.gz
+    bot_data-20240101T030000Z.db.gz.sha256
+
+    python db_backup.py backup  [--db bot_data.db] [--dir backups] [--keep 7]
+    python db_backup.py list    [--dir backups]
+    python db_backup.py restore backups/bot_data-....db.gz [--db bot_data.db]
+
+الاستعادة تتحقق من المجموع وسلامة اللقطة ثم تكتبها فوق القاعدة بواجهة backup
+نفسها، فتبقى الاتصالات المفتوحة سليمة؛ يُفضل إيقاف الخدمة قبلها.
+"""
+import argparse
+import gzip
+import hashlib
+import os
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+
+SUFFIX = '.db.gz'
+
+def _integrity_check(conn):
+    result = conn.execute("PRAGMA quick_check").fetchone()[0]
+    if result != 'ok':
+        raise RuntimeError(f"فشل فحص السلامة: {result}")
+
+class _TooManyRestarts(Exception):
+    pass
+
+def copy_database(src_path, dest_path, step_pages=256, pause=0.05, max_restarts=5, busy_timeout=5.0):
+    """نسخ src_path إلى dest_path على خطوات؛ يعيد إحصاءات النسخ"""
+    stats = {"steps": 0, "restarts": 0, "pages": 0, "final_step": False}
+    previous = [None]
+
+    def progress(status, remaining, total):
+        stats["steps"] += 1
+        stats["pages"] = total
+        if previous[0] is not None and remaining > previous[0]:
+            stats["restarts"] += 1
+            if stats["restarts"] >= max_restarts:
+                raise _TooManyRestarts()
+        previous[0] = remaining
+        if remaining:
+            time.sleep(pause)
+
+    src = sqlite3.connect(src_path, timeout=busy_timeout, check_same_thread=False)
+    dest = sqlite3.connect(dest_path)
+    try:
+        started = time.monotonic()
+        stats["snapshot"] = src.execute("PRAGMA journal_mode").fetchone()[0] == 'wal'
+        if stats["snapshot"]:
+            # القراءة في WAL لا تحجب الكتابة، وتثبيتها يمنع إعادة البدء بين الخطوات
+            src.execute("BEGIN")
+            src.execute("SELECT COUNT(*) FROM sqlite_master").fetchone()
+        try:
+            src.backup(dest, pages=step_pages, progress=progress, sleep=pause)
+        except _TooManyRestarts:
+            # الكتابة المستمرة تعيد النسخ من البداية؛ خطوة واحدة تحجز القراءة لمدة النسخ فقط
+            stats["final_step"] = True
+            src.backup(dest, pages=-1)
+        if stats["snapshot"]:
+            src.rollback()
+        _integrity_check(dest)
+        stats["seconds"] = round(time.monotonic() - started, 3)
+    finally:
+        dest.close()
+        src.close()
+    return stats
+
+def _sha256_file(path, chunk_size=1 << 20):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def create_backup(db_path, backup_dir, keep=7, step_pages=256, pause=0.05, level=6):
+    """إنشاء لقطة مضغوطة ذات مجموع تحقق ثم تطبيق سياسة الاحتفاظ؛ يعيد مسارها وإحصاءاتها"""
+    os.makedirs(backup_dir, exist_ok=True)
+    stem = os.path.splitext(os.path.basename(db_path))[0]
+    stamp = datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%SZ')
+    final_path = os.path.join(backup_dir, f"{stem}-{stamp}{SUFFIX}")
+    fd, raw_path = tempfile.mkstemp(suffix='.db', dir=backup_dir)
+    os.close(fd)
+    partial_path = final_path + '.partial'
+    try:
+        stats = copy_database(db_path, raw_path, step_pages=step_pages, pause=pause)
+        with open(raw_path, 'rb') as src, gzip.open(partial_path, 'wb', compresslevel=level) as dst:
+            shutil.copyfileobj(src, dst, 1 << 20)
+        checksum = _sha256_file(partial_path)
+        os.replace(partial_path, final_path)
+        with open(final_path + '.sha256', 'w') as f:
+            f.write(f"{checksum}  {os.path.basename(final_path)}\n")
+        stats.update(path=final_path, sha256=checksum,
+                     raw_bytes=os.path.getsize(raw_path), stored_bytes=os.path.getsize(final_path))
+    finally:
+        for path in (raw_path, partial_path):
+            if os.path.exists(path):
+                os.remove(path)
+    stats["pruned"] = prune_backups(backup_dir, keep, stem)
+    return stats
+
+def list_backups(backup_dir, stem=None):
+    """اللقطات الموجودة من الأقدم إلى الأحدث (الاسم الزمني يرتب أبجدياً)"""
+    if not os.path.isdir(backup_dir):
+        return []
+    names = sorted(name for name in os.listdir(backup_dir)
+                   if name.endswith(SUFFIX) and (stem is None or name.startswith(stem + '-')))
+    return [os.path.join(backup_dir, name) for name in names]
+
+def prune_backups(backup_dir, keep, stem=None):
+    """حذف اللقطات الأقدم مع ترك آخر `keep` لقطة؛ keep<=0 يعني الاحتفاظ بالكل"""
+    if keep <= 0:
+        return []
+    removed = list_backups(backup_dir, stem)[:-keep]
+    for path in removed:
+        for target in (path, path + '.sha256'):
+            if os.path.exists(target):
+                os.remove(target)
+    return removed
+
+def verify_backup(snapshot_path):
+    """مقارنة مجموع اللقطة بملف sha256 المرافق"""
+    with open(snapshot_path + '.sha256') as f:
+        expected = f.read().split()[0]
+    actual = _sha256_file(snapshot_path)
+    if actual != expected:
+        raise RuntimeError(f"مجموع التحقق لا يطابق: {actual} != {expected}")
+    return actual
+
+def restore_backup(snapshot_path, db_path):
+    """استعادة لقطة فوق db_path بعد التحقق من المجموع وسلامة القاعدة"""
+    verify_backup(snapshot_path)
+    fd, raw_path = tempfile.mkstemp(suffix='.db', dir=os.path.dirname(os.path.abspath(db_path)))
+    os.close(fd)
+    try:
+        with gzip.open(snapshot_path, 'rb') as src, open(raw_path, 'wb') as dst:
+            shutil.copyfileobj(src, dst, 1 << 20)
+        src = sqlite3.connect(raw_path)
+        dest = sqlite3.connect(db_path, timeout=30)
+        try:
+            _integrity_check(src)
+            src.backup(dest)
+        finally:
+            dest.close()
+            src.close()
+    finally:
+        os.remove(raw_path)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="نسخ احتياطي واستعادة لقاعدة SQLite")
+    sub = parser.add_subparsers(dest='command', required=True)
+    backup = sub.add_parser('backup')
+    backup.add_argument('--db', default='bot_data.db')
+    backup.add_argument('--dir', default=os.environ.get('BACKUP_DIR', 'backups'))
+    backup.add_argument('--keep', type=int, default=int(os.environ.get('BACKUP_KEEP', 7)))
+    backup.add_argument('--step-pages', type=int, default=256)
+    backup.add_argument('--pause', type=float, default=0.05)
+    listing = sub.add_parser('list')
+    listing.add_argument('--dir', default=os.environ.get('BACKUP_DIR', 'backups'))
+    restore = sub.add_parser('restore')
+    restore.add_argument('snapshot')
+    restore.add_argument('--db', default='bot_data.db')
+    args = parser.parse_args(argv)
+
+    if args.command == 'backup':
+        stats = create_backup(args.db, args.dir, args.keep, args.step_pages, args.pause)
+        print(f"{stats['path']}  {stats['stored_bytes']} bytes  {stats['seconds']}s  "
+              f"steps={stats['steps']} restarts={stats['restarts']}")
+    elif args.command == 'list':
+        for path in list_backups(args.dir):
+            print(f"{path}  {os.path.getsize(path)} bytes")
+    else:
+        restore_backup(args.snapshot, args.db)
+        print(f"restored {args.snapshot} -> {args.db}")
+
+if __name__ == '__main__':
+    sys.exit(main())
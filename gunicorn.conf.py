@@ -0,0 +1,16 @@
+# إعدادات gunicorn: تحميل التطبيق مرة واحدة في العملية الرئيسية ثم fork للعمال
+import os
+
+bind = f"0.0.0.0:{os.environ.get('PORT', 5000)}"
+workers = int(os.environ.get('WEB_CONCURRENCY', 2))
+threads = int(os.environ.get('GUNICORN_THREADS', 8))
+preload_app = os.environ.get('GUNICORN_PRELOAD', '1') == '1'
+# وضع asyncio: GUNICORN_WORKER_CLASS=uvicorn.workers.UvicornWorker مع asgi:application
+if os.environ.get('GUNICORN_WORKER_CLASS'):
+    worker_class = os.environ['GUNICORN_WORKER_CLASS']
+
+def post_worker_init(worker):
+    # الموارد غير الآمنة عبر fork تُنشأ من جديد في كل عامل بعد تحميل التطبيق
+    # وتثبيت معالجات الإشارات (post_fork أبكر من ذلك فتضيع فيه إشارات الإيقاف)
+    from app import init_worker
+    init_worker()
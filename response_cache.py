@@ -0,0 +1,219 @@
+"""ذاكرة مؤقتة تقريبية لردود الذكاء أمام get_ai_response.
+
+الأسئلة المتطابقة تقريباً (ترقيم مختلف، رموز تعبيرية، كلمة زائدة) تُطبَّع أولاً ثم
+تُقارن بتشابه Jaccard بين مجموعات المقاطع الحرفية الثلاثية (shingles):
+
+- توقيع MinHash من 32 قيمة 16-بت: كل مقطع يُجزأ بـ blake2b مرة واحدة ويُقسم
+  الملخص (64 بايت) إلى 32 دالة تجزئة مستقلة، والتوقيع أصغر قيمة لكل موضع.
+- فهرس LSH من `bands` شريطاً؛ الأسئلة التي تتطابق في شريط واحد على الأقل مرشحة.
+- يُتحقق من Jaccard الفعلي للمرشح قبل تقديم الرد، فلا يُقدَّم رد تحت العتبة أبداً.
+  نسبة المرشحين الذين تجاوز تقديرهم العتبة وتأكدوا هي `precision` في الإحصاءات.
+
+تُخزن فقط الأسئلة القصيرة غير الشخصية (بدون أرقام طويلة أو بريد أو روابط أو
+كلمات المتكلم). الذاكرة محدودة بعدد المدخلات وبحجم النصوص، والإخراج بترتيب LRU.
+"""
+import re
+import threading
+import time
+from array import array
+from collections import OrderedDict
+from hashlib import blake2b
+from operator import eq
+
+NUM_PERM = 32
+SHINGLE = 3
+
+_PERSONAL = re.compile(r'\d{4,}|@|https?:|www\.')
+_PERSONAL_WORDS = frozenset((
+    'i', 'im', 'me', 'my', 'mine', 'myself', 'id',
+    'انا', 'اسمي', 'عمري', 'عندي', 'لدي', 'حسابي', 'رقمي', 'عنواني', 'بياناتي',
+    'زوجي', 'زوجتي', 'ابني', 'بنتي', 'امي', 'ابي', 'صديقي', 'مديري', 'شركتي',
+))
+
+def shingles(text, size=SHINGLE):
+    if len(text) <= size:
+        return {text}
+    return {text[i:i + size] for i in range(len(text) - size + 1)}
+
+def minhash(shingle_set):
+    """توقيع MinHash (32 × uint16) كبايتات"""
+    digests = memoryview(b''.join([blake2b(s.encode('utf-8'), digest_size=2 * NUM_PERM).digest()
+                                   for s in shingle_set])).cast('H')
+    return array('H', [min(digests[i::NUM_PERM]) for i in range(NUM_PERM)]).tobytes()
+
+def estimate_jaccard(sig_a, sig_b):
+    return sum(map(eq, memoryview(sig_a).cast('H'), memoryview(sig_b).cast('H'))) / NUM_PERM
+
+def jaccard(set_a, set_b):
+    if not set_a or not set_b:
+        return 0.0
+    return len(set_a & set_b) / len(set_a | set_b)
+
+class ResponseCache:
+    """تطابق تام ثم تقريبي (MinHash/LSH) على السؤال المطبَّع، آمن بين الخيوط"""
+
+    def __init__(self, normalize, max_entries=50000, max_bytes=64 * 1024 * 1024, threshold=0.8,
+                 ttl=3600.0, max_prompt_chars=200, bands=8, max_candidates=32):
+        if NUM_PERM % bands:
+            raise ValueError("bands must divide %d" % NUM_PERM)
+        self.normalize = normalize
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_prompt_chars = max_prompt_chars
+        self.bands = bands
+        self.band_bytes = 2 * NUM_PERM // bands
+        self.max_candidates = max_candidates
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # id -> [prompt, signature, response, expires_at, size]
+        self._exact = {}               # prompt -> id
+        self._buckets = {}             # band key -> id أو قائمة ids
+        self._next_id = 0
+        self._bytes = 0
+        self._stats = {"lookups": 0, "ineligible": 0, "exact_hits": 0, "approx_hits": 0,
+                       "rejected": 0, "misses": 0, "stores": 0, "evictions": 0}
+
+    @property
+    def enabled(self):
+        return self.max_entries > 0
+
+    def cache_key(self, prompt):
+        """السؤال المطبَّع، أو None إن كان طويلاً أو شخصياً"""
+        if not prompt or len(prompt) > self.max_prompt_chars or _PERSONAL.search(prompt):
+            return None
+        key = self.normalize(prompt)
+        if not key or _PERSONAL_WORDS.intersection(key.split()):
+            return None
+        return key
+
+    def _band_keys(self, signature):
+        size = self.band_bytes
+        for band in range(self.bands):
+            yield (band << 64) | int.from_bytes(signature[band * size:(band + 1) * size], 'little')
+
+    def _bucket_add(self, band_key, entry_id):
+        current = self._buckets.get(band_key)
+        if current is None:
+            self._buckets[band_key] = entry_id
+        elif isinstance(current, list):
+            current.append(entry_id)
+        else:
+            self._buckets[band_key] = [current, entry_id]
+
+    def _bucket_remove(self, band_key, entry_id):
+        current = self._buckets.get(band_key)
+        if isinstance(current, list):
+            if entry_id in current:
+                current.remove(entry_id)
+            if len(current) == 1:
+                self._buckets[band_key] = current[0]
+        elif current == entry_id:
+            del self._buckets[band_key]
+
+    def _remove(self, entry_id):
+        prompt, signature, _, _, size = self._entries.pop(entry_id)
+        if self._exact.get(prompt) == entry_id:
+            del self._exact[prompt]
+        for band_key in self._band_keys(signature):
+            self._bucket_remove(band_key, entry_id)
+        self._bytes -= size
+
+    def _hit(self, entry_id, now):
+        entry = self._entries[entry_id]
+        if entry[3] <= now:
+            self._remove(entry_id)
+            return None
+        self._entries.move_to_end(entry_id)
+        return entry[2]
+
+    def lookup(self, prompt):
+        """الرد المخزن لسؤال مطابق أو مشابه فوق العتبة، وإلا None"""
+        if not self.enabled:
+            return None
+        key = self.cache_key(prompt)
+        with self._lock:
+            self._stats["lookups"] += 1
+            if key is None:
+                self._stats["ineligible"] += 1
+                return None
+            now = time.time()
+            entry_id = self._exact.get(key)
+            if entry_id is not None:
+                response = self._hit(entry_id, now)
+                if response is not None:
+                    self._stats["exact_hits"] += 1
+                    return response
+        query_shingles = shingles(key)
+        signature = minhash(query_shingles)
+        with self._lock:
+            candidates = set()
+            for band_key in self._band_keys(signature):
+                found = self._buckets.get(band_key)
+                if found is None:
+                    continue
+                if isinstance(found, list):
+                    # الأحدث أولاً؛ الشرائح المزدحمة لا تُقرأ كاملة
+                    candidates.update(found[-(self.max_candidates - len(candidates)):])
+                else:
+                    candidates.add(found)
+                if len(candidates) >= self.max_candidates:
+                    break
+            best_id, best_score = None, 0.0
+            for entry_id in candidates:
+                entry = self._entries.get(entry_id)
+                if entry is None or estimate_jaccard(signature, entry[1]) < self.threshold:
+                    continue
+                score = jaccard(query_shingles, shingles(entry[0]))
+                if score < self.threshold:
+                    self._stats["rejected"] += 1
+                elif score > best_score:
+                    best_id, best_score = entry_id, score
+            if best_id is not None:
+                response = self._hit(best_id, time.time())
+                if response is not None:
+                    self._stats["approx_hits"] += 1
+                    return response
+            self._stats["misses"] += 1
+        return None
+
+    def store(self, prompt, response, key=None):
+        """تخزين رد ناجح؛ يعيد الحجم المحسوب بالبايت، أو 0 للأسئلة غير المؤهلة"""
+        if not self.enabled or not response:
+            return 0
+        key = key or self.cache_key(prompt)
+        if key is None:
+            return 0
+        signature = minhash(shingles(key))
+        size = len(key.encode('utf-8')) + len(response.encode('utf-8')) + len(signature)
+        if size > self.max_bytes:
+            return 0
+        with self._lock:
+            previous = self._exact.get(key)
+            if previous is not None:
+                self._remove(previous)
+            entry_id = self._next_id
+            self._next_id += 1
+            self._entries[entry_id] = [key, signature, response, time.time() + self.ttl, size]
+            self._exact[key] = entry_id
+            for band_key in self._band_keys(signature):
+                self._bucket_add(band_key, entry_id)
+            self._bytes += size
+            self._stats["stores"] += 1
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+                self._stats["evictions"] += 1
+        return size
+
+    def __len__(self):
+        return len(self._entries)
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats, entries=len(self._entries), bytes=self._bytes)
+        eligible = stats["lookups"] - stats["ineligible"]
+        hits = stats["exact_hits"] + stats["approx_hits"]
+        stats["hit_rate"] = round(hits / eligible, 4) if eligible else 0.0
+        checked = stats["approx_hits"] + stats["rejected"]
+        stats["precision"] = round(stats["approx_hits"] / checked, 4) if checked else None
+        return stats
@@ -0,0 +1,320 @@
+"""حالة مشتركة بين العمال (عدادات وقيم مخزنة مؤقتاً) بواجهة قابلة للتبديل.
+
+الواجهة واحدة في كل التطبيقات:
+    get(key, default=None)
+    set(key, value, ttl=None)
+    incr(key, amount=1, ttl=None)            -> القيمة الجديدة
+    compare_and_set(key, expected, value, ttl=None) -> True عند النجاح
+    delete(key)
+
+القيم أي شيء قابل للتحويل إلى JSON. `ttl` بالثواني، ويُطبَّق في incr فقط عند
+إنشاء المفتاح حتى تعمل العدادات كنوافذ زمنية ثابتة. `expected=None` في
+compare_and_set يعني أن المفتاح يجب ألا يكون موجوداً.
+
+يُختار التطبيق عبر create_shared_state(url):
+    memory://                    داخل العملية فقط
+    sqlite:///path/to/state.db   ملف SQLite بوضع WAL يتشاركه كل العمال على نفس الجهاز
+    redis://host:port/db         أي خادم يتكلم بروتوكول RESP
+"""
+import json
+import socket
+import sqlite3
+import threading
+import time
+from urllib.parse import urlparse
+
+_MISSING = object()
+
+class MemoryState:
+    """تطبيق داخل العملية محمي بقفل"""
+
+    def __init__(self, sweep_every=1024):
+        self._lock = threading.Lock()
+        self._data = {}
+        self._ops = 0
+        self._sweep_every = sweep_every
+
+    def _live(self, key, now):
+        item = self._data.get(key)
+        if item is None:
+            return _MISSING
+        value, expires_at = item
+        if expires_at is not None and expires_at <= now:
+            del self._data[key]
+            return _MISSING
+        return value
+
+    def _tick(self, now):
+        self._ops += 1
+        if self._ops % self._sweep_every == 0:
+            for key in [k for k, (_, exp) in self._data.items() if exp is not None and exp <= now]:
+                del self._data[key]
+
+    def get(self, key, default=None):
+        with self._lock:
+            value = self._live(key, time.time())
+        return default if value is _MISSING else value
+
+    def set(self, key, value, ttl=None):
+        now = time.time()
+        with self._lock:
+            self._tick(now)
+            self._data[key] = (value, now + ttl if ttl else None)
+
+    def incr(self, key, amount=1, ttl=None):
+        now = time.time()
+        with self._lock:
+            self._tick(now)
+            value = self._live(key, now)
+            if value is _MISSING:
+                self._data[key] = (amount, now + ttl if ttl else None)
+                return amount
+            value += amount
+            self._data[key] = (value, self._data[key][1])
+            return value
+
+    def compare_and_set(self, key, expected, value, ttl=None):
+        now = time.time()
+        with self._lock:
+            current = self._live(key, now)
+            if (current is _MISSING and expected is not None) or \
+               (current is not _MISSING and current != expected):
+                return False
+            self._data[key] = (value, now + ttl if ttl else None)
+            return True
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def reset(self):
+        pass
+
+class SQLiteState:
+    """تطبيق متعدد العمليات فوق ملف SQLite بوضع WAL"""
+
+    def __init__(self, path, busy_timeout=5.0):
+        self.path = path
+        self.busy_timeout = busy_timeout
+        self._local = threading.local()
+        conn = self._conn()
+        conn.execute('''CREATE TABLE IF NOT EXISTS kv
+                        (key TEXT PRIMARY KEY, value TEXT, expires_at REAL)''')
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_kv_expires ON kv(expires_at)")
+
+    def _conn(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=self.busy_timeout,
+                                   isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def reset(self):
+        """إغلاق اتصال هذا الخيط، يُستدعى بعد fork"""
+        self._local = threading.local()
+
+    def _read(self, conn, key, now):
+        row = conn.execute("SELECT value, expires_at FROM kv WHERE key=?", (key,)).fetchone()
+        if row is None or (row[1] is not None and row[1] <= now):
+            return _MISSING, None
+        return json.loads(row[0]), row[1]
+
+    def get(self, key, default=None):
+        value, _ = self._read(self._conn(), key, time.time())
+        return default if value is _MISSING else value
+
+    def set(self, key, value, ttl=None):
+        now = time.time()
+        self._conn().execute("INSERT OR REPLACE INTO kv VALUES (?, ?, ?)",
+                             (key, json.dumps(value), now + ttl if ttl else None))
+
+    def incr(self, key, amount=1, ttl=None):
+        conn = self._conn()
+        now = time.time()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            value, expires_at = self._read(conn, key, now)
+            if value is _MISSING:
+                value, expires_at = amount, (now + ttl if ttl else None)
+            else:
+                value += amount
+            conn.execute("INSERT OR REPLACE INTO kv VALUES (?, ?, ?)",
+                         (key, json.dumps(value), expires_at))
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return value
+
+    def compare_and_set(self, key, expected, value, ttl=None):
+        conn = self._conn()
+        now = time.time()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            current, _ = self._read(conn, key, now)
+            if (current is _MISSING and expected is not None) or \
+               (current is not _MISSING and current != expected):
+                conn.execute("ROLLBACK")
+                return False
+            conn.execute("INSERT OR REPLACE INTO kv VALUES (?, ?, ?)",
+                         (key, json.dumps(value), now + ttl if ttl else None))
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return True
+
+    def delete(self, key):
+        self._conn().execute("DELETE FROM kv WHERE key=?", (key,))
+
+    def purge_expired(self):
+        """حذف المفاتيح المنتهية، تُستدعى دورياً"""
+        self._conn().execute("DELETE FROM kv WHERE expires_at IS NOT NULL AND expires_at <= ?",
+                             (time.time(),))
+
+class RedisError(Exception):
+    pass
+
+class RedisState:
+    """محول لبروتوكول RESP2 بدون اعتماديات خارجية، اتصال واحد لكل خيط"""
+
+    def __init__(self, host='127.0.0.1', port=6379, db=0, password=None, timeout=2.0):
+        self.host = host
+        self.port = port
+        self.db = db
+        self.password = password
+        self.timeout = timeout
+        self._local = threading.local()
+
+    def reset(self):
+        self._local = threading.local()
+
+    def _connect(self):
+        sock = socket.create_connection((self.host, self.port), timeout=self.timeout)
+        self._local.sock = sock
+        self._local.reader = sock.makefile('rb')
+        if self.password:
+            self._call('AUTH', self.password)
+        if self.db:
+            self._call('SELECT', self.db)
+
+    def _send(self, *commands):
+        if getattr(self._local, 'sock', None) is None:
+            self._connect()
+        out = []
+        for args in commands:
+            out.append(b'*%d\r\n' % len(args))
+            for arg in args:
+                if not isinstance(arg, bytes):
+                    arg = str(arg).encode('utf-8')
+                out.append(b'$%d\r\n%s\r\n' % (len(arg), arg))
+        try:
+            self._local.sock.sendall(b''.join(out))
+            # كل الردود تُقرأ قبل رفع أي خطأ حتى لا تبقى بايتات في المقبس للأوامر التالية
+            replies = [self._reply() for _ in commands]
+        except (OSError, RedisError):
+            # انقطاع أو رد غير مفهوم: موضع القراءة لم يعد معروفاً فيُغلق الاتصال
+            self._drop()
+            raise
+        for reply in replies:
+            error = _first_error(reply)
+            if error is not None:
+                raise error
+        return replies
+
+    def _drop(self):
+        sock = getattr(self._local, 'sock', None)
+        self._local.sock = None
+        if sock is not None:
+            try:
+                sock.close()
+            except OSError:
+                pass
+
+    def _call(self, *args):
+        return self._send(args)[0]
+
+    def _reply(self):
+        """رد واحد؛ ردود الخطأ تُعاد ككائنات RedisError ولا تُرفع هنا"""
+        line = self._local.reader.readline()
+        if not line:
+            raise RedisError("connection closed")
+        kind, rest = line[:1], line[1:-2]
+        if kind == b'+':
+            return rest.decode('utf-8')
+        if kind == b'-':
+            return RedisError(rest.decode('utf-8'))
+        if kind == b':':
+            return int(rest)
+        if kind == b'$':
+            size = int(rest)
+            if size < 0:
+                return None
+            data = self._local.reader.read(size + 2)
+            return data[:-2].decode('utf-8')
+        if kind == b'*':
+            size = int(rest)
+            if size < 0:
+                return None
+            return [self._reply() for _ in range(size)]
+        raise RedisError(f"unexpected reply: {line!r}")
+
+    def get(self, key, default=None):
+        raw = self._call('GET', key)
+        return default if raw is None else json.loads(raw)
+
+    def set(self, key, value, ttl=None):
+        if ttl:
+            self._call('SET', key, json.dumps(value), 'PX', int(ttl * 1000))
+        else:
+            self._call('SET', key, json.dumps(value))
+
+    def incr(self, key, amount=1, ttl=None):
+        if ttl:
+            # SET NX ينشئ المفتاح بمهلته مرة واحدة، وINCRBY يحافظ على المهلة
+            _, value = self._send(('SET', key, 0, 'PX', int(ttl * 1000), 'NX'),
+                                  ('INCRBY', key, amount))
+            return value
+        return self._call('INCRBY', key, amount)
+
+    def compare_and_set(self, key, expected, value, ttl=None):
+        self._call('WATCH', key)
+        try:
+            raw = self._call('GET', key)
+            current = None if raw is None else json.loads(raw)
+            if (raw is None and expected is not None) or (raw is not None and current != expected):
+                return False
+            args = ('SET', key, json.dumps(value)) + (('PX', int(ttl * 1000)) if ttl else ())
+            replies = self._send(('MULTI',), args, ('EXEC',))
+            return replies[-1] is not None
+        finally:
+            self._call('UNWATCH')
+
+    def delete(self, key):
+        self._call('DEL', key)
+
+def _first_error(reply):
+    if isinstance(reply, RedisError):
+        return reply
+    if isinstance(reply, list):
+        for item in reply:
+            error = _first_error(item)
+            if error is not None:
+                return error
+    return None
+
+def create_shared_state(url):
+    """إنشاء تطبيق الحالة المشتركة من عنوان URL"""
+    parsed = urlparse(url or 'memory://')
+    if parsed.scheme == 'memory':
+        return MemoryState()
+    if parsed.scheme == 'sqlite':
+        # sqlite:///relative.db و sqlite:////absolute/path.db
+        return SQLiteState(url[len('sqlite:///'):])
+    if parsed.scheme == 'redis':
+        db = int(parsed.path.lstrip('/') or 0)
+        return RedisState(parsed.hostname or '127.0.0.1', parsed.port or 6379, db, parsed.password)
+    raise ValueError(f"unknown shared state backend: {url}")
@@ -0,0 +1,140 @@
+"""خادم RESP2 مصغر داخل العملية لاختبار RedisState بدون Redis.
+
+يدعم AUTH وSELECT وPING وGET وSET (NX، PX) وINCRBY وDEL وPTTL وWATCH وUNWATCH
+وMULTI وEXEC، وهي الأوامر التي يرسلها RedisState فقط.
+
+    stub = RespStub()
+    state = RedisState('127.0.0.1', stub.port)
+    stub.fail_next['SET'] = 'ERR injected'     # رد خطأ لأول SET قادم
+    stub.before_exec = lambda: ...              # يُستدعى قبل EXEC والقفل ممسوك
+"""
+import socketserver
+import threading
+import time
+
+class RespStub:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.data = {}          # key -> bytes
+        self.expires = {}       # key -> وقت الانتهاء (time.monotonic)
+        self.versions = {}      # key -> رقم يزيد مع كل كتابة (لـ WATCH)
+        self.fail_next = {}     # اسم الأمر -> نص الخطأ
+        self.before_exec = None
+        self.commands = []
+        stub = self
+
+        class Handler(socketserver.StreamRequestHandler):
+            def handle(self):
+                session = {"watched": {}, "queued": None}
+                try:
+                    while True:
+                        args = stub._read_command(self.rfile)
+                        if args is None:
+                            return
+                        self.wfile.write(stub._execute(session, args))
+                except ConnectionError:
+                    pass
+
+        self.server = socketserver.ThreadingTCPServer(('127.0.0.1', 0), Handler)
+        self.server.daemon_threads = True
+        self.port = self.server.server_address[1]
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    @staticmethod
+    def _read_command(rfile):
+        line = rfile.readline()
+        if not line:
+            return None
+        args = []
+        for _ in range(int(line[1:-2])):
+            size = int(rfile.readline()[1:-2])
+            args.append(rfile.read(size + 2)[:-2])
+        return args
+
+    def _live(self, key):
+        expires_at = self.expires.get(key)
+        if expires_at is not None and expires_at <= time.monotonic():
+            self.data.pop(key, None)
+            self.expires.pop(key, None)
+        return self.data.get(key)
+
+    def _write(self, key, value, ttl_ms=None):
+        self.data[key] = value
+        if ttl_ms is None:
+            self.expires.pop(key, None)
+        else:
+            self.expires[key] = time.monotonic() + ttl_ms / 1000
+        self.versions[key] = self.versions.get(key, 0) + 1
+
+    def _execute(self, session, args):
+        name = args[0].decode().upper()
+        self.commands.append(name)
+        error = self.fail_next.pop(name, None)
+        if error is not None:
+            return b'-%s\r\n' % error.encode()
+        if session["queued"] is not None and name not in ('EXEC', 'MULTI'):
+            session["queued"].append(args)
+            return b'+QUEUED\r\n'
+        with self.lock:
+            if name == 'MULTI':
+                session["queued"] = []
+                return b'+OK\r\n'
+            if name == 'EXEC':
+                queued, session["queued"] = session["queued"], None
+                if self.before_exec:
+                    self.before_exec()
+                watched, session["watched"] = session["watched"], {}
+                if any(self.versions.get(k, 0) != v for k, v in watched.items()):
+                    return b'*-1\r\n'
+                return b'*%d\r\n' % len(queued) + b''.join(self._run(a) for a in queued)
+            if name == 'WATCH':
+                for key in args[1:]:
+                    session["watched"][key] = self.versions.get(key, 0)
+                return b'+OK\r\n'
+            if name == 'UNWATCH':
+                session["watched"] = {}
+                return b'+OK\r\n'
+            return self._run(args)
+
+    def _run(self, args):
+        name = args[0].decode().upper()
+        if name in ('AUTH', 'SELECT', 'PING'):
+            return b'+OK\r\n'
+        if name == 'GET':
+            value = self._live(args[1])
+            return b'$-1\r\n' if value is None else b'$%d\r\n%s\r\n' % (len(value), value)
+        if name == 'SET':
+            key, value, options = args[1], args[2], [a.decode().upper() for a in args[3:]]
+            if 'NX' in options and self._live(key) is not None:
+                return b'$-1\r\n'
+            ttl_ms = int(options[options.index('PX') + 1]) if 'PX' in options else None
+            self._write(key, value, ttl_ms)
+            return b'+OK\r\n'
+        if name == 'INCRBY':
+            key = args[1]
+            current = self._live(key) or b'0'
+            if not current.lstrip(b'-').isdigit():
+                return b'-ERR value is not an integer or out of range\r\n'
+            value = int(current) + int(args[2])
+            ttl = self.expires.get(key)
+            self.data[key] = str(value).encode()
+            self.versions[key] = self.versions.get(key, 0) + 1
+            if ttl is not None:
+                self.expires[key] = ttl
+            return b':%d\r\n' % value
+        if name == 'PTTL':
+            if self._live(args[1]) is None:
+                return b':-2\r\n'
+            expires_at = self.expires.get(args[1])
+            return b':-1\r\n' if expires_at is None else b':%d\r\n' % int((expires_at - time.monotonic()) * 1000)
+        if name == 'DEL':
+            removed = sum(1 for key in args[1:] if self.data.pop(key, None) is not None)
+            for key in args[1:]:
+                self.expires.pop(key, None)
+                self.versions[key] = self.versions.get(key, 0) + 1
+            return b':%d\r\n' % removed
+        return b'-ERR unknown command %s\r\n' % name.encode()
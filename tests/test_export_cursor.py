@@ -0,0 +1,64 @@
+import base64
+import hashlib
+import hmac
+import json
+from datetime import datetime, timedelta
+
+import pytest
+
+@pytest.fixture
+def app(app_module):
+    return app_module
+
+def messages(app, session_id, count):
+    for i in range(count):
+        app.save_web_message(session_id, f"سؤال {i}", f"رد {i}")
+
+def forge(app, state, key):
+    payload = base64.urlsafe_b64encode(json.dumps(state, separators=(',', ':')).encode()).rstrip(b'=')
+    return f"{payload.decode()}.{hmac.new(key, payload, hashlib.sha256).hexdigest()[:16]}"
+
+def test_round_trip_keeps_filters_and_snapshot(app):
+    messages(app, 'cursor-a', 3)
+    start, end = datetime.now() - timedelta(hours=1), datetime.now() + timedelta(hours=1)
+    state = app.parse_export_cursor(app.make_export_cursor('messages', start, end, 'cursor-a'))
+    assert state["k"] == 'messages'
+    assert state["session"] == 'cursor-a'
+    assert state["from"] == start.isoformat() and state["to"] == end.isoformat()
+    assert state["max"] >= state["after"] + 3
+
+def test_snapshot_and_resume(app):
+    messages(app, 'cursor-b', 3)
+    state = app.parse_export_cursor(app.make_export_cursor('messages', session_id='cursor-b'))
+    messages(app, 'cursor-b', 2)  # بعد بدء التصدير: خارج اللقطة
+    rows = list(app.iter_export_rows(state))
+    assert [r[4] for r in rows] == ["رد 0", "رد 1", "رد 2"]
+    resumed = list(app.iter_export_rows(state, after=rows[1][0]))
+    assert [r[0] for r in resumed] == [rows[2][0]]
+
+@pytest.mark.parametrize('mutate', [
+    lambda p, s: (p[:-1] + ('A' if p[-1] != 'A' else 'B'), s),
+    lambda p, s: (p, s[:-1] + ('0' if s[-1] != '0' else '1')),
+    lambda p, s: (p, ''),
+])
+def test_tampered_cursor_rejected(app, mutate):
+    payload, signature = app.make_export_cursor('sessions').rsplit('.', 1)
+    payload, signature = mutate(payload, signature)
+    with pytest.raises(ValueError):
+        app.parse_export_cursor(f"{payload}.{signature}")
+
+@pytest.mark.parametrize('token', ['', 'no-dot', '...', 'a.b.c'])
+def test_malformed_cursor_rejected(app, token):
+    with pytest.raises(ValueError):
+        app.parse_export_cursor(token)
+
+def test_cursor_signed_with_public_api_key_rejected(app):
+    state = {"k": "messages", "after": 0, "max": 10 ** 9, "session": None, "from": None, "to": None}
+    with pytest.raises(ValueError):
+        app.parse_export_cursor(forge(app, state, app.API_SECRET_KEY.encode()))
+    assert app.parse_export_cursor(forge(app, state, app.EXPORT_SIGNING_KEY)) == state
+
+def test_unknown_kind_rejected_even_when_signed(app):
+    state = {"k": "access_codes", "after": 0, "max": 10, "session": None, "from": None, "to": None}
+    with pytest.raises(ValueError):
+        app.parse_export_cursor(forge(app, state, app.EXPORT_SIGNING_KEY))
@@ -0,0 +1,112 @@
+import threading
+import time
+from types import SimpleNamespace
+
+import pytest
+
+def message(chat_id, text):
+    return SimpleNamespace(chat=SimpleNamespace(id=chat_id), text=text)
+
+class Recorder:
+    """دالة flush تسجل الدفعات، ويمكن حجزها لمحاكاة رد بطيء"""
+
+    def __init__(self, fail_on=()):
+        self.batches = []
+        self.flushed_at = []
+        self.active = {}
+        self.overlap = False
+        self.gate = threading.Event()
+        self.gate.set()
+        self.fail_on = fail_on
+        self.done = threading.Condition()
+
+    def __call__(self, messages, first_at):
+        chat_id = messages[0].chat.id
+        with self.done:
+            if self.active.get(chat_id):
+                self.overlap = True
+            self.active[chat_id] = True
+        try:
+            self.gate.wait(5)
+            if messages[0].text in self.fail_on:
+                raise RuntimeError("flush failed")
+        finally:
+            with self.done:
+                self.active[chat_id] = False
+                self.batches.append([m.text for m in messages])
+                self.flushed_at.append(time.monotonic())
+                self.done.notify_all()
+
+    def wait_for(self, count, timeout=5):
+        with self.done:
+            assert self.done.wait_for(lambda: len(self.batches) >= count, timeout), self.batches
+
+def thread_submit(fn, *args):
+    threading.Thread(target=fn, args=args, daemon=True).start()
+
+@pytest.fixture
+def make_batcher(app_module):
+    def make(flush, window=0.05, max_wait=1.0):
+        return app_module.MessageBatcher(flush, window, max_wait, thread_submit)
+    return make
+
+def test_messages_within_window_are_merged_in_order(make_batcher):
+    flush = Recorder()
+    batcher = make_batcher(flush)
+    for text in ("a", "b", "c"):
+        batcher.add(message(1, text))
+    flush.wait_for(1)
+    time.sleep(0.1)
+    assert flush.batches == [["a", "b", "c"]]
+    stats = batcher.stats()
+    assert stats["messages_in"] == 3 and stats["batches_out"] == 1 and stats["merge_ratio"] == 3.0
+
+def test_chats_are_flushed_separately(make_batcher):
+    flush = Recorder()
+    batcher = make_batcher(flush)
+    batcher.add(message(1, "a1"))
+    batcher.add(message(2, "b1"))
+    batcher.add(message(1, "a2"))
+    flush.wait_for(2)
+    assert sorted(flush.batches) == [["a1", "a2"], ["b1"]]
+
+def test_max_wait_caps_a_busy_chat(make_batcher):
+    flush = Recorder()
+    batcher = make_batcher(flush, window=0.1, max_wait=0.25)
+    started = time.monotonic()
+    for i in range(10):
+        batcher.add(message(1, str(i)))
+        time.sleep(0.05)
+    # بدون السقف تُعاد الجدولة مع كل رسالة فتخرج دفعة واحدة بعد آخرها (~0.55 ث)
+    flush.wait_for(2)
+    time.sleep(0.15)
+    assert flush.flushed_at[0] - started < 0.4
+    assert sum(flush.batches, []) == [str(i) for i in range(10)]
+
+def test_batches_of_one_chat_never_overlap(make_batcher):
+    flush = Recorder()
+    flush.gate.clear()
+    batcher = make_batcher(flush, window=0.02)
+    batcher.add(message(1, "first"))
+    time.sleep(0.1)                     # الدفعة الأولى قيد التفريغ ومحجوزة
+    batcher.add(message(1, "second"))
+    batcher.add(message(2, "other"))
+    time.sleep(0.1)
+    assert batcher.stats()["flushing_chats"] == 2
+    assert flush.batches == []
+    flush.gate.set()
+    flush.wait_for(3)
+    assert not flush.overlap
+    chat_one = [b for b in flush.batches if b[0] != "other"]
+    assert chat_one == [["first"], ["second"]]
+    time.sleep(0.05)
+    assert batcher.stats()["flushing_chats"] == 0
+
+def test_failed_flush_does_not_block_the_chat(make_batcher):
+    flush = Recorder(fail_on=("boom",))
+    batcher = make_batcher(flush, window=0.02)
+    batcher.add(message(1, "boom"))
+    flush.wait_for(1)
+    batcher.add(message(1, "after"))
+    flush.wait_for(2)
+    assert flush.batches == [["boom"], ["after"]]
@@ -0,0 +1,77 @@
+import os
+import sys
+import time
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from response_cache import NUM_PERM, ResponseCache, estimate_jaccard, jaccard, minhash, shingles
+
+@pytest.fixture
+def cache(app_module):
+    return ResponseCache(app_module.normalize_search_text, threshold=0.8)
+
+@pytest.mark.parametrize('variant', [
+    "ما هي عاصمة فرنسا؟",
+    "ما هي عاصمة فرنسا",
+    "  ما   هي عاصمة فرنسا ؟؟ ",
+    "مَا هِيَ عَاصِمَةُ فَرَنْسَا؟",
+    "ما هي عاصمـــة فرنسا!",
+])
+def test_normalised_variants_hit_exactly(cache, variant):
+    cache.store("ما هي عاصمة فرنسا؟", "باريس")
+    assert cache.cache_key(variant) == cache.cache_key("ما هي عاصمة فرنسا؟")
+    assert cache.lookup(variant) == "باريس"
+    assert cache.stats()["exact_hits"] == 1
+
+def test_near_duplicate_served_through_lsh(cache):
+    cache.store("what is the capital city of france", "Paris")
+    query = "what is the capital city of france please"
+    key = cache.cache_key(query)
+    assert key != cache.cache_key("what is the capital city of france")
+    assert jaccard(shingles(key), shingles("what is the capital city of france")) >= 0.8
+    assert cache.lookup(query) == "Paris"
+    stats = cache.stats()
+    assert stats["approx_hits"] == 1 and stats["exact_hits"] == 0
+
+def test_dissimilar_prompt_misses(cache):
+    cache.store("what is the capital city of france", "Paris")
+    assert cache.lookup("how do I bake sourdough bread at home") is None
+    assert cache.lookup("what is the capital city of spain") is None
+    assert cache.stats()["approx_hits"] == 0
+
+@pytest.mark.parametrize('prompt', [
+    "my account number is 12345678",
+    "email me at someone@example.com",
+    "انا عمري ثلاثون سنة",
+    "see https://example.com",
+    "x" * 201,
+    "",
+])
+def test_personal_or_long_prompts_are_not_cached(cache, prompt):
+    assert cache.cache_key(prompt) is None
+    assert cache.store(prompt, "reply") == 0
+    assert len(cache) == 0
+
+def test_expired_entry_is_dropped(app_module):
+    cache = ResponseCache(app_module.normalize_search_text, ttl=0.01)
+    cache.store("what is the capital city of france", "Paris")
+    time.sleep(0.02)
+    assert cache.lookup("what is the capital city of france") is None
+    assert len(cache) == 0
+
+def test_lru_eviction_by_entries(app_module):
+    cache = ResponseCache(app_module.normalize_search_text, max_entries=2)
+    for i, prompt in enumerate(["first question here", "second question here", "third question here"]):
+        cache.store(prompt, str(i))
+    assert cache.lookup("first question here") is None
+    assert cache.lookup("third question here") == "2"
+    assert cache.stats()["evictions"] == 1
+
+def test_minhash_estimate_tracks_jaccard():
+    a, b = shingles("the quick brown fox jumps over"), shingles("the quick brown fox jumped over")
+    assert len(minhash(a)) == 2 * NUM_PERM
+    assert estimate_jaccard(minhash(a), minhash(a)) == 1.0
+    assert abs(estimate_jaccard(minhash(a), minhash(b)) - jaccard(a, b)) < 0.3
@@ -0,0 +1,63 @@
+import os
+import sys
+import time
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from resp_stub import RespStub
+from shared_state import RedisError, RedisState
+
+@pytest.fixture
+def stub():
+    server = RespStub()
+    yield server
+    server.close()
+
+@pytest.fixture
+def state(stub):
+    return RedisState('127.0.0.1', stub.port)
+
+def test_incr_sets_ttl_only_on_create(state, stub):
+    assert state.incr('hits', ttl=60) == 1
+    first_expiry = stub.expires[b'hits']
+    time.sleep(0.01)
+    assert state.incr('hits', 2, ttl=60) == 3
+    assert stub.expires[b'hits'] == first_expiry
+    assert 0 < state._call('PTTL', 'hits') <= 60000
+
+def test_incr_without_ttl_never_expires(state, stub):
+    assert state.incr('total') == 1
+    assert b'total' not in stub.expires
+
+def test_compare_and_set(state):
+    assert state.compare_and_set('owner', None, 1, ttl=30)
+    assert not state.compare_and_set('owner', None, 2)
+    assert not state.compare_and_set('owner', 2, 3)
+    assert state.compare_and_set('owner', 1, 4)
+    assert state.get('owner') == 4
+
+def test_compare_and_set_conflict(state, stub):
+    state.set('owner', 1)
+    # كتابة عميل آخر بين GET وEXEC
+    stub.before_exec = lambda: stub._write(b'owner', b'9')
+    assert not state.compare_and_set('owner', 1, 2)
+    assert state.get('owner') == 9
+
+def test_pipeline_error_keeps_connection_in_sync(state, stub):
+    stub.fail_next['SET'] = 'ERR injected'
+    with pytest.raises(RedisError, match='injected'):
+        state.incr('hits', ttl=60)
+    # رد INCRBY من الدفعة الفاشلة قُرئ ولم يبق في المقبس
+    assert state.get('hits') == 1
+    state.set('name', 'mobi')
+    assert state.get('name') == 'mobi'
+    assert state.incr('hits') == 2
+
+def test_error_reply_raises(state):
+    state.set('name', 'mobi')
+    with pytest.raises(RedisError, match='not an integer'):
+        state.incr('name')
+    assert state.get('name') == 'mobi'
@@ -0,0 +1,65 @@
+import os
+import sys
+import zlib
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import text_codec
+from text_codec import RAW, ZLIB, ZSTD, compress_text, decompress_text
+
+TEXTS = [
+    "",
+    "ok",
+    "مرحبا",
+    "😈 موبي",
+    "سؤال طويل يتكرر " * 50,
+    "line one\nline two\ttab   separator \x00 nul",
+    "".join(chr(c) for c in range(0x20, 0x2000, 7)),
+]
+CODECS = ['none', 'zlib'] + (['zstd'] if text_codec.zstandard is not None else [])
+
+@pytest.mark.parametrize('codec', CODECS)
+@pytest.mark.parametrize('text', TEXTS, ids=range(len(TEXTS)))
+def test_round_trip(codec, text):
+    packed = compress_text(text, codec)
+    assert isinstance(packed, bytes)
+    assert decompress_text(packed) == text
+
+@pytest.mark.parametrize('codec', CODECS)
+def test_raw_when_compression_does_not_help(codec):
+    packed = compress_text("ok", codec)
+    assert packed == bytes([RAW]) + b"ok"
+
+def test_header_byte():
+    text = "سؤال طويل يتكرر " * 50
+    assert compress_text(text, 'none')[0] == RAW
+    packed = compress_text(text, 'zlib')
+    assert packed[0] == ZLIB
+    assert zlib.decompress(packed[1:]).decode('utf-8') == text
+    assert len(packed) < len(text.encode('utf-8'))
+
+def test_zstd_falls_back_to_zlib_without_the_package(monkeypatch):
+    monkeypatch.setattr(text_codec, 'zstandard', None)
+    assert compress_text("سؤال طويل يتكرر " * 50, 'zstd')[0] == ZLIB
+
+@pytest.mark.skipif(text_codec.zstandard is None, reason="zstandard غير مثبت")
+def test_zstd_header_and_dictionary():
+    samples = ["سؤال رقم %d عن الطقس والبرمجة والرياضة" % i for i in range(2000)]
+    text_codec.load_zstd_dictionary(text_codec.train_zstd_dictionary(samples, size=4096))
+    packed = compress_text(samples[7], 'zstd')
+    assert packed[0] == ZSTD
+    assert decompress_text(packed) == samples[7]
+
+def test_legacy_and_empty_values():
+    assert compress_text(None) is None
+    assert decompress_text(None) is None
+    assert decompress_text("نص قديم مخزن كـ TEXT") == "نص قديم مخزن كـ TEXT"
+    assert decompress_text(b"") == ""
+    assert decompress_text(memoryview(bytes([RAW]) + "مرحبا".encode('utf-8'))) == "مرحبا"
+
+def test_unknown_header_rejected():
+    with pytest.raises(ValueError):
+        decompress_text(bytes([0x7F]) + b"data")
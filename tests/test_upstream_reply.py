@@ -0,0 +1,93 @@
+import json
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from upstream_reply import PayloadTooLarge, ReplyExtractor
+
+TRICKY = 'quote " backslash \\ both \\" tail\\\\'
+
+# كل حمولة تُقارن بـ json.loads(...).get('response')
+PAYLOADS = [
+    b'{"response": "hello"}',
+    b'{ "model" : "x" , "response" : "spaced" , "done" : true }',
+    json.dumps({"response": TRICKY}).encode(),
+    json.dumps({"response": TRICKY + "\\"}).encode(),
+    json.dumps({"response": "مرحبا 😈 بك"}, ensure_ascii=False).encode(),
+    json.dumps({"response": "مرحبا 😈   بك"}).encode(),
+    json.dumps({"context": "}{][,:\"\\", "response": "after tricky string"}).encode(),
+    json.dumps({"meta": {"response": "nested", "list": [1, {"response": 2}, "]"]},
+                "response": "outer"}).encode(),
+    json.dumps({"responses": "near miss", "respons": 1, "response": "exact"}).encode(),
+    json.dumps({"a": 1, "response": "last field"}).encode(),
+    json.dumps({"response": 42, "done": True}).encode(),
+    json.dumps({"response": None}).encode(),
+    json.dumps({"response": {"text": "obj", "parts": [1, [2, {"x": "}"}]]}}).encode(),
+    json.dumps({"response": ["a", {"b": "c"}]}).encode(),
+    json.dumps({"done": True, "context": [1, 2, 3]}).encode(),
+    json.dumps({"response": ""}).encode(),
+]
+
+def feed_all(chunks, max_bytes=1024 * 1024):
+    extractor = ReplyExtractor('response', max_bytes)
+    for chunk in chunks:
+        extractor.feed(chunk)
+    return extractor.finish()
+
+def splits(payload):
+    """كل تقسيم إلى قطعتين وثلاث، ثم بايتاً بايتاً"""
+    n = len(payload)
+    yield [payload]
+    for i in range(n + 1):
+        yield [payload[:i], payload[i:]]
+    for i in range(1, n):
+        for j in range(i, n, max(1, n // 40)):
+            yield [payload[:i], payload[i:j], payload[j:]]
+    yield [payload[i:i + 1] for i in range(n)]
+
+@pytest.mark.parametrize('payload', PAYLOADS, ids=range(len(PAYLOADS)))
+def test_matches_json_loads_for_every_split(payload):
+    expected = json.loads(payload).get('response')
+    for chunks in splits(payload):
+        assert feed_all(chunks) == expected, chunks
+
+def test_size_counts_bytes_after_the_field():
+    payload = json.dumps({"response": "x", "context": list(range(100))}).encode()
+    extractor = ReplyExtractor('response', 1024)
+    for i in range(len(payload)):
+        extractor.feed(payload[i:i + 1])
+    assert extractor.size == len(payload)
+    assert extractor.finish() == "x"
+
+@pytest.mark.parametrize('limit', [1, 10, 20])
+def test_oversize_stops_at_the_crossing_chunk(limit):
+    payload = b'{"response": "0123456789abcdef"}'
+    extractor = ReplyExtractor('response', limit)
+    with pytest.raises(PayloadTooLarge) as raised:
+        for i in range(len(payload)):
+            extractor.feed(payload[i:i + 1])
+    assert raised.value.size == limit + 1
+    assert raised.value.limit == limit
+
+def test_declared_length_rejected_before_reading():
+    extractor = ReplyExtractor('response', 100)
+    extractor.check_length(None)
+    extractor.check_length('100')
+    with pytest.raises(PayloadTooLarge):
+        extractor.check_length('101')
+
+@pytest.mark.parametrize('payload', [b'[1, 2]', b'"text"', b'  [{"response": "x"}]'])
+def test_non_object_rejected(payload):
+    with pytest.raises(ValueError):
+        feed_all([payload])
+
+def test_truncated_before_value_completes():
+    payload = json.dumps({"model": "x", "response": TRICKY}).encode()
+    end_of_value = payload.rindex(b'"') + 1
+    for cut in range(end_of_value):
+        with pytest.raises(ValueError):
+            feed_all([payload[:cut]])
@@ -0,0 +1,97 @@
+"""ضغط نصوص الرسائل والردود قبل تخزينها في web_messages.
+
+كل قيمة مضغوطة BLOB يبدأ ببايت يحدد الترميز:
+    0x00  نص UTF-8 بدون ضغط (عندما لا يوفر الضغط شيئاً)
+    0x01  zlib
+    0x02  zstd، مع قاموس مدرب إن وُجد (رقم القاموس داخل إطار zstd نفسه)
+
+القيم القديمة المخزنة كـ TEXT تُعاد كما هي، فلا يلزم ترحيل الجدول قبل التشغيل.
+zstd اختياري: يُستخدم فقط إن كانت حزمة zstandard مثبتة.
+"""
+import threading
+import zlib
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+RAW = 0
+ZLIB = 1
+ZSTD = 2
+
+_lock = threading.Lock()
+_zstd_dicts = {}
+_zstd_active_dict = None
+_local = threading.local()
+
+def available_codecs():
+    return ['none', 'zlib'] + (['zstd'] if zstandard is not None else [])
+
+def load_zstd_dictionary(data, activate=True):
+    """تسجيل قاموس zstd (بايتات) لفك الضغط، واستخدامه للضغط إن طُلب"""
+    global _zstd_active_dict
+    if zstandard is None:
+        return None
+    zdict = zstandard.ZstdCompressionDict(data)
+    with _lock:
+        _zstd_dicts[zdict.dict_id()] = zdict
+        if activate:
+            _zstd_active_dict = zdict
+    return zdict.dict_id()
+
+def train_zstd_dictionary(samples, size=16384):
+    """تدريب قاموس zstd من عينات نصية وإعادة بايتاته"""
+    if zstandard is None:
+        raise RuntimeError("zstandard غير مثبت")
+    encoded = [s.encode('utf-8') for s in samples if s]
+    return zstandard.train_dictionary(size, encoded).as_bytes()
+
+def _zstd_compressor(level):
+    # ZstdCompressor ليس آمناً بين الخيوط، فيُحفظ واحد لكل خيط ولكل قاموس
+    cache = getattr(_local, 'compressors', None)
+    if cache is None:
+        cache = _local.compressors = {}
+    key = (level, id(_zstd_active_dict))
+    compressor = cache.get(key)
+    if compressor is None:
+        compressor = cache[key] = zstandard.ZstdCompressor(level=level, dict_data=_zstd_active_dict)
+    return compressor
+
+def _zstd_decompress(payload):
+    dict_id = zstandard.get_frame_parameters(payload).dict_id
+    zdict = _zstd_dicts.get(dict_id) if dict_id else None
+    return zstandard.ZstdDecompressor(dict_data=zdict).decompress(payload)
+
+def compress_text(text, codec='zlib', level=6):
+    """ترميز نص إلى BLOB بترويسة الترميز"""
+    if text is None:
+        return None
+    raw = text.encode('utf-8')
+    if codec == 'zstd' and zstandard is not None:
+        packed = bytes([ZSTD]) + _zstd_compressor(level).compress(raw)
+    elif codec in ('zlib', 'zstd'):
+        packed = bytes([ZLIB]) + zlib.compress(raw, level)
+    else:
+        packed = None
+    if packed is None or len(packed) >= len(raw) + 1:
+        return bytes([RAW]) + raw
+    return packed
+
+def decompress_text(value):
+    """فك ترميز قيمة من web_messages؛ النصوص القديمة تُعاد كما هي"""
+    if value is None or isinstance(value, str):
+        return value
+    value = bytes(value)
+    if not value:
+        return ''
+    header, payload = value[0], value[1:]
+    if header == RAW:
+        return payload.decode('utf-8')
+    if header == ZLIB:
+        return zlib.decompress(payload).decode('utf-8')
+    if header == ZSTD:
+        if zstandard is None:
+            raise RuntimeError("قيمة مضغوطة بـ zstd لكن zstandard غير مثبت")
+        return _zstd_decompress(payload).decode('utf-8')
+    raise ValueError(f"ترميز غير معروف: {header}")
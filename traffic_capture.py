@@ -0,0 +1,210 @@
+"""تسجيل حركة /api/chat و/api/verify-code و/webhook وزمن خادم الذكاء في JSONL لإعادة تشغيلها.
+
+    CAPTURE_PATH=captures/traffic.jsonl CAPTURE_SAMPLE=0.1 gunicorn app:app -c gunicorn.conf.py
+    python benchmarks/replay.py captures/traffic.jsonl --speed 2
+
+كل سطر حدث واحد فيه "t" (وقت الوصول بالثواني) و"kind":
+
+    chat      {"session", "message", "idempotency_key", "status", "ms"}
+    verify    {"code", "status", "ms"}
+    webhook   {"chat", "update", "status", "ms"}
+    upstream  {"prompt", "ms", "outcome", "reply_len"}
+
+التنقية قبل الكتابة:
+- المعرفات (الجلسة، الرمز، المحادثة، المستخدم، Idempotency-Key) تُستبدل ببصمة
+  HMAC ثابتة؛ نفس القيمة تعطي نفس البصمة في كل العمال، والأرقام تبقى أرقاماً.
+- النصوص تُستبدل بنص بديل بنفس الطول مشتق من بصمة النص، فيبقى تكرار الأسئلة
+  وأطوالها كما هي. أوامر تلغرام تحتفظ بكلمة الأمر فقط.
+- الأسماء تصبح "user"، وتُحذف أرقام الهواتف والروابط ومعرفات الملفات.
+
+التسجيل لا يحجب الطلب: الأحداث تمر بطابور محدود يكتبه خيط خلفي بإلحاق
+(O_APPEND) إلى ملف واحد، وتُسقط ويُعد عددها عند امتلائه أو عند بلوغ `max_bytes`.
+العينة (`sample`) تؤخذ لكل جلسة أو محادثة كاملة حتى يبقى ترتيبها قابلاً لإعادة التشغيل.
+"""
+import atexit
+import hashlib
+import hmac
+import json
+import os
+import queue
+import threading
+import time
+
+_ID_PARENTS = frozenset(('chat', 'from', 'user', 'sender_chat', 'forward_from', 'forward_from_chat',
+                         'via_bot', 'new_chat_member', 'left_chat_member', 'old_chat_member'))
+_TEXT_FIELDS = frozenset(('text', 'caption', 'data', 'query', 'question', 'explanation'))
+_NAME_FIELDS = frozenset(('first_name', 'last_name', 'title'))
+_DROP_FIELDS = frozenset(('username', 'phone_number', 'email', 'url', 'bio', 'description',
+                          'invite_link', 'file_id', 'file_unique_id', 'vcard', 'location', 'venue'))
+
+class TrafficRecorder:
+    def __init__(self, path, key, sample=1.0, max_bytes=512 * 1024 * 1024, queue_size=10000):
+        self.path = path
+        self.key = key if isinstance(key, bytes) else key.encode('utf-8')
+        self.sample = sample
+        self.max_bytes = max_bytes
+        self.queue_size = queue_size
+        self.written = 0
+        self.dropped = 0
+        self._pid = None
+        self._queue = None
+        self._thread = None
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self):
+        return bool(self.path) and self.sample > 0
+
+    def _digest(self, value):
+        return hmac.new(self.key, str(value).encode('utf-8'), hashlib.sha256).hexdigest()
+
+    def token(self, value):
+        """بصمة نصية ثابتة لمعرف (تصلح كـ session_id وIdempotency-Key)"""
+        return None if value is None else self._digest(value)[:24]
+
+    def number(self, value):
+        """بصمة رقمية لمعرف تلغرام مع الحفاظ على الإشارة (المجموعات سالبة)"""
+        if not isinstance(value, int):
+            return value
+        pseudo = int(self._digest(abs(value))[:12], 16) or 1
+        return -pseudo if value < 0 else pseudo
+
+    def text(self, value):
+        """نص بديل بنفس الطول؛ النصوص المتطابقة تعطي نفس البديل"""
+        if not isinstance(value, str) or not value:
+            return value
+        stub = 'q' + self._digest(value)[:15]
+        return (stub + 'x' * max(0, len(value) - len(stub)))[:len(value)]
+
+    def command(self, value):
+        if isinstance(value, str) and value.startswith('/'):
+            head, _, rest = value.partition(' ')
+            return f"{head} {self.text(rest)}" if rest else head
+        return self.text(value)
+
+    def sanitize_update(self, obj, parent=None):
+        if isinstance(obj, list):
+            return [self.sanitize_update(item, parent) for item in obj]
+        if not isinstance(obj, dict):
+            return obj
+        clean = {}
+        for key, value in obj.items():
+            if key in _DROP_FIELDS:
+                continue
+            if key == 'id' and parent in _ID_PARENTS:
+                clean[key] = self.number(value)
+            elif key in ('user_id', 'chat_id'):
+                clean[key] = self.number(value)
+            elif key == 'text':
+                clean[key] = self.command(value)
+            elif key in _TEXT_FIELDS:
+                clean[key] = self.text(value)
+            elif key in _NAME_FIELDS:
+                clean[key] = 'user' if key == 'first_name' else None
+            else:
+                clean[key] = self.sanitize_update(value, key)
+        return clean
+
+    def sampled(self, identity):
+        if self.sample >= 1:
+            return True
+        return int(self._digest(identity)[:8], 16) / 0xFFFFFFFF < self.sample
+
+    def _ensure_writer(self):
+        # خيط الكتابة لا ينتقل مع fork؛ كل عامل ينشئ طابوره وخيطه
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._queue = queue.Queue(maxsize=self.queue_size)
+            self._thread = threading.Thread(target=self._write_loop, args=(self._queue,), daemon=True)
+            self._thread.start()
+            self._pid = os.getpid()
+            atexit.register(self.close)
+
+    def _write_loop(self, events):
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        fd = os.open(self.path, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o600)
+        closing = False
+        while not closing:
+            lines = [events.get()]
+            while len(lines) < 500:
+                try:
+                    lines.append(events.get_nowait())
+                except queue.Empty:
+                    break
+            if None in lines:
+                closing = True
+                lines = [line for line in lines if line is not None]
+            if os.fstat(fd).st_size >= self.max_bytes:
+                self.dropped += len(lines)
+                continue
+            if lines:
+                os.write(fd, ''.join(lines).encode('utf-8'))
+                self.written += len(lines)
+        os.close(fd)
+
+    def emit(self, kind, at=None, **fields):
+        if not self.enabled:
+            return
+        self._ensure_writer()
+        event = {"t": round(at if at is not None else time.time(), 4), "kind": kind, **fields}
+        try:
+            self._queue.put_nowait(json.dumps(event, ensure_ascii=False, separators=(',', ':')) + "\n")
+        except queue.Full:
+            self.dropped += 1
+
+    def record_http(self, path, data, headers, status, at, duration):
+        """حدث طلب HTTP بعد تنقيته؛ `headers` قاموس بمفاتيح صغيرة"""
+        if not self.enabled or not isinstance(data, dict):
+            return
+        ms = round(duration * 1000, 2)
+        if path == '/api/chat':
+            session = data.get('session_id')
+            if self.sampled(f"s:{session}"):
+                message = data.get('message')
+                self.emit("chat", at, session=self.token(session),
+                          message=self.text(message.strip()) if isinstance(message, str) else None,
+                          idempotency_key=self.token(headers.get('idempotency-key')), status=status, ms=ms)
+        elif path == '/api/verify-code':
+            code = data.get('code')
+            if self.sampled(f"c:{code}"):
+                self.emit("verify", at, code=self.token(code.strip() if isinstance(code, str) else code),
+                          status=status, ms=ms)
+        elif path == '/webhook':
+            chat = _update_chat(data)
+            if self.sampled(f"u:{chat}"):
+                self.emit("webhook", at, chat=self.number(chat) if isinstance(chat, int) else None,
+                          update=self.sanitize_update(data), status=status, ms=ms)
+
+    def record_upstream(self, prompt, duration, outcome, reply_len=0):
+        if self.enabled:
+            self.emit("upstream", time.time() - duration, prompt=self.text(prompt),
+                      ms=round(duration * 1000, 2), outcome=outcome, reply_len=reply_len)
+
+    def close(self, timeout=2.0):
+        """كتابة ما في الطابور عند خروج العامل"""
+        if self._pid != os.getpid():
+            return
+        try:
+            self._queue.put(None, timeout=timeout)
+        except queue.Full:
+            return
+        self._thread.join(timeout)
+
+    def stats(self):
+        return {"enabled": self.enabled, "written": self.written, "dropped": self.dropped,
+                "queued": self._queue.qsize() if self._queue is not None and self._pid == os.getpid() else 0}
+
+def _update_chat(update):
+    for value in update.values():
+        if isinstance(value, dict):
+            chat = value.get('chat') or (value.get('message') or {}).get('chat')
+            if isinstance(chat, dict):
+                return chat.get('id')
+            if isinstance(value.get('from'), dict):
+                return value['from'].get('id')
+    return None
@@ -0,0 +1,219 @@
+"""استقبال تحديثات تلغرام بـ getUpdates (long polling) لبيئات بدون webhook عام.
+
+- طلب getUpdates واحد مفتوح حتى `timeout` ثانية ويعيد حتى `limit` تحديثاً.
+- كل دفعة تُكتب في جدول telegram_updates مع آخر update_id في telegram_offsets
+  في معاملة واحدة قبل طلب الدفعة التالية (الذي يؤكدها لتلغرام). التحديث يُحذف
+  من الجدول بعد انتهاء معالجته، وعند الإقلاع تُوزَّع التحديثات المتبقية أولاً؛
+  فلا يضيع تحديث عند التوقف ولا يُعاد ما اكتملت معالجته.
+- التوزيع على مجموعة خيوط محدودة مع الحفاظ على ترتيب رسائل كل محادثة: لكل
+  محادثة طابور، ولا يعالجها أكثر من خيط واحد في نفس الوقت. عند بلوغ
+  `max_pending` تحديثاً قيد المعالجة يتوقف الجلب حتى تفرغ أماكن.
+
+    poller = UpdatePoller(token, handle, db_path='bot_data.db')
+    poller.run()          # يحجب؛ poller.stop() من خيط آخر
+"""
+import collections
+import json
+import logging
+import queue
+import sqlite3
+import threading
+import time
+
+import requests
+
+logger = logging.getLogger('mobi.polling')
+
+_CHAT_FIELDS = ('message', 'edited_message', 'channel_post', 'edited_channel_post',
+                'business_message', 'edited_business_message')
+
+def update_chat_id(update):
+    """المفتاح الذي تُرتب معه معالجة التحديث: المحادثة، ثم المستخدم، ثم التحديث نفسه"""
+    for field in _CHAT_FIELDS:
+        if field in update:
+            return update[field]['chat']['id']
+    callback = update.get('callback_query')
+    if callback and callback.get('message'):
+        return callback['message']['chat']['id']
+    for value in update.values():
+        if isinstance(value, dict) and isinstance(value.get('from'), dict):
+            return value['from']['id']
+    return ('update', update['update_id'])
+
+class UpdatePoller:
+    def __init__(self, token, handle, db_path='bot_data.db', api_url='https://api.telegram.org',
+                 timeout=50, limit=100, workers=8, max_pending=None, allowed_updates=None):
+        self.token = token
+        self.handle = handle
+        self.db_path = db_path
+        self.api_url = api_url.rstrip('/')
+        self.timeout = timeout
+        self.limit = limit
+        self.workers = workers
+        self.max_pending = max_pending or workers * limit
+        self.allowed_updates = allowed_updates
+        self.bot_id = token.split(':', 1)[0]
+        self.session = requests.Session()
+        self._stop = threading.Event()
+        self._lock = threading.Condition()
+        self._chats = {}                     # chat -> deque من التحديثات بانتظار المعالجة
+        self._ready = queue.Queue()          # محادثات جاهزة لخيط فارغ
+        self._pending = 0
+        self._threads = []
+        self.stats = {"fetched": 0, "handled": 0, "errors": 0, "polls": 0, "recovered": 0}
+        self.last_update_id = self._init_db()
+
+    def _connect(self):
+        return sqlite3.connect(self.db_path, timeout=10, check_same_thread=False)
+
+    def _init_db(self):
+        conn = self._connect()
+        conn.execute('''CREATE TABLE IF NOT EXISTS telegram_offsets
+                        (bot_id TEXT PRIMARY KEY, last_update_id INTEGER, updated_at REAL)''')
+        conn.execute('''CREATE TABLE IF NOT EXISTS telegram_updates
+                        (bot_id TEXT, update_id INTEGER, payload TEXT, received_at REAL,
+                         PRIMARY KEY (bot_id, update_id))''')
+        row = conn.execute("SELECT last_update_id FROM telegram_offsets WHERE bot_id=?",
+                           (self.bot_id,)).fetchone()
+        conn.commit()
+        conn.close()
+        return row[0] if row else 0
+
+    def _store(self, updates):
+        """حفظ الدفعة والإزاحة ذرياً قبل أن يؤكدها طلب getUpdates التالي"""
+        now = time.time()
+        conn = self._connect()
+        try:
+            with conn:
+                conn.executemany("INSERT OR IGNORE INTO telegram_updates VALUES (?, ?, ?, ?)",
+                                 [(self.bot_id, u['update_id'], json.dumps(u, ensure_ascii=False), now)
+                                  for u in updates])
+                conn.execute("INSERT OR REPLACE INTO telegram_offsets VALUES (?, ?, ?)",
+                             (self.bot_id, updates[-1]['update_id'], now))
+        finally:
+            conn.close()
+
+    def _done(self, update_id):
+        conn = self._connect()
+        try:
+            with conn:
+                conn.execute("DELETE FROM telegram_updates WHERE bot_id=? AND update_id=?",
+                             (self.bot_id, update_id))
+        finally:
+            conn.close()
+
+    def _call(self, method, payload, read_timeout):
+        res = self.session.post(f"{self.api_url}/bot{self.token}/{method}", json=payload,
+                                timeout=(10, read_timeout))
+        data = res.json()
+        if not data.get('ok'):
+            raise RuntimeError(f"{method}: {data.get('error_code')} {data.get('description')}")
+        return data['result']
+
+    def _dispatch(self, updates):
+        with self._lock:
+            for update in updates:
+                chat = update_chat_id(update)
+                backlog = self._chats.get(chat)
+                if backlog is None:
+                    self._chats[chat] = collections.deque([update])
+                    self._ready.put(chat)
+                else:
+                    backlog.append(update)
+            self._pending += len(updates)
+
+    def _worker(self):
+        while True:
+            chat = self._ready.get()
+            if chat is None:
+                return
+            with self._lock:
+                update = self._chats[chat][0]
+            ok = True
+            try:
+                self.handle(update)
+            except Exception:
+                ok = False
+                logger.exception("update handler failed", extra={"fields": {"update_id": update['update_id']}})
+            try:
+                self._done(update['update_id'])
+            except Exception:
+                logger.exception("failed to mark update done")
+            with self._lock:
+                self.stats["handled" if ok else "errors"] += 1
+                backlog = self._chats[chat]
+                backlog.popleft()
+                if backlog:
+                    self._ready.put(chat)
+                else:
+                    del self._chats[chat]
+                self._pending -= 1
+                self._lock.notify_all()
+
+    def _recover(self):
+        """توزيع التحديثات التي حُفظت ولم تكتمل معالجتها قبل التوقف الأخير"""
+        conn = self._connect()
+        rows = conn.execute("SELECT payload FROM telegram_updates WHERE bot_id=? ORDER BY update_id",
+                            (self.bot_id,)).fetchall()
+        conn.close()
+        if rows:
+            self.stats["recovered"] = len(rows)
+            logger.info("recovering unfinished updates", extra={"fields": {"count": len(rows)}})
+            self._dispatch([json.loads(payload) for (payload,) in rows])
+
+    def run(self):
+        try:
+            self._call('deleteWebhook', {"drop_pending_updates": False}, 10)
+        except Exception as e:
+            logger.warning("deleteWebhook failed: %s", e)
+        self._threads = [threading.Thread(target=self._worker, daemon=True, name=f"poller-{i}")
+                         for i in range(self.workers)]
+        for t in self._threads:
+            t.start()
+        recovered = False
+        backoff = 1.0
+        while not self._stop.is_set():
+            try:
+                if not recovered:
+                    self._recover()
+                    recovered = True
+                self._poll_once()
+                backoff = 1.0
+            except Exception as e:
+                # خطأ الشبكة أو القاعدة (database is locked) لا يُنهي الاستقبال؛ التحديثات
+                # غير المخزنة تُجلب من جديد لأن الإزاحة لم تتقدم
+                logger.warning("polling iteration failed: %s", e)
+                self._stop.wait(backoff)
+                backoff = min(backoff * 2, 30.0)
+        self._shutdown()
+
+    def _poll_once(self):
+        with self._lock:
+            while self._pending >= self.max_pending and not self._stop.is_set():
+                self._lock.wait(1.0)
+        payload = {"offset": self.last_update_id + 1, "limit": self.limit, "timeout": self.timeout}
+        if self.allowed_updates is not None:
+            payload["allowed_updates"] = self.allowed_updates
+        updates = self._call('getUpdates', payload, self.timeout + 10)
+        self.stats["polls"] += 1
+        updates = [u for u in updates if u['update_id'] > self.last_update_id]
+        if not updates:
+            return
+        self._store(updates)
+        self.last_update_id = updates[-1]['update_id']
+        self.stats["fetched"] += len(updates)
+        self._dispatch(updates)
+
+    def _shutdown(self, grace=30.0):
+        # التحديثات التي لم تنته خلال المهلة تبقى في الجدول وتُعالج بعد الإقلاع
+        deadline = time.monotonic() + grace
+        with self._lock:
+            while self._pending and time.monotonic() < deadline:
+                self._lock.wait(1.0)
+        for _ in self._threads:
+            self._ready.put(None)
+
+    def stop(self):
+        self._stop.set()
+        with self._lock:
+            self._lock.notify_all()
@@ -0,0 +1,139 @@
+"""استخراج حقل الرد من جسم JSON لخادم الذكاء أثناء وصوله، بذاكرة محدودة.
+
+    extractor = ReplyExtractor('response', max_bytes=256 * 1024)
+    for chunk in ai_body_chunks(res, deadline):
+        extractor.feed(chunk)          # PayloadTooLarge عند تجاوز الحد
+    reply = extractor.finish()
+
+- لا يُحتفظ بالجسم كاملاً: يُتتبع العمق وحالة النصوص فقط، وتُجمع بايتات قيمة
+  الحقل المطلوب في المستوى الأول وحدها ثم تُفك بـ json.loads.
+- البايتات تُعد مع كل قطعة ويُرفع PayloadTooLarge فور تجاوز `max_bytes`، فيُقطع
+  الاتصال قبل قراءة الباقي. `check_length` يرفض Content-Length المعلن مسبقاً.
+- الفحص بنيوي وليس تحققاً كاملاً من صحة JSON: جسم ليس كائناً أو لم يكتمل يرفع
+  ValueError، وكائن مكتمل بدون الحقل يعيد None.
+"""
+import json
+import re
+
+_STRUCTURE = re.compile(rb'["{}\[\],:]')
+
+class PayloadTooLarge(ValueError):
+    def __init__(self, size, limit):
+        super().__init__(f"upstream payload exceeds {limit} bytes ({size})")
+        self.size = size
+        self.limit = limit
+
+class ReplyExtractor:
+    def __init__(self, field='response', max_bytes=256 * 1024):
+        self.field = field.encode('utf-8')
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.found = False
+        self.value = None
+        self._depth = 0
+        self._closed = False
+        self._in_string = False
+        self._escape = False
+        self._expect_key = False
+        self._key = None          # مفتاح المستوى الأول قيد القراءة
+        self._last_key = None     # آخر مفتاح مكتمل بانتظار ':'
+        self._capture = None      # قطع قيمة الحقل المطلوب
+
+    def check_length(self, declared):
+        """رفض Content-Length المعلن قبل قراءة الجسم"""
+        if declared is not None and int(declared) > self.max_bytes:
+            raise PayloadTooLarge(int(declared), self.max_bytes)
+
+    def feed(self, chunk):
+        """يعيد True بعد اكتمال قيمة الحقل؛ القطع اللاحقة تُعد فقط"""
+        self.size += len(chunk)
+        if self.size > self.max_bytes:
+            raise PayloadTooLarge(self.size, self.max_bytes)
+        if not self.found and not self._closed:
+            self._scan(chunk)
+        return self.found
+
+    def finish(self):
+        if self.found:
+            return self.value
+        if not self._closed:
+            raise ValueError("incomplete JSON object from upstream")
+        return None
+
+    def _string_end(self, chunk, pos):
+        """موضع علامة إغلاق النص الحالي في القطعة أو -1.
+
+        علامة التنصيص تُغلق النص إن سبقها عدد زوجي من الشرطات المائلة؛ زوجية
+        الشرطات في آخر القطعة تُحمل إلى القطعة التالية في `_escape`.
+        """
+        carry, self._escape = self._escape, False
+        while True:
+            quote = chunk.find(b'"', pos)
+            stop = len(chunk) if quote < 0 else quote
+            i = stop - 1
+            while i >= pos and chunk[i] == 0x5C:
+                i -= 1
+            escaped = (stop - 1 - i) & 1
+            if i < pos and carry:
+                escaped ^= 1
+            carry = False
+            if quote < 0:
+                self._escape = bool(escaped)
+                return -1
+            if not escaped:
+                return quote
+            pos = quote + 1
+
+    def _scan(self, chunk):
+        pos, end = 0, len(chunk)
+        start = 0 if self._capture is not None else None
+        while pos < end:
+            if self._in_string:
+                quote = self._string_end(chunk, pos)
+                stop = end if quote < 0 else quote
+                if self._key is not None and len(self._key) <= len(self.field):
+                    # مفتاح فيه تهريب لا يطابق الحقل أبداً
+                    self._key += chunk[pos:min(stop, pos + len(self.field) + 1)]
+                if quote < 0:
+                    break
+                self._in_string = False
+                if self._key is not None:
+                    self._last_key, self._key = bytes(self._key), None
+                pos = quote + 1
+                continue
+            match = _STRUCTURE.search(chunk, pos)
+            if match is None:
+                break
+            char = chunk[match.start()]
+            pos = match.end()
+            if self._depth == 0 and char != 0x7B:
+                raise ValueError("upstream reply is not a JSON object")
+            if start is not None and self._depth == 1 and char in b',}':
+                self._capture.append(chunk[start:match.start()])
+                self.value = json.loads(b''.join(self._capture))
+                self.found = True
+                self._capture = None
+                return
+            if char == 0x22:
+                self._in_string = True
+                if self._depth == 1 and self._expect_key:
+                    self._key = bytearray()
+                    self._expect_key = False
+            elif char in b'{[':
+                self._depth += 1
+                self._expect_key = self._depth == 1
+            elif char in b'}]':
+                self._depth -= 1
+                if self._depth == 0:
+                    self._closed = True
+                    return
+            elif self._depth == 1:
+                if char == 0x2C:
+                    self._expect_key = True
+                elif char == 0x3A:
+                    if self._last_key == self.field:
+                        self._capture = []
+                        start = pos
+                    self._last_key = None
+        if start is not None:
+            self._capture.append(chunk[start:])